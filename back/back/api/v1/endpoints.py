@@ -1,25 +1,418 @@
-from fastapi import APIRouter, Depends, Query
-from db.database import AsyncSessionLocal
-from crud.nodes import get_nodes_history, get_all_tagnames
-from schemas.nodes import NodeSchema, NodeShortSchema
-from typing import List, Optional
+from fastapi import APIRouter, Depends, Query, Header, Response, Request, HTTPException
+from fastapi.responses import StreamingResponse
+from db.database import get_db, get_pool_status, explain_sampler, set_statement_timeout, AsyncSessionLocal
+from crud.nodes import HistoryFilters, parse_fields, PROJECTABLE_FIELDS, get_nodes_history, get_history_rows, get_node_versions, get_nodes_downsampled, get_nodes_rollup, get_all_tagnames, iter_history_pages, EXPORT_COLUMNS
+from crud.node_cache import node_cache
+from crud.facets import get_facets, facets_cache_stats
+from crud.aligned import get_aligned, grid_size
+from crud.alarms import alarm_engine, get_alarm_rules, create_alarm_rule, delete_alarm_rule
+from crud.live import live_feed
+from crud.latest import latest_values
+from crud.hot_tier import hot_tier
+from crud.ingest import ingest_readings, parse_readings, IngestError, IngestBusyError, CONFLICT_POLICIES
+from core.serialization import dumps
+from core.arrow import ARROW_MEDIA_TYPE, wants_arrow, history_to_arrow, nested_to_arrow, aligned_to_arrow
+from core.alignment import FILL_POLICIES
+from core.http_cache import response_cache, make_etag, etag_matches, http_date, write_marks
+from core.admission import query_flights, query_limiter, QueryTimeoutError
+from schemas.nodes import NodeSchema, NodeShortSchema, DownsampledNodeSchema, RollupNodeSchema, IngestResultSchema, HistoryQuerySchema, FacetsSchema, AlignedSchema, AlarmRuleSchema, AlarmRuleOutSchema, AlarmSchema
+from core.config import settings
+from typing import List, Optional, Literal
 from datetime import datetime
+import asyncio
+import csv
+import io
+import json
+import uuid
 
 router = APIRouter()
 
-async def get_db():
-    async with AsyncSessionLocal() as session:
-        yield session
+def history_filters(
+    recordtype: Optional[List[str]] = Query(None, description="Типы записей, можно несколько"),
+    appid: Optional[List[uuid.UUID]] = Query(None, description="ID приложений, можно несколько"),
+    quality: Optional[List[int]] = Query(None, description="Значения качества, можно несколько")
+) -> Optional[HistoryFilters]:
+    return HistoryFilters.of(recordtype, appid, quality)
+
+def history_fields(
+    fields: Optional[List[str]] = Query(None, description=f"Поля записей через запятую: {', '.join(PROJECTABLE_FIELDS)}; value — значение по типу узла")
+) -> Optional[tuple]:
+    try:
+        return parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+async def _guarded(db, key, compute):
+    """
+    Тяжёлый запрос к БД: одинаковые одновременные запросы выполняются один раз,
+    остальные получают его результат; выполнение — через ограничитель
+    параллелизма и с таймаутом выражения.
+    """
+    async def run():
+        if query_limiter.saturated and db.in_transaction():
+            # Соединение, взятое до очереди (проверка версии), возвращается
+            # в пул на время ожидания слота: очередь не должна занимать пул
+            await db.rollback()
+        async with query_limiter.slot():
+            await set_statement_timeout(db, settings.DB_STATEMENT_TIMEOUT)
+            if settings.DB_STATEMENT_TIMEOUT <= 0:
+                return await compute()
+            try:
+                # Запас в секунду: в PostgreSQL выражение раньше отменит сама БД
+                return await asyncio.wait_for(compute(), settings.DB_STATEMENT_TIMEOUT + 1)
+            except asyncio.TimeoutError as e:
+                raise QueryTimeoutError("Query exceeded DB_STATEMENT_TIMEOUT") from e
+
+    if settings.COALESCE_ENABLED:
+        return await query_flights.do(key, run)
+    return await run()
+
+async def _history_response(db, nodeid, date_from, date_to, limit, arrow, if_none_match, filters=None, fields=None):
+    # Ответ меняется только с появлением или перезаписью записей, поэтому сначала
+    # проверяем время последней записи каждого узла и отвечаем 304 или телом из кэша
+    media_type = ARROW_MEDIA_TYPE if arrow else "application/json"
+    nodeids = tuple(sorted(set(nodeid))) if nodeid else None
+    key = (nodeids, date_from, date_to, limit, filters, fields, media_type)
+    # Недавний период числовых узлов отвечается из горячего слоя без запросов к БД
+    hot = settings.HOT_TIER_ENABLED and hot_tier.covers(nodeids, date_from, filters, fields)
+    if hot:
+        versions = hot_tier.node_versions(nodeids, date_from, date_to, filters)
+    else:
+        # Без фильтров версия берётся из таблицы последних значений; в БД — только при промахе
+        versions = latest_values.node_versions(nodeids, date_from, date_to) if settings.LATEST_ENABLED and filters is None else None
+        if versions is None:
+            versions = await get_node_versions(db, nodeids, date_from, date_to, filters)
+    etag = make_etag(key, (versions, write_marks(nodeids)))
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if versions:
+        headers["Last-Modified"] = http_date(max(time for _, time in versions))
+
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    cached = response_cache.get(key)
+    if cached and cached[0] == etag:
+        body = cached[1]
+    else:
+        if hot:
+            result = await hot_tier.get_history(db, nodeids, date_from, date_to, limit, filters, fields)
+            body = nested_to_arrow(result, "history") if arrow else dumps(result)
+        else:
+            async def compute():
+                if arrow and fields is None:
+                    return history_to_arrow(*await get_history_rows(db, nodeids, date_from, date_to, limit, filters))
+                if arrow:
+                    return nested_to_arrow(await get_nodes_history(db, nodeids, date_from, date_to, limit, filters, fields), "history")
+                return dumps(await get_nodes_history(db, nodeids, date_from, date_to, limit, filters, fields))
+
+            # ETag в ключе: результат объединяется только для одной версии данных
+            body = await _guarded(db, ("history", key, etag), compute)
+        response_cache.set(key, (etag, body))
+    return Response(content=body, media_type=media_type, headers=headers)
 
 @router.get("/data", response_model=List[NodeSchema])
 async def read_data(
     db=Depends(get_db),
+    nodeid: Optional[List[int]] = Query(None, description="ID узлов (node), можно несколько: nodeid=1&nodeid=2"),
+    date_from: Optional[datetime] = Query(None, description="Дата и время начала периода (ISO 8601)"),
+    date_to: Optional[datetime] = Query(None, description="Дата и время конца периода (ISO 8601)"),
+    limit: int = Query(settings.HISTORY_LIMIT, ge=1, le=settings.HISTORY_MAX_LIMIT, description="Количество последних записей на узел"),
+    filters: Optional[HistoryFilters] = Depends(history_filters),
+    fields: Optional[tuple] = Depends(history_fields),
+    if_none_match: Optional[str] = Header(None),
+    format: Optional[Literal["json", "arrow"]] = Query(None, description="Формат ответа: json или arrow (Arrow IPC stream)"),
+    accept: Optional[str] = Header(None)
+):
+    return await _history_response(db, nodeid, date_from, date_to, limit, wants_arrow(format, accept), if_none_match, filters, fields)
+
+@router.post("/data/query")
+async def query_data(
+    query: HistoryQuerySchema,
+    db=Depends(get_db),
+    if_none_match: Optional[str] = Header(None),
+    format: Optional[Literal["json", "arrow"]] = Query(None, description="Формат ответа: json или arrow (Arrow IPC stream)"),
+    accept: Optional[str] = Header(None)
+):
+    """История по набору узлов одним запросом к БД; с points/resolution — агрегаты."""
+    arrow = wants_arrow(format, accept)
+    filters = HistoryFilters.of(query.recordtype, query.appid, query.quality)
+    if query.points is None and query.resolution is None:
+        try:
+            fields = parse_fields(query.fields)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        return await _history_response(db, query.nodeids, query.date_from, query.date_to, query.limit, arrow, if_none_match, filters, fields)
+    points = query.points or settings.DOWNSAMPLE_POINTS
+    nodeids = tuple(sorted(set(query.nodeids))) if query.nodeids else None
+    result = await _guarded(
+        db, ("rollup", nodeids, query.date_from, query.date_to, points, query.resolution, filters),
+        lambda: get_nodes_rollup(db, query.nodeids, query.date_from, query.date_to, points, query.resolution, filters)
+    )
+    if arrow:
+        return Response(content=nested_to_arrow(result, "points"), media_type=ARROW_MEDIA_TYPE)
+    return Response(content=dumps(result), media_type="application/json")
+
+@router.get("/data/downsampled", response_model=List[DownsampledNodeSchema])
+async def read_downsampled_data(
+    db=Depends(get_db),
+    nodeid: Optional[List[int]] = Query(None, description="ID узлов (node), можно несколько"),
+    date_from: Optional[datetime] = Query(None, description="Дата и время начала периода (ISO 8601)"),
+    date_to: Optional[datetime] = Query(None, description="Дата и время конца периода (ISO 8601)"),
+    points: int = Query(settings.DOWNSAMPLE_POINTS, ge=3, le=settings.DOWNSAMPLE_MAX_POINTS, description="Количество точек на узел"),
+    method: Literal["buckets", "lttb"] = Query("buckets", description="buckets — min/max/avg по корзинам, lttb — Largest-Triangle-Three-Buckets"),
+    filters: Optional[HistoryFilters] = Depends(history_filters),
+    format: Optional[Literal["json", "arrow"]] = Query(None, description="Формат ответа: json или arrow (Arrow IPC stream)"),
+    accept: Optional[str] = Header(None)
+):
+    result = await _guarded(
+        db, ("downsampled", tuple(sorted(set(nodeid))) if nodeid else None, date_from, date_to, points, method, filters),
+        lambda: get_nodes_downsampled(db, nodeid, date_from, date_to, points, method, filters)
+    )
+    if wants_arrow(format, accept):
+        return Response(content=nested_to_arrow(result, "points"), media_type=ARROW_MEDIA_TYPE)
+    return result
+
+@router.get("/data/rollup", response_model=List[RollupNodeSchema])
+async def read_rollup_data(
+    db=Depends(get_db),
+    nodeid: Optional[List[int]] = Query(None, description="ID узлов (node), можно несколько"),
+    date_from: Optional[datetime] = Query(None, description="Дата и время начала периода (ISO 8601)"),
+    date_to: Optional[datetime] = Query(None, description="Дата и время конца периода (ISO 8601)"),
+    points: int = Query(settings.DOWNSAMPLE_POINTS, ge=3, le=settings.DOWNSAMPLE_MAX_POINTS, description="Желаемое количество точек на узел"),
+    resolution: Optional[float] = Query(None, gt=0, description="Желаемое разрешение в секундах"),
+    filters: Optional[HistoryFilters] = Depends(history_filters),
+    format: Optional[Literal["json", "arrow"]] = Query(None, description="Формат ответа: json или arrow (Arrow IPC stream)"),
+    accept: Optional[str] = Header(None)
+):
+    result = await _guarded(
+        db, ("rollup", tuple(sorted(set(nodeid))) if nodeid else None, date_from, date_to, points, resolution, filters),
+        lambda: get_nodes_rollup(db, nodeid, date_from, date_to, points, resolution, filters)
+    )
+    if wants_arrow(format, accept):
+        return Response(content=nested_to_arrow(result, "points"), media_type=ARROW_MEDIA_TYPE)
+    return result
+
+@router.get("/aligned", response_model=AlignedSchema)
+async def read_aligned_data(
+    db=Depends(get_db),
+    nodeid: List[int] = Query(..., description="ID узлов (node): nodeid=1&nodeid=2"),
+    date_from: datetime = Query(..., description="Дата и время начала периода (ISO 8601)"),
+    date_to: datetime = Query(..., description="Дата и время конца периода (ISO 8601)"),
+    step: float = Query(..., gt=0, description="Шаг сетки в секундах"),
+    fill: Literal[FILL_POLICIES] = Query("locf", description="locf — последнее известное значение, linear — линейная интерполяция, average — среднее по корзине шага"),
+    filters: Optional[HistoryFilters] = Depends(history_filters),
+    format: Optional[Literal["json", "arrow"]] = Query(None, description="Формат ответа: json или arrow (Arrow IPC stream)"),
+    accept: Optional[str] = Header(None)
+):
+    """Значения нескольких узлов на общей сетке времени, по столбцам."""
+    if date_to < date_from:
+        raise HTTPException(status_code=422, detail="date_to must not be earlier than date_from")
+    if len(set(nodeid)) > settings.ALIGNED_MAX_NODES:
+        raise HTTPException(status_code=422, detail=f"At most {settings.ALIGNED_MAX_NODES} nodes can be aligned")
+    if grid_size(date_from, date_to, step) > settings.ALIGNED_MAX_POINTS:
+        raise HTTPException(status_code=422, detail=f"Grid exceeds {settings.ALIGNED_MAX_POINTS} points, increase step")
+    result = await _guarded(
+        db, ("aligned", tuple(nodeid), date_from, date_to, step, fill, filters),
+        lambda: get_aligned(db, nodeid, date_from, date_to, step, fill, filters)
+    )
+    if wants_arrow(format, accept):
+        return Response(content=aligned_to_arrow(result), media_type=ARROW_MEDIA_TYPE)
+    return Response(content=dumps(result), media_type="application/json")
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if value is None or isinstance(value, (int, float, bool, str)):
+        return value
+    return str(value)
+
+async def _export_stream(nodeid, date_from, date_to, format, filters=None):
+    # Сессия открывается внутри генератора: зависимость get_db закрывается
+    # раньше, чем StreamingResponse успевает отдать тело ответа
+    async with AsyncSessionLocal() as session:
+        if format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+            yield buffer.getvalue()
+        async for rows in iter_history_pages(session, nodeid, date_from, date_to, filters=filters):
+            if format == "csv":
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows([_export_value(value) for value in row] for row in rows)
+                yield buffer.getvalue()
+            else:
+                yield "".join(
+                    json.dumps(dict(zip(EXPORT_COLUMNS, map(_export_value, row))), ensure_ascii=False) + "\n"
+                    for row in rows
+                )
+
+@router.get("/data/export")
+async def export_data(
     nodeid: Optional[int] = Query(None, description="ID узла (node)"),
     date_from: Optional[datetime] = Query(None, description="Дата и время начала периода (ISO 8601)"),
+    date_to: Optional[datetime] = Query(None, description="Дата и время конца периода (ISO 8601)"),
+    format: Literal["ndjson", "csv"] = Query("ndjson", description="Формат выгрузки"),
+    filters: Optional[HistoryFilters] = Depends(history_filters)
+):
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"nodes_history_{nodeid or 'all'}.{format}"
+    return StreamingResponse(
+        _export_stream(nodeid, date_from, date_to, format, filters),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.get("/stream")
+async def stream_updates(
+    request: Request,
+    nodeid: Optional[List[int]] = Query(None, description="ID узлов; без параметра — все узлы")
+):
+    """Server-Sent Events: новые записи истории по выбранным узлам."""
+    subscription = live_feed.subscribe(nodeid)
+
+    async def events():
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    batch = await asyncio.wait_for(subscription.queue.get(), timeout=settings.LIVE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield b"event: history\ndata: " + dumps(batch) + b"\n\n"
+        finally:
+            live_feed.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/stream/stats")
+async def read_stream_stats():
+    return live_feed.stats()
+
+@router.post("/ingest", response_model=IngestResultSchema)
+async def ingest_data(
+    request: Request,
+    db=Depends(get_db),
+    on_conflict: Literal[CONFLICT_POLICIES] = Query("ignore", description="Действие при совпадении (nodeid, time): ignore, update или error"),
+    create_nodes: bool = Query(False, description="Создавать отсутствующие узлы")
+):
+    """Пакетная загрузка показаний: JSON-массив, NDJSON (application/x-ndjson) или CSV (text/csv)."""
+    try:
+        readings = parse_readings(await request.body(), request.headers.get("content-type"))
+        return await ingest_readings(db, readings, on_conflict, create_nodes)
+    except IngestError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IngestBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@router.get("/latest")
+async def read_latest(
+    db=Depends(get_db),
+    nodeid: Optional[List[int]] = Query(None, description="ID узлов; без параметра — все узлы"),
+    appid: Optional[List[uuid.UUID]] = Query(None, description="ID приложений"),
+    quality: Optional[List[int]] = Query(None, description="Значения качества")
+):
+    """Текущее значение и качество каждого тега из таблицы последних значений в памяти."""
+    if not latest_values.warmed:
+        await latest_values.warm(db)
+    await latest_values.fill_tagnames(db)
+    if not (nodeid or appid or quality):
+        body = latest_values.snapshot()
+    else:
+        body = dumps(latest_values.query(nodeid, appid, quality))
+    return Response(content=body, media_type="application/json")
+
+@router.get("/latest/stats")
+async def read_latest_stats():
+    return latest_values.stats()
+
+@router.get("/alarms", response_model=List[AlarmSchema])
+async def read_alarms(
+    db=Depends(get_db),
+    nodeid: Optional[List[int]] = Query(None, description="ID узлов"),
+    severity: Optional[List[str]] = Query(None, description="Уровни важности")
+):
+    """Активные тревоги из памяти движка правил, без запросов к истории."""
+    await alarm_engine.fill_tagnames(db)
+    if not (nodeid or severity):
+        body = alarm_engine.snapshot()
+    else:
+        body = dumps(alarm_engine.query(nodeid, severity))
+    return Response(content=body, media_type="application/json")
+
+@router.get("/alarms/events")
+async def read_alarm_events(limit: int = Query(100, ge=1, le=settings.ALARM_EVENTS_KEEP, description="Количество последних событий")):
+    """Последние срабатывания и снятия тревог, новые первыми."""
+    events = list(alarm_engine.events)[-limit:]
+    return Response(content=dumps(events[::-1]), media_type="application/json")
+
+@router.get("/alarms/stats")
+async def read_alarm_stats():
+    return alarm_engine.stats()
+
+@router.get("/alarms/rules", response_model=List[AlarmRuleOutSchema])
+async def read_alarm_rules(db=Depends(get_db)):
+    return await get_alarm_rules(db)
+
+@router.post("/alarms/rules", response_model=AlarmRuleOutSchema, status_code=201)
+async def add_alarm_rule(rule: AlarmRuleSchema, db=Depends(get_db)):
+    return await create_alarm_rule(db, rule.model_dump())
+
+@router.delete("/alarms/rules/{rule_id}", status_code=204)
+async def remove_alarm_rule(rule_id: int, db=Depends(get_db)):
+    if not await delete_alarm_rule(db, rule_id):
+        raise HTTPException(status_code=404, detail="Alarm rule not found")
+    return Response(status_code=204)
+
+@router.get("/facets", response_model=FacetsSchema)
+async def read_facets(
+    db=Depends(get_db),
+    nodeid: Optional[List[int]] = Query(None, description="ID узлов; без параметра — все узлы"),
+    date_from: Optional[datetime] = Query(None, description="Дата и время начала периода (ISO 8601)"),
     date_to: Optional[datetime] = Query(None, description="Дата и время конца периода (ISO 8601)")
 ):
-    return await get_nodes_history(db, nodeid, date_from, date_to)
+    """Различные значения recordtype, appid и quality для фильтров без выгрузки истории."""
+    return await get_facets(db, nodeid, date_from, date_to)
 
 @router.get("/tagnames", response_model=List[NodeShortSchema])
 async def get_tagnames(db=Depends(get_db)):
     return await get_all_tagnames(db)
+
+@router.get("/cache/nodes")
+async def read_node_cache_stats():
+    return node_cache.stats()
+
+@router.post("/cache/nodes/invalidate")
+async def invalidate_node_cache(nodeid: Optional[int] = Query(None, description="ID узла; без параметра сбрасывается весь кэш")):
+    node_cache.invalidate(nodeid)
+    return node_cache.stats()
+
+@router.get("/cache/responses")
+async def read_response_cache_stats():
+    return response_cache.stats()
+
+@router.get("/cache/hot")
+async def read_hot_tier_stats():
+    return hot_tier.stats()
+
+@router.get("/cache/facets")
+async def read_facets_cache_stats():
+    return facets_cache_stats()
+
+@router.get("/db/pool")
+async def read_pool_status():
+    return get_pool_status()
+
+@router.get("/db/admission")
+async def read_admission_stats():
+    return {"limiter": query_limiter.stats(), "coalescing": query_flights.stats()}
+
+@router.get("/db/explain")
+async def read_explain_samples():
+    """Последние планы EXPLAIN ANALYZE для выборки медленных запросов."""
+    return Response(content=dumps(explain_sampler.snapshot()), media_type="application/json")
@@ -0,0 +1,122 @@
+"""
+Микробенчмарк сериализации /api/v1/data: строк в секунду для прежнего пути
+(ORM-объекты -> словари с isoformat() -> проверка List[NodeSchema] -> JSON)
+и нового (кортежи Core -> словари -> orjson).
+
+Запуск из каталога back/back:
+    python -m benchmarks.bench_serialization --nodes 100 --rows-per-node 500
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import List
+
+from pydantic import TypeAdapter
+from sqlalchemy import select, desc, func
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker, aliased
+
+from db.models import SensorData
+from crud.nodes import latest_history_query, group_history
+from core.serialization import dumps
+from schemas.nodes import NodeSchema
+from benchmarks.bench_nodes_history import seed, legacy_history_item
+
+_nodes_adapter = TypeAdapter(List[NodeSchema])
+
+
+async def legacy_path(session, nodes: dict, limit: int) -> bytes:
+    # Тот же оконный запрос, но с загрузкой ORM-объектов SensorData
+    rn = func.row_number().over(partition_by=SensorData.nodeid, order_by=desc(SensorData.time)).label("rn")
+    subquery = select(SensorData, rn).subquery()
+    history_alias = aliased(SensorData, subquery)
+    items = (await session.execute(
+        select(history_alias)
+        .where(subquery.c.rn <= limit)
+        .order_by(history_alias.nodeid, desc(history_alias.time))
+    )).scalars().all()
+    grouped = {}
+    for item in items:
+        grouped.setdefault(item.nodeid, []).append(legacy_history_item(item))
+    result = [
+        {"nodeid": nodeid, "tagname": nodes[nodeid]["tagname"], "history": history}
+        for nodeid, history in grouped.items()
+    ]
+    # Повторная проверка FastAPI по response_model и стандартный JSON-кодировщик
+    validated = _nodes_adapter.validate_python(result)
+    return _nodes_adapter.dump_json(validated)
+
+
+async def fast_path(session, nodes: dict, limit: int) -> bytes:
+    rows = (await session.execute(latest_history_query(limit=limit, dialect_name=session.bind.dialect.name))).all()
+    return dumps(group_history(rows, nodes))
+
+
+async def measure(Session, func, nodes: dict, limit: int, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        async with Session() as session:
+            started = time.perf_counter()
+            body = await func(session, nodes, limit)
+            timings.append(time.perf_counter() - started)
+    return min(timings), len(body)
+
+
+def measure_encoding(result: list, repeat: int):
+    """Только сериализация уже сгруппированных данных."""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        _nodes_adapter.dump_json(_nodes_adapter.validate_python(result))
+    legacy = (time.perf_counter() - started) / repeat
+    started = time.perf_counter()
+    for _ in range(repeat):
+        dumps(result)
+    fast = (time.perf_counter() - started) / repeat
+    return legacy, fast
+
+
+async def main(url: str, node_count: int, rows_per_node: int, limit: int, repeat: int):
+    engine = create_async_engine(url)
+    Session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    try:
+        await seed(engine, node_count, rows_per_node)
+        nodes = {i: {"tagname": f"TAG_{i:05d}"} for i in range(1, node_count + 1)}
+        rows = node_count * min(limit, rows_per_node)
+
+        legacy_time, legacy_size = await measure(Session, legacy_path, nodes, limit, repeat)
+        fast_time, fast_size = await measure(Session, fast_path, nodes, limit, repeat)
+
+        async with Session() as session:
+            result = group_history((await session.execute(latest_history_query(limit=limit, dialect_name=session.bind.dialect.name))).all(), nodes)
+        legacy_encode, fast_encode = measure_encoding(result, repeat)
+    finally:
+        await engine.dispose()
+
+    results = {
+        "rows": rows,
+        "end_to_end": {
+            "legacy_rows_per_s": round(rows / legacy_time),
+            "fast_rows_per_s": round(rows / fast_time),
+            "legacy_bytes": legacy_size,
+            "fast_bytes": fast_size,
+        },
+        "encoding_only": {
+            "legacy_rows_per_s": round(rows / legacy_encode),
+            "fast_rows_per_s": round(rows / fast_encode),
+        },
+    }
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="sqlite+aiosqlite:///bench_serialization.db")
+    parser.add_argument("--nodes", type=int, default=100)
+    parser.add_argument("--rows-per-node", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.url, args.nodes, args.rows_per_node, args.limit, args.repeat))
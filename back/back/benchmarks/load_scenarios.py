@@ -0,0 +1,261 @@
+"""
+Сценарии нагрузки на /api/v1/data и /api/v1/tagnames.
+
+Сценарии:
+  single_node        — история одного случайного узла;
+  all_nodes          — последние записи всех узлов;
+  long_range         — прореживание всего периода и длинная выборка по одному узлу;
+  tagnames           — список тегов;
+  concurrent_pollers — N клиентов опрашивают /data с If-None-Match, как дашборды.
+
+Для каждого сценария: число запросов и ошибок, пропускная способность,
+p50/p95/p99 задержки, объём ответов и число запросов к БД на HTTP-запрос
+(по разнице счётчиков /metrics). Результаты с хешем коммита пишутся в JSON,
+чтобы сравнивать производительность между коммитами.
+
+По умолчанию приложение запускается в процессе (DATABASE_URL берётся из
+окружения, как у сервера); --base-url направляет нагрузку на запущенный сервер.
+
+Запуск из каталога back/back:
+    DATABASE_URL=sqlite+aiosqlite:///bench_data.db python -m benchmarks.load_scenarios --generate --json results.json
+    python -m benchmarks.load_scenarios --base-url http://localhost:8000 --pollers 50 --seconds 30
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import subprocess
+import time
+from datetime import datetime
+from typing import Callable, List, Optional
+
+import httpx
+
+from benchmarks import generator as data_generator
+
+API = "/api/v1"
+
+_DB_QUERIES = re.compile(r"^http_request_db_queries_sum\{[^}]*\} (\S+)$", re.MULTILINE)
+
+
+def percentile(sorted_values: List[float], share: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(int(round(share * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class ScenarioResult:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+        self.not_modified = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.db_queries = None
+
+    def observe(self, response: httpx.Response, seconds: float):
+        self.latencies.append(seconds)
+        self.bytes += len(response.content)
+        if response.status_code == 304:
+            self.not_modified += 1
+        elif response.status_code >= 400:
+            self.errors += 1
+
+    def to_dict(self) -> dict:
+        latencies = sorted(self.latencies)
+        requests = len(latencies)
+
+        def ms(value):
+            return round(value * 1000, 3) if value is not None else None
+
+        return {
+            "scenario": self.name,
+            "requests": requests,
+            "errors": self.errors,
+            "not_modified": self.not_modified,
+            "seconds": round(self.seconds, 3),
+            "throughput_rps": round(requests / self.seconds, 2) if self.seconds else None,
+            "p50_ms": ms(percentile(latencies, 0.50)),
+            "p95_ms": ms(percentile(latencies, 0.95)),
+            "p99_ms": ms(percentile(latencies, 0.99)),
+            "mean_ms": ms(sum(latencies) / requests) if requests else None,
+            "bytes_per_request": round(self.bytes / requests) if requests else None,
+            "db_queries_per_request": round(self.db_queries / requests, 2) if requests and self.db_queries is not None else None,
+        }
+
+
+async def _db_queries(client: httpx.AsyncClient) -> Optional[float]:
+    """Сумма запросов к БД по всем маршрутам из /metrics; None, если метрики выключены."""
+    response = await client.get("/metrics")
+    if response.status_code != 200:
+        return None
+    return sum(float(value) for value in _DB_QUERIES.findall(response.text))
+
+
+async def run_sequential(client, name: str, make_request: Callable, requests: int) -> dict:
+    result = ScenarioResult(name)
+    before = await _db_queries(client)
+    started = time.perf_counter()
+    for _ in range(requests):
+        method, url, params, headers = make_request()
+        request_started = time.perf_counter()
+        response = await client.request(method, url, params=params, headers=headers)
+        result.observe(response, time.perf_counter() - request_started)
+    result.seconds = time.perf_counter() - started
+    after = await _db_queries(client)
+    if before is not None and after is not None:
+        result.db_queries = after - before
+    return result.to_dict()
+
+
+async def run_pollers(client, pollers: int, seconds: float, interval: float, params: dict) -> dict:
+    """Клиенты-дашборды: опрос /data раз в interval секунд с условным запросом по ETag."""
+    result = ScenarioResult(f"concurrent_pollers_{pollers}")
+    before = await _db_queries(client)
+    deadline = time.perf_counter() + seconds
+
+    async def poller():
+        etag = None
+        # Клиенты стартуют вразнобой, как реальные дашборды
+        await asyncio.sleep(random.uniform(0, interval))
+        while time.perf_counter() < deadline:
+            headers = {"If-None-Match": etag} if etag else {}
+            request_started = time.perf_counter()
+            response = await client.get(f"{API}/data", params=params, headers=headers)
+            result.observe(response, time.perf_counter() - request_started)
+            etag = response.headers.get("ETag", etag)
+            await asyncio.sleep(interval)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(poller() for _ in range(pollers)))
+    result.seconds = time.perf_counter() - started
+    after = await _db_queries(client)
+    if before is not None and after is not None:
+        result.db_queries = after - before
+    return result.to_dict()
+
+
+async def run_scenarios(client, nodeids: List[int], date_from: Optional[str], date_to: Optional[str], args) -> List[dict]:
+    rng = random.Random(args.seed)
+    results = []
+
+    def single_node():
+        return "GET", f"{API}/data", {"nodeid": rng.choice(nodeids)}, {}
+
+    def all_nodes():
+        return "GET", f"{API}/data", {"limit": args.limit}, {}
+
+    def long_range_downsampled():
+        params = {"nodeid": rng.choice(nodeids), "points": args.points}
+        if date_from and date_to:
+            params.update(date_from=date_from, date_to=date_to)
+        return "GET", f"{API}/data/downsampled", params, {}
+
+    def long_range_raw():
+        params = {"nodeid": rng.choice(nodeids), "limit": args.long_limit}
+        if date_from and date_to:
+            params.update(date_from=date_from, date_to=date_to)
+        return "GET", f"{API}/data", params, {}
+
+    def tagnames():
+        return "GET", f"{API}/tagnames", None, {}
+
+    scenarios = {
+        "single_node": single_node,
+        "all_nodes": all_nodes,
+        "long_range_downsampled": long_range_downsampled,
+        "long_range_raw": long_range_raw,
+        "tagnames": tagnames,
+    }
+    for name, make_request in scenarios.items():
+        if args.scenarios and name not in args.scenarios:
+            continue
+        # Прогрев: первые запросы заполняют кэши и пул соединений
+        await run_sequential(client, name, make_request, args.warmup)
+        results.append(await run_sequential(client, name, make_request, args.requests))
+        print(_format(results[-1]))
+
+    if not args.scenarios or "concurrent_pollers" in args.scenarios:
+        for pollers in args.pollers:
+            results.append(await run_pollers(client, pollers, args.seconds, args.poll_interval, {"limit": args.limit}))
+            print(_format(results[-1]))
+    return results
+
+
+def _format(result: dict) -> str:
+    return (
+        f"{result['scenario']:<28} {result['requests']:>7} req  {result['throughput_rps'] or 0:>9} rps"
+        f"  p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms  p99 {result['p99_ms']} ms"
+        f"  db/req {result['db_queries_per_request']}  errors {result['errors']}"
+    )
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args) -> dict:
+    dataset = None
+    if args.generate:
+        from core.config import settings
+        dataset = await data_generator.load(args.url or settings.DATABASE_URL, data_generator.generator_from_args(args), args.batch_size)
+        print(f"Loaded dataset: {dataset}")
+
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout)
+    else:
+        from main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=args.timeout)
+
+    async with client:
+        tagnames = (await client.get(f"{API}/tagnames")).json()
+        nodeids = [node["nodeid"] for node in tagnames]
+        if not nodeids:
+            raise SystemExit("No nodes with history, run with --generate or load data first")
+        date_from = dataset["date_from"] if dataset else args.date_from
+        date_to = dataset["date_to"] if dataset else args.date_to
+        scenarios = await run_scenarios(client, nodeids, date_from, date_to, args)
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "target": args.base_url or "in-process",
+        "nodes": len(nodeids),
+        "dataset": dataset,
+        "scenarios": scenarios,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    data_generator.add_arguments(parser)
+    parser.set_defaults(url=None)
+    parser.add_argument("--generate", action="store_true", help="Сгенерировать и загрузить данные перед нагрузкой")
+    parser.add_argument("--base-url", help="Адрес запущенного сервера; без него приложение запускается в процессе")
+    parser.add_argument("--scenarios", nargs="*", help="Выполнить только перечисленные сценарии")
+    parser.add_argument("--requests", type=int, default=200, help="Запросов на последовательный сценарий")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--long-limit", type=int, default=1000)
+    parser.add_argument("--points", type=int, default=500)
+    parser.add_argument("--date-from", help="Начало длинного периода (ISO 8601), если данные не генерируются")
+    parser.add_argument("--date-to", help="Конец длинного периода (ISO 8601)")
+    parser.add_argument("--pollers", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--seconds", type=float, default=10.0, help="Длительность сценария с опросчиками")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--json", help="Сохранить результаты в JSON-файл")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,172 @@
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from core.config import settings
+from core.metrics import registry, Gauge, CounterFunc
+import asyncio
+import functools
+
+
+class OverloadedError(RuntimeError):
+    """Запрос отклонён: очередь ограничителя заполнена или ожидание слишком долгое."""
+
+
+class QueryTimeoutError(OverloadedError):
+    """Запрос к БД превысил DB_STATEMENT_TIMEOUT."""
+
+
+# SQLSTATE query_canceled: PostgreSQL отменил выражение по statement_timeout
+_QUERY_CANCELED = "57014"
+
+
+def is_statement_timeout(error: BaseException) -> bool:
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    orig = getattr(error, "orig", None)
+    return getattr(orig, "sqlstate", None) == _QUERY_CANCELED or getattr(orig, "pgcode", None) == _QUERY_CANCELED
+
+
+def query_errors(default: Optional[Callable] = None):
+    """
+    Декоратор запросов к БД: таймаут выражения становится QueryTimeoutError,
+    таймаут ожидания пула пробрасывается (оба — перегрузка, 503, а не пустой
+    результат). Прочие ошибки дают default(), если он задан, иначе пробрасываются.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            except (OverloadedError, PoolTimeoutError):
+                raise
+            except Exception as e:
+                if is_statement_timeout(e):
+                    raise QueryTimeoutError("Query exceeded DB_STATEMENT_TIMEOUT") from e
+                if default is None:
+                    raise
+                return default()
+        return wrapper
+    return decorator
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных запросов: первый по ключу выполняет
+    работу, остальные ждут его результат (или исключение). Если первый
+    запрос отменён (клиент ушёл), ожидающие повторяют попытку сами.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable]):
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                return await self._lead(key, func)
+            self.followers += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    continue
+                raise
+
+    async def _lead(self, key: Hashable, func: Callable[[], Awaitable]):
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.leaders += 1
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Помечаем исключение полученным: ожидающих может не быть
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "coalesced": self.followers}
+
+
+class AdmissionLimiter:
+    """
+    Ограничение числа одновременно выполняемых тяжёлых запросов с очередью.
+    Если очередь уже заполнена, запрос отклоняется сразу (503), а не копится;
+    ожидание места в очереди ограничено queue_timeout.
+    """
+
+    def __init__(self, limit: int, queue_size: int, queue_timeout: float):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+
+    @property
+    def saturated(self) -> bool:
+        """Все слоты заняты: новый запрос встанет в очередь или будет отклонён."""
+        return self._semaphore.locked()
+
+    @asynccontextmanager
+    async def slot(self):
+        if not self._semaphore.locked():
+            # Свободный слот занимается сразу, без переключения задач
+            await self._semaphore.acquire()
+        elif self.waiting >= self.queue_size:
+            self.shed += 1
+            raise OverloadedError("Too many queries in flight, retry later")
+        else:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise OverloadedError("Query queue wait timed out, retry later")
+            finally:
+                self.waiting -= 1
+        self.active += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+        }
+
+
+query_flights = SingleFlight()
+query_limiter = AdmissionLimiter(settings.QUERY_MAX_CONCURRENCY, settings.QUERY_QUEUE_SIZE, settings.QUERY_QUEUE_TIMEOUT)
+
+registry.register(Gauge("query_active", "Heavy queries executing now.", lambda: query_limiter.active))
+registry.register(Gauge("query_waiting", "Heavy queries waiting for a slot.", lambda: query_limiter.waiting))
+registry.register(CounterFunc("query_shed_total", "Queries rejected because the queue was full.", lambda: query_limiter.shed))
+registry.register(CounterFunc("query_queue_timeouts_total", "Queries rejected after waiting QUERY_QUEUE_TIMEOUT.", lambda: query_limiter.timed_out))
+registry.register(CounterFunc("query_coalesced_total", "Requests served by another in-flight identical query.", lambda: query_flights.followers))
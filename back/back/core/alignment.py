@@ -0,0 +1,35 @@
+import numpy as np
+
+FILL_POLICIES = ("locf", "linear", "average")
+
+
+def time_grid(start: int, step: int, count: int) -> np.ndarray:
+    """Общая сетка времени: count отметок (мкс) с шагом step начиная со start."""
+    return start + step * np.arange(count, dtype=np.int64)
+
+
+def align_locf(times: np.ndarray, values: np.ndarray, grid: np.ndarray) -> np.ndarray:
+    """
+    Последнее известное значение на каждую отметку сетки (last observation
+    carried forward); до первого наблюдения — NaN. times отсортирован.
+    """
+    index = np.searchsorted(times, grid, side="right") - 1
+    result = np.full(len(grid), np.nan)
+    known = index >= 0
+    result[known] = values[index[known]]
+    return result
+
+
+def align_linear(times: np.ndarray, values: np.ndarray, grid: np.ndarray) -> np.ndarray:
+    """Линейная интерполяция между соседними наблюдениями; вне их диапазона — NaN."""
+    if len(times) == 0:
+        return np.full(len(grid), np.nan)
+    return np.interp(grid.astype(np.float64), times.astype(np.float64), values, left=np.nan, right=np.nan)
+
+
+def scatter_buckets(buckets: np.ndarray, values: np.ndarray, count: int) -> np.ndarray:
+    """Уже посчитанные значения корзин на сетку из count отметок; пустые корзины — NaN."""
+    result = np.full(count, np.nan)
+    inside = (buckets >= 0) & (buckets < count)
+    result[buckets[inside]] = values[inside]
+    return result
@@ -0,0 +1,112 @@
+import pyarrow as pa
+from core.config import settings
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# Строковые столбцы с малым числом различных значений кодируются словарём
+DICTIONARY_COLUMNS = ("tagname", "recordtype", "appid", "method", "resolution", "value_kind")
+
+_DICTIONARY_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+HISTORY_ARROW_SCHEMA = pa.schema([
+    ("nodeid", pa.int64()),
+    ("tagname", _DICTIONARY_TYPE),
+    ("time", pa.timestamp("us")),
+    ("actualtime", pa.timestamp("us")),
+    ("valdouble", pa.float64()),
+    ("valint", pa.int64()),
+    ("valuint", pa.int64()),
+    ("valbool", pa.bool_()),
+    ("valstring", pa.string()),
+    ("quality", pa.int64()),
+    ("recordtype", _DICTIONARY_TYPE),
+    ("appid", _DICTIONARY_TYPE),
+])
+
+
+def wants_arrow(format_param, accept) -> bool:
+    """Формат ответа: ?format=arrow или заголовок Accept с типом Arrow IPC."""
+    if format_param:
+        return format_param == "arrow"
+    return bool(accept) and ARROW_MEDIA_TYPE in accept
+
+
+def _column(values, field_type):
+    if pa.types.is_dictionary(field_type):
+        return pa.array(values, pa.string()).dictionary_encode()
+    return pa.array(values, field_type)
+
+
+def _to_ipc(table: pa.Table) -> bytes:
+    sink = pa.BufferOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression=settings.ARROW_IPC_COMPRESSION or None)
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def history_to_arrow(rows, nodes: dict) -> bytes:
+    """
+    Строки истории (nodeid, *HISTORY_FIELDS) в поток Arrow IPC — одна плоская
+    таблица по всем узлам, время как timestamp[us] (int64), значения
+    типизированными массивами. Строки узлов, которых нет в nodes, пропускаются.
+    """
+    rows = [row for row in rows if row[0] in nodes]
+    columns = list(zip(*rows)) if rows else [()] * (len(HISTORY_ARROW_SCHEMA) - 1)
+    nodeids = columns[0]
+    tagnames = [nodes[nodeid]["tagname"] for nodeid in nodeids]
+    values = [nodeids, tagnames] + [list(column) for column in columns[1:]]
+
+    appid_index = HISTORY_ARROW_SCHEMA.get_field_index("appid")
+    values[appid_index] = [str(appid) if appid else None for appid in values[appid_index]]
+
+    arrays = [_column(column, field.type) for column, field in zip(values, HISTORY_ARROW_SCHEMA)]
+    return _to_ipc(pa.Table.from_arrays(arrays, schema=HISTORY_ARROW_SCHEMA))
+
+
+def nested_to_arrow(result: list, items_key: str) -> bytes:
+    """
+    Ответ вида [{nodeid, tagname, ..., items_key: [{...}, ...]}] в одну
+    плоскую таблицу Arrow: поля узла повторяются для каждой точки.
+    """
+    node_fields = []
+    item_fields = []
+    for node in result:
+        node_fields = [key for key in node if key != items_key]
+        if node[items_key]:
+            item_fields = list(node[items_key][0])
+            break
+
+    columns = {name: [] for name in node_fields + item_fields}
+    for node in result:
+        for item in node[items_key]:
+            for name in node_fields:
+                columns[name].append(node[name])
+            for name in item_fields:
+                columns[name].append(item.get(name))
+
+    arrays = {}
+    for name, values in columns.items():
+        if name in DICTIONARY_COLUMNS:
+            arrays[name] = pa.array([str(value) if value is not None else None for value in values], pa.string()).dictionary_encode()
+            continue
+        try:
+            arrays[name] = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Столбец value у узлов разных типов (число и строка) — передаём строками
+            arrays[name] = pa.array([str(value) if value is not None else None for value in values], pa.string())
+    return _to_ipc(pa.table(arrays))
+
+
+def aligned_to_arrow(result: dict) -> bytes:
+    """
+    Выровненные значения в широкую таблицу Arrow: столбец time и столбец
+    float64 на узел (имя — nodeid, tagname в метаданных поля), NaN — null.
+    """
+    fields = [pa.field("time", pa.timestamp("us"))]
+    arrays = [pa.array(result["time"], pa.timestamp("us"))]
+    for nodeid, tagname, values in zip(result["nodeids"], result["tagnames"], result["values"]):
+        fields.append(pa.field(str(nodeid), pa.float64(), metadata={"tagname": tagname or ""}))
+        arrays.append(pa.array(values, pa.float64(), from_pandas=True))
+    schema = pa.schema(fields, metadata={"step": str(result["step"]), "fill": result["fill"]})
+    return _to_ipc(pa.Table.from_arrays(arrays, schema=schema))
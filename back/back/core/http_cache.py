@@ -0,0 +1,53 @@
+from core.cache import TTLCache
+from core.config import settings
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from collections import Counter
+from typing import Iterable, Optional
+import hashlib
+
+# Кэш сериализованных ответов: ключ запроса -> (ETag, тело ответа)
+response_cache = TTLCache(settings.RESPONSE_CACHE_SIZE, settings.RESPONSE_CACHE_TTL)
+
+# Число загрузок по узлам в этом процессе: перезапись существующих (nodeid, time)
+# не сдвигает max(time), поэтому версия ответа учитывает и его
+_node_writes = Counter()
+
+
+def mark_history_written(nodeids: Iterable[int]):
+    """Вызывается после записи истории: меняет версии узлов и сбрасывает их ответы из кэша."""
+    nodeids = set(nodeids)
+    if not nodeids:
+        return
+    _node_writes.update(nodeids)
+    # Ключ ответа начинается с набора узлов; None — все узлы
+    response_cache.invalidate_matching(lambda key: key[0] is None or not nodeids.isdisjoint(key[0]))
+
+
+def write_marks(nodeids: Optional[Iterable[int]]) -> tuple:
+    if nodeids is None:
+        return (sum(_node_writes.values()),)
+    return tuple(_node_writes[nodeid] for nodeid in nodeids)
+
+
+def make_etag(key: tuple, version) -> str:
+    """Слабый ETag из параметров запроса и версии выборки (время последней записи каждого узла)."""
+    raw = repr((key, version)).encode()
+    return 'W/"%s"' % hashlib.sha1(raw).hexdigest()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Сравнение слабое: префикс W/ не учитывается
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+
+def http_date(value: datetime) -> str:
+    # Время в nodes_history хранится без часового пояса и считается UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
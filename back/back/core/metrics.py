@@ -0,0 +1,245 @@
+from contextvars import ContextVar
+from typing import Dict, Iterable, Optional, Tuple
+import bisect
+import threading
+import time
+
+# Границы корзин гистограмм
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+ROWS_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_format_labels(self.labels, labels)} {_format_number(value)}"
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus: кумулятивные корзины, сумма и количество по меткам."""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Счётчики по корзинам (последняя — +Inf), сумма
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_number(bound) + '"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_number(total)}"
+            yield f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}"
+
+
+class Gauge:
+    """Значение, вычисляемое при каждом чтении /metrics."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, getter):
+        self.name = name
+        self.help = help
+        self.getter = getter
+
+    def render(self) -> Iterable[str]:
+        value = self.getter()
+        if value is None:
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield f"{self.name} {_format_number(value)}"
+
+
+class CounterFunc(Gauge):
+    """
+    Счётчик, который уже ведёт сам объект (только растёт с запуска процесса),
+    читается при каждом чтении /metrics. Тип counter и суффикс _total —
+    чтобы к нему применялся rate().
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, getter):
+        if not name.endswith("_total"):
+            raise ValueError(f"Counter name must end with _total: {name}")
+        super().__init__(name, help, getter)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> bytes:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+registry = MetricsRegistry()
+
+REQUEST_LABELS = ("method", "route")
+
+request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Request latency from start to last body byte.",
+    REQUEST_LABELS + ("status",)
+))
+response_size = registry.register(Histogram(
+    "http_response_size_bytes", "Response body size.", REQUEST_LABELS, SIZE_BUCKETS
+))
+request_db_time = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent in database queries per request.", REQUEST_LABELS
+))
+request_db_queries = registry.register(Histogram(
+    "http_request_db_queries", "Number of database queries per request.", REQUEST_LABELS, COUNT_BUCKETS
+))
+request_db_rows = registry.register(Histogram(
+    "http_request_db_rows", "Number of rows returned by database queries per request.", REQUEST_LABELS, ROWS_BUCKETS
+))
+query_duration = registry.register(Histogram(
+    "db_query_duration_seconds", "Database query latency.", ("statement",)
+))
+slow_queries = registry.register(Counter(
+    "db_slow_queries_total", "Queries slower than DB_SLOW_QUERY_MS.", ("route",)
+))
+
+
+class RequestStats:
+    """Счётчики базы данных для одного HTTP-запроса; заполняются событиями движка."""
+
+    __slots__ = ("scope", "db_time", "queries", "rows")
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.db_time = 0.0
+        self.queries = 0
+        self.rows = 0
+
+    @property
+    def route(self) -> str:
+        # Маршрутизатор Starlette записывает найденный маршрут в scope
+        return getattr(self.scope.get("route"), "path", "unmatched")
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+
+def statement_kind(statement: str) -> str:
+    """Первое слово SQL — метка для гистограммы запросов без роста числа рядов."""
+    word = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return word if word in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "COPY") else "OTHER"
+
+
+def observe_query(statement: str, seconds: float, rows: int):
+    query_duration.observe(seconds, statement_kind(statement))
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.db_time += seconds
+        stats.queries += 1
+        stats.rows += max(rows, 0)
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: длительность запроса до последнего байта тела, размер
+    ответа и счётчики БД (время, число запросов, строки) по маршруту.
+    Маршрут берётся из шаблона пути маршрута ("/data"), а не из фактического URL,
+    чтобы число рядов не зависело от параметров.
+    """
+
+    def __init__(self, app, exclude_paths: Iterable[str] = ()):
+        self.app = app
+        self.exclude_paths = tuple(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude_paths):
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            labels = (scope["method"], stats.route)
+            request_duration.observe(time.perf_counter() - started, *labels, status)
+            response_size.observe(size, *labels)
+            request_db_time.observe(stats.db_time, *labels)
+            request_db_queries.observe(stats.queries, *labels)
+            request_db_rows.observe(stats.rows, *labels)
@@ -0,0 +1,11 @@
+import orjson
+
+
+def dumps(data) -> bytes:
+    """
+    Сериализация ответа сразу в байты JSON. orjson сам кодирует datetime
+    (ISO 8601) и UUID, поэтому строки истории не нужно предварительно
+    преобразовывать и проверять через Pydantic. Массивы NumPy кодируются
+    напрямую, NaN — как null.
+    """
+    return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
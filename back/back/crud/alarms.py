@@ -0,0 +1,308 @@
+from sqlalchemy import select, delete
+from db.models import AlarmRule
+from crud.node_cache import node_cache
+from crud.latest import latest_values
+from core.config import settings
+from core.metrics import registry, Gauge, CounterFunc
+from core.serialization import dumps
+from collections import deque
+from datetime import datetime
+from operator import itemgetter
+from typing import Dict, Iterable, List, Optional, Tuple
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+ALARM_KINDS = ("threshold", "rate", "stale", "quality")
+
+RULE_FIELDS = (
+    "id", "name", "kind", "nodeid", "appid", "low", "high", "deadband",
+    "max_rate", "max_age", "min_quality", "severity", "enabled"
+)
+
+
+def rule_to_dict(rule: AlarmRule) -> dict:
+    return {name: getattr(rule, name) for name in RULE_FIELDS}
+
+
+def _numeric(row: dict) -> Optional[float]:
+    for name in ("valdouble", "valint", "valuint", "valbool"):
+        value = row.get(name)
+        if value is not None:
+            return float(value)
+    return None
+
+
+def _appid(value) -> Optional[str]:
+    return str(value) if value is not None else None
+
+
+class AlarmEngine:
+    """
+    Проверка правил тревог по новым записям истории без повторного чтения БД.
+
+    Записи приходят из опросчика новых записей и из загрузки (как в таблицу
+    последних значений). Для каждого узла хранится водяной знак — время
+    последней проверенной записи — и последнее числовое значение: повторы
+    и опоздавшие записи пропускаются, скорость изменения считается по паре
+    соседних записей. Правила индексируются по nodeid и appid, поэтому
+    стоимость записи определяется числом правил её узла, а не общим числом правил.
+
+    Активные тревоги живут в памяти; после перезапуска состояние
+    восстанавливается проверкой последних значений при прогреве.
+    """
+
+    def __init__(self):
+        self.rules: Dict[int, dict] = {}
+        self._by_node: Dict[int, List[dict]] = {}
+        self._by_app: Dict[str, List[dict]] = {}
+        self._global: List[dict] = []
+        self._scope: Dict[Tuple[int, Optional[str]], Tuple[dict, ...]] = {}
+        # nodeid -> (время последней проверенной записи, последнее числовое значение)
+        self._last: Dict[int, Tuple[datetime, Optional[float]]] = {}
+        self._appids: Dict[int, Optional[str]] = {}
+        self.active: Dict[Tuple[int, int], dict] = {}
+        self.events = deque(maxlen=settings.ALARM_EVENTS_KEEP)
+        self.loaded = False
+        self.rows_evaluated = 0
+        self.rows_skipped = 0
+        self.raised = 0
+        self.cleared = 0
+        self._snapshot: Optional[bytes] = None
+
+    # Правила
+
+    def set_rules(self, rules: Iterable[dict]):
+        self.rules = {rule["id"]: rule for rule in rules if rule["enabled"] and rule["kind"] in ALARM_KINDS}
+        self._by_node, self._by_app, self._global = {}, {}, []
+        for rule in self.rules.values():
+            if rule["nodeid"] is not None:
+                self._by_node.setdefault(rule["nodeid"], []).append(rule)
+            elif rule["appid"] is not None:
+                self._by_app.setdefault(_appid(rule["appid"]), []).append(rule)
+            else:
+                self._global.append(rule)
+        self._scope = {}
+        # Тревоги удалённых и изменённых правил снимаются без события
+        for key in [key for key in self.active if key[0] not in self.rules]:
+            del self.active[key]
+        self._snapshot = None
+        self.loaded = True
+
+    async def load_rules(self, session):
+        rules = (await session.execute(select(AlarmRule))).scalars().all()
+        self.set_rules(rule_to_dict(rule) for rule in rules)
+        logger.info(f"Alarm engine loaded {len(self.rules)} rules")
+
+    def rules_for(self, nodeid: int, appid: Optional[str]) -> Tuple[dict, ...]:
+        key = (nodeid, appid)
+        rules = self._scope.get(key)
+        if rules is None:
+            rules = self._scope[key] = tuple(
+                self._by_node.get(nodeid, []) + self._by_app.get(appid, []) + self._global
+            )
+        return rules
+
+    # Проверка записей
+
+    def update(self, rows: Iterable[dict]):
+        """Проверяет новые записи (словари nodeid + HISTORY_FIELDS) в порядке времени."""
+        rows = [row for row in rows if row.get("time") is not None]
+        rows.sort(key=itemgetter("time"))
+        last = self._last
+        for row in rows:
+            nodeid = row["nodeid"]
+            time = row["time"]
+            previous = last.get(nodeid)
+            if previous is not None and time <= previous[0]:
+                self.rows_skipped += 1
+                continue
+            value = _numeric(row)
+            appid = _appid(row.get("appid"))
+            self._appids[nodeid] = appid
+            last[nodeid] = (time, value if value is not None else (previous[1] if previous else None))
+            rules = self.rules_for(nodeid, appid)
+            if rules:
+                self._evaluate(rules, nodeid, time, value, row.get("quality"), previous)
+            self.rows_evaluated += 1
+
+    def recheck(self, rows: Iterable[dict]):
+        """
+        Проверка текущих значений узлов (строки таблицы последних значений)
+        без сдвига водяных знаков — после изменения правил, чтобы новое
+        правило срабатывало на уже выходящее за пределы значение сразу.
+        Правила скорости ждут следующей пары записей.
+        """
+        for row in rows:
+            if row.get("time") is None:
+                continue
+            nodeid = row["nodeid"]
+            rules = self.rules_for(nodeid, _appid(row.get("appid")))
+            if rules:
+                self._evaluate(rules, nodeid, row["time"], _numeric(row), row.get("quality"), None)
+
+    def _evaluate(self, rules, nodeid: int, time: datetime, value: Optional[float], quality, previous):
+        for rule in rules:
+            kind = rule["kind"]
+            key = (rule["id"], nodeid)
+            active = key in self.active
+            if kind == "threshold":
+                if value is None:
+                    continue
+                low, high = rule["low"], rule["high"]
+                if (high is not None and value > high) or (low is not None and value < low):
+                    self._raise(rule, nodeid, time, value, f"value {value:g} outside [{low}, {high}]")
+                elif active:
+                    deadband = rule["deadband"] or 0.0
+                    if (high is None or value <= high - deadband) and (low is None or value >= low + deadband):
+                        self._clear(key, time, value)
+            elif kind == "rate":
+                if value is None or previous is None or previous[1] is None:
+                    continue
+                seconds = (time - previous[0]).total_seconds()
+                if seconds <= 0:
+                    continue
+                rate = (value - previous[1]) / seconds
+                if abs(rate) > rule["max_rate"]:
+                    self._raise(rule, nodeid, time, value, f"rate {rate:g}/s exceeds {rule['max_rate']:g}/s")
+                elif active:
+                    self._clear(key, time, value)
+            elif kind == "quality":
+                if quality is None:
+                    continue
+                if quality < rule["min_quality"]:
+                    self._raise(rule, nodeid, time, value, f"quality {quality} below {rule['min_quality']}")
+                elif active:
+                    self._clear(key, time, value)
+            elif kind == "stale" and active:
+                # Новая запись снимает тревогу об отсутствии данных
+                self._clear(key, time, value)
+
+    def check_stale(self, now: datetime):
+        """Тревоги stale: нет записей дольше max_age секунд (время записей — UTC)."""
+        for rule in self.rules.values():
+            if rule["kind"] != "stale":
+                continue
+            if rule["nodeid"] is not None:
+                nodeids = (rule["nodeid"],)
+            elif rule["appid"] is not None:
+                appid = _appid(rule["appid"])
+                nodeids = [nodeid for nodeid, node_appid in self._appids.items() if node_appid == appid]
+            else:
+                nodeids = self._last.keys()
+            for nodeid in nodeids:
+                previous = self._last.get(nodeid)
+                last_time = previous[0] if previous else None
+                if last_time is None or (now - last_time).total_seconds() > rule["max_age"]:
+                    message = f"no data since {last_time.isoformat()}" if last_time else "no data"
+                    self._raise(rule, nodeid, now, previous[1] if previous else None, message)
+
+    # Состояние тревог
+
+    def _raise(self, rule: dict, nodeid: int, time: datetime, value: Optional[float], message: str):
+        key = (rule["id"], nodeid)
+        alarm = self.active.get(key)
+        if alarm is not None:
+            alarm["last_time"] = time
+            alarm["last_value"] = value
+            self._snapshot = None
+            return
+        self.active[key] = {
+            "rule_id": rule["id"],
+            "rule": rule["name"],
+            "kind": rule["kind"],
+            "severity": rule["severity"],
+            "nodeid": nodeid,
+            "tagname": None,
+            "message": message,
+            "raised_at": time,
+            "value": value,
+            "last_time": time,
+            "last_value": value,
+        }
+        self.raised += 1
+        self.events.append({"event": "raised", "rule_id": rule["id"], "nodeid": nodeid, "time": time, "value": value, "message": message})
+        self._snapshot = None
+
+    def _clear(self, key: Tuple[int, int], time: datetime, value: Optional[float]):
+        alarm = self.active.pop(key)
+        self.cleared += 1
+        self.events.append({"event": "cleared", "rule_id": key[0], "nodeid": key[1], "time": time, "value": value, "message": alarm["message"]})
+        self._snapshot = None
+
+    async def fill_tagnames(self, session):
+        """Подставляет имена тегов для новых тревог из кэша узлов."""
+        missing = {alarm["nodeid"] for alarm in self.active.values() if alarm["tagname"] is None}
+        if not missing:
+            return
+        nodes = await node_cache.get_nodes(session, missing)
+        for alarm in self.active.values():
+            if alarm["tagname"] is None and alarm["nodeid"] in nodes:
+                alarm["tagname"] = nodes[alarm["nodeid"]]["tagname"]
+                self._snapshot = None
+
+    def query(self, nodeids: Optional[Iterable[int]] = None, severities: Optional[Iterable[str]] = None) -> list:
+        alarms = self.active.values()
+        if nodeids:
+            nodeids = set(nodeids)
+            alarms = [alarm for alarm in alarms if alarm["nodeid"] in nodeids]
+        if severities:
+            severities = set(severities)
+            alarms = [alarm for alarm in alarms if alarm["severity"] in severities]
+        return sorted(alarms, key=itemgetter("raised_at"), reverse=True)
+
+    def snapshot(self) -> bytes:
+        """Сериализованный список активных тревог; пересобирается только после изменений."""
+        if self._snapshot is None:
+            self._snapshot = dumps(self.query())
+        return self._snapshot
+
+    def stats(self) -> dict:
+        return {
+            "rules": len(self.rules),
+            "nodes": len(self._last),
+            "active": len(self.active),
+            "rows_evaluated": self.rows_evaluated,
+            "rows_skipped": self.rows_skipped,
+            "raised": self.raised,
+            "cleared": self.cleared,
+        }
+
+
+alarm_engine = AlarmEngine()
+
+registry.register(Gauge("alarms_active", "Currently active alarms.", lambda: len(alarm_engine.active)))
+registry.register(CounterFunc("alarm_rows_evaluated_total", "History rows checked against alarm rules.", lambda: alarm_engine.rows_evaluated))
+
+
+async def get_alarm_rules(session) -> List[dict]:
+    rules = (await session.execute(select(AlarmRule).order_by(AlarmRule.id))).scalars().all()
+    return [rule_to_dict(rule) for rule in rules]
+
+
+async def create_alarm_rule(session, values: dict) -> dict:
+    rule = AlarmRule(**values)
+    session.add(rule)
+    await session.commit()
+    await session.refresh(rule)
+    await alarm_engine.load_rules(session)
+    alarm_engine.recheck(latest_values.values.values())
+    return rule_to_dict(rule)
+
+
+async def delete_alarm_rule(session, rule_id: int) -> bool:
+    result = await session.execute(delete(AlarmRule).where(AlarmRule.id == rule_id))
+    await session.commit()
+    await alarm_engine.load_rules(session)
+    return bool(result.rowcount)
+
+
+async def run_stale_checker(interval: float = settings.ALARM_STALE_INTERVAL):
+    """Фоновая задача: периодическая проверка правил stale."""
+    while True:
+        try:
+            alarm_engine.check_stale(datetime.utcnow())
+        except Exception as e:
+            logger.error(f"Error checking stale alarms: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,152 @@
+from sqlalchemy import select, func, cast, extract, literal, and_, true, union_all, Float, BigInteger, DateTime
+from db.models import SensorData, Node
+from db.functions import numeric_value
+from crud.nodes import HistoryFilters, filter_nodeids, filter_values, node_set
+from core.alignment import time_grid, align_locf, align_linear, scatter_buckets
+from core.admission import query_errors
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+import numpy as np
+
+
+def grid_size(date_from: datetime, date_to: datetime, step: float) -> int:
+    """Число отметок сетки с шагом step секунд от date_from до date_to включительно."""
+    return int((date_to - date_from).total_seconds() // step) + 1
+
+
+def _to_micros(times) -> np.ndarray:
+    return np.array(times, dtype="datetime64[us]").astype(np.int64)
+
+
+def _observations(nodeids: List[int], date_from: datetime, date_to: datetime, fill: str, filters: Optional[HistoryFilters], dialect_name: str = "postgresql"):
+    """
+    Наблюдения внутри периода и опорные точки за его границами одним запросом:
+    последнее наблюдение до date_from (для LOCF и интерполяции в начале периода)
+    и первое после date_to (для интерполяции в конце). В PostgreSQL опорная
+    точка — LATERAL с ORDER BY time LIMIT 1 на узел: один шаг по индексу
+    (nodeid, time) от границы, а не max/min(time) по GROUP BY, который читает
+    всю историю узла до (после) периода. В SQLite — GROUP BY.
+    """
+    value = numeric_value()
+
+    def points(query):
+        query = filter_nodeids(query, SensorData.nodeid, nodeids).where(value.is_not(None))
+        return filter_values(query, SensorData.__table__, filters)
+
+    def seed(before: bool):
+        condition = SensorData.time < date_from if before else SensorData.time > date_to
+        if dialect_name == "postgresql":
+            nodes = node_set(nodeids)
+            nearest = filter_values(
+                select(SensorData.nodeid, SensorData.time, value.label("value"))
+                .where(SensorData.nodeid == nodes.c.nodeid)
+                .where(condition)
+                .where(value.is_not(None)),
+                SensorData.__table__, filters
+            ).order_by(SensorData.time.desc() if before else SensorData.time).limit(1).lateral("seed")
+            return select(nearest.c.nodeid, nearest.c.time, nearest.c.value).select_from(nodes.join(nearest, true()))
+        aggregate = func.max if before else func.min
+        bound = points(
+            select(SensorData.nodeid, aggregate(SensorData.time).label("time"))
+            .where(condition)
+            .group_by(SensorData.nodeid)
+        ).subquery()
+        return points(
+            select(SensorData.nodeid, SensorData.time, value)
+            .join(bound, and_(SensorData.nodeid == bound.c.nodeid, SensorData.time == bound.c.time))
+        )
+
+    parts = [
+        points(select(SensorData.nodeid, SensorData.time, value).where(SensorData.time >= date_from).where(SensorData.time <= date_to)),
+        seed(before=True),
+    ]
+    if fill == "linear":
+        parts.append(seed(before=False))
+    return union_all(*parts)
+
+
+def _bucket_averages(nodeids: List[int], date_from: datetime, step: float, count: int, filters: Optional[HistoryFilters]):
+    """Среднее по корзинам [t, t + step) для каждой отметки сетки — агрегация в SQL."""
+    value = numeric_value()
+    offset = extract("epoch", SensorData.time) - extract("epoch", literal(date_from, DateTime))
+    bucket = cast(func.floor(offset / literal(step, Float)), BigInteger).label("bucket")
+    query = (
+        select(SensorData.nodeid, bucket, func.avg(value))
+        .where(SensorData.time >= date_from)
+        .where(SensorData.time < date_from + timedelta(seconds=step * count))
+        .where(value.is_not(None))
+        .group_by(SensorData.nodeid, bucket)
+    )
+    query = filter_nodeids(query, SensorData.nodeid, nodeids)
+    return filter_values(query, SensorData.__table__, filters)
+
+
+def _split_by_node(nodeid: np.ndarray, *columns: np.ndarray) -> Dict[int, Tuple[np.ndarray, ...]]:
+    """Столбцы, отсортированные по узлу, в срезы по узлам без копирования."""
+    if len(nodeid) == 0:
+        return {}
+    starts = np.flatnonzero(np.diff(nodeid)) + 1
+    bounds = zip(np.concatenate(([0], starts)), np.concatenate((starts, [len(nodeid)])))
+    return {int(nodeid[start]): tuple(column[start:end] for column in columns) for start, end in bounds}
+
+
+@query_errors()
+async def get_aligned(session, nodeids: List[int], date_from: datetime, date_to: datetime, step: float, fill: str = "locf", filters: Optional[HistoryFilters] = None) -> dict:
+    """
+    Значения нескольких узлов на общей сетке времени с шагом step секунд.
+
+    fill="locf" — последнее известное значение на отметку, "linear" — линейная
+    интерполяция между соседними наблюдениями, "average" — среднее по корзине
+    [t, t + step). Для locf/linear выбираются наблюдения периода с опорными
+    точками за его границами и выравниваются на NumPy (searchsorted/interp);
+    для average агрегация по корзинам выполняется в SQL.
+
+    Ответ по столбцам: общий столбец time и по столбцу values на узел,
+    пропуски — NaN (null в JSON).
+    """
+    count = grid_size(date_from, date_to, step)
+    grid = time_grid(int(_to_micros([date_from])[0]), round(step * 1e6), count)
+    nodes = dict((await session.execute(
+        select(Node.nodeid, Node.tagname).where(Node.nodeid.in_(sorted(set(nodeids))))
+    )).all())
+    order = [nodeid for nodeid in dict.fromkeys(nodeids) if nodeid in nodes]
+
+    if not order:
+        # Пустой список узлов в filter_nodeids означал бы «все узлы»
+        columns = []
+    elif fill == "average":
+        rows = (await session.execute(_bucket_averages(order, date_from, step, count, filters))).all()
+        nodeid, buckets, averages = (list(column) for column in zip(*rows)) if rows else ([], [], [])
+        nodeid = np.array(nodeid, dtype=np.int64)
+        buckets = np.array(buckets, dtype=np.int64)
+        averages = np.array(averages, dtype=np.float64)
+        # Порядок строк после GROUP BY не гарантирован
+        index = np.lexsort((buckets, nodeid))
+        by_node = _split_by_node(nodeid[index], buckets[index], averages[index])
+        columns = [
+            scatter_buckets(*by_node[node], count) if node in by_node else np.full(count, np.nan)
+            for node in order
+        ]
+    else:
+        rows = (await session.execute(_observations(order, date_from, date_to, fill, filters, session.bind.dialect.name))).all()
+        nodeid, times, values = (list(column) for column in zip(*rows)) if rows else ([], [], [])
+        nodeid = np.array(nodeid, dtype=np.int64)
+        times = _to_micros(times)
+        values = np.array(values, dtype=np.float64)
+        index = np.lexsort((times, nodeid))
+        by_node = _split_by_node(nodeid[index], times[index], values[index])
+        align = align_linear if fill == "linear" else align_locf
+        columns = [
+            align(*by_node[node], grid) if node in by_node else np.full(count, np.nan)
+            for node in order
+        ]
+
+    return {
+        "start": date_from,
+        "step": step,
+        "fill": fill,
+        "time": grid.astype("datetime64[us]").tolist(),
+        "nodeids": order,
+        "tagnames": [nodes[node] for node in order],
+        "values": columns,
+    }
@@ -0,0 +1,127 @@
+from sqlalchemy import select
+from db.models import SensorData
+from crud.nodes import filter_nodeids
+from crud.node_cache import node_cache
+from crud.latest import latest_values
+from core.cache import TTLCache
+from core.config import settings
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+FACET_FIELDS = ("recordtype", "appid", "quality")
+
+_facets_cache = TTLCache(settings.FACETS_CACHE_SIZE, settings.FACETS_CACHE_TTL)
+
+
+class FacetIndex:
+    """
+    Значения recordtype/appid/quality по узлам. Прогревается при старте одним
+    запросом DISTINCT по истории и дальше обновляется из опросчика новых
+    записей и из загрузки, как таблица последних значений, поэтому фильтры
+    без периода не читают историю на каждый запрос.
+    """
+
+    def __init__(self):
+        self.values: Dict[int, Tuple[set, ...]] = {}
+        self.warmed = False
+        self.updates = 0
+
+    async def warm(self, session):
+        """Значения из всей истории; записанное во время прогрева не теряется — множества объединяются."""
+        table = SensorData.__table__
+        query = select(table.c.nodeid, *[table.c[name] for name in FACET_FIELDS]).distinct()
+        rows = (await session.execute(query)).all()
+        self.update(dict(zip(("nodeid",) + FACET_FIELDS, row)) for row in rows)
+        self.warmed = True
+        logger.info(f"Facet index warmed with {len(self.values)} nodes")
+
+    def update(self, rows: Iterable[dict]):
+        for row in rows:
+            sets = self.values.get(row["nodeid"])
+            if sets is None:
+                sets = self.values[row["nodeid"]] = tuple(set() for _ in FACET_FIELDS)
+            for name, values in zip(FACET_FIELDS, sets):
+                value = row.get(name)
+                if value is not None:
+                    values.add(value)
+        self.updates += 1
+
+    def query(self, nodeids: Optional[Iterable[int]] = None) -> Dict[str, set]:
+        result = {name: set() for name in FACET_FIELDS}
+        selected = self.values.values() if not nodeids else [self.values[nodeid] for nodeid in nodeids if nodeid in self.values]
+        for sets in selected:
+            for name, values in zip(FACET_FIELDS, sets):
+                result[name] |= values
+        return result
+
+    def stats(self) -> dict:
+        return {"nodes": len(self.values), "warmed": self.warmed, "updates": self.updates}
+
+
+facet_index = FacetIndex()
+
+
+def _sorted_values(values: set, key=None) -> list:
+    return sorted((value for value in values if value is not None), key=key)
+
+
+async def get_facets(session, nodeid: Optional[List[int]] = None, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None) -> dict:
+    """
+    Различные значения recordtype/appid/quality для фильтров дашборда.
+
+    С периодом — одним запросом DISTINCT по трём столбцам в его пределах,
+    которые отбираются по индексу времени. Без периода значения берутся из
+    таблицы последних значений и индекса значений (прогретого по истории и
+    пополняемого при записи). Список узлов берётся из кэша узлов.
+    Результат кэшируется на FACETS_CACHE_TTL секунд.
+    """
+    nodeids = tuple(sorted(set(nodeid))) if nodeid else None
+    key = (nodeids, date_from, date_to)
+    cached = _facets_cache.get(key)
+    if cached is not None:
+        return cached
+
+    if date_from is None and date_to is None:
+        if not latest_values.warmed:
+            await latest_values.warm(session)
+        if not facet_index.warmed:
+            await facet_index.warm(session)
+        values = facet_index.query(nodeids)
+        for row in latest_values.query(nodeids):
+            for name in FACET_FIELDS:
+                values[name].add(row[name])
+    else:
+        table = SensorData.__table__
+        query = select(*[table.c[name] for name in FACET_FIELDS]).distinct()
+        query = filter_nodeids(query, table.c.nodeid, nodeids)
+        if date_from:
+            query = query.where(table.c.time >= date_from)
+        if date_to:
+            query = query.where(table.c.time <= date_to)
+
+        values = {name: set() for name in FACET_FIELDS}
+        for row in (await session.execute(query)).all():
+            for name, value in zip(FACET_FIELDS, row):
+                values[name].add(value)
+
+    nodes = await node_cache.get_tagnames(session)
+    if nodeids:
+        nodes = [node for node in nodes if node["nodeid"] in nodeids]
+
+    result = {
+        "nodes": nodes,
+        "recordtype": _sorted_values(values["recordtype"]),
+        "appid": [str(value) for value in _sorted_values(values["appid"], key=str)],
+        "quality": _sorted_values(values["quality"]),
+        "date_from": date_from,
+        "date_to": date_to,
+    }
+    _facets_cache.set(key, result)
+    return result
+
+
+def facets_cache_stats() -> dict:
+    return dict(_facets_cache.stats(), index=facet_index.stats())
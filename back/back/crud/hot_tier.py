@@ -0,0 +1,332 @@
+from sqlalchemy import select, func
+from db.models import SensorData
+from crud.nodes import NodeIds, HistoryFilters, VALUE_KIND_COLUMNS, single_nodeid, value_kind
+from crud.node_cache import node_cache
+from core.config import settings
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import datetime, timedelta
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# В горячем слое хранятся только числовые узлы: время, значение и качество
+HOT_KINDS = ("double", "int", "uint")
+HOT_FIELDS = ("time", "value", "quality")
+
+# Отсутствующее качество в массиве int64
+QUALITY_MISSING = np.iinfo(np.int64).min
+
+# Байт на слот: время, значение и качество по 8 байт, массивы вдвое больше ёмкости
+_SLOT_BYTES = 3 * 8 * 2
+
+# Минимальная ёмкость буфера узла, записей
+MIN_CAPACITY = 1024
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def to_micros(value: datetime) -> int:
+    return (value - _EPOCH) // timedelta(microseconds=1)
+
+
+class NodeRing:
+    """
+    Кольцевой буфер последних записей одного узла на массивах NumPy.
+    Живые данные лежат непрерывно в [start, end) массивов удвоенной ёмкости:
+    запись в конец, при заполнении — сдвиг к началу (амортизированно O(1)),
+    поэтому выборка по времени — срез без копирования.
+    """
+
+    __slots__ = ("kind", "capacity", "times", "values", "qualities", "start", "end", "complete_from")
+
+    def __init__(self, kind: str, capacity: int, complete_from: int):
+        self.kind = kind
+        self.capacity = capacity
+        self.times = np.empty(capacity * 2, dtype=np.int64)
+        self.values = np.empty(capacity * 2, dtype=np.float64)
+        self.qualities = np.empty(capacity * 2, dtype=np.int64)
+        self.start = 0
+        self.end = 0
+        # Время (мкс), начиная с которого в буфере есть все записи узла
+        self.complete_from = complete_from
+
+    def __len__(self):
+        return self.end - self.start
+
+    def _compact(self):
+        size = len(self)
+        for array in (self.times, self.values, self.qualities):
+            array[:size] = array[self.start:self.end]
+        self.start, self.end = 0, size
+
+    def append(self, times: np.ndarray, values: np.ndarray, qualities: np.ndarray):
+        """Добавляет записи, упорядоченные по времени и не раньше последней записи буфера."""
+        if len(times) > self.capacity:
+            times, values, qualities = times[-self.capacity:], values[-self.capacity:], qualities[-self.capacity:]
+            # Не поместившиеся старые записи пачки не покрываются буфером
+            self.complete_from = max(self.complete_from, int(times[0]))
+        if self.end + len(times) > len(self.times):
+            self._compact()
+        end = self.end + len(times)
+        self.times[self.end:end] = times
+        self.values[self.end:end] = values
+        self.qualities[self.end:end] = qualities
+        self.end = end
+        overflow = len(self) - self.capacity
+        if overflow > 0:
+            self.start += overflow
+            # Вытесненные записи больше не покрываются буфером
+            self.complete_from = max(self.complete_from, int(self.times[self.start]))
+
+    def upsert(self, time: int, value: float, quality: int):
+        """Запись вне порядка или замена существующей (nodeid, time)."""
+        times = self.times[self.start:self.end]
+        position = int(np.searchsorted(times, time))
+        if position < len(times) and times[position] == time:
+            self.values[self.start + position] = value
+            self.qualities[self.start + position] = quality
+            return
+        if time < self.complete_from:
+            # Старше покрываемого окна — такие запросы всё равно идут в БД
+            return
+        merged_times = np.insert(times, position, time)
+        merged_values = np.insert(self.values[self.start:self.end], position, value)
+        merged_qualities = np.insert(self.qualities[self.start:self.end], position, quality)
+        self.start = self.end = 0
+        self.append(merged_times, merged_values, merged_qualities)
+
+    def trim(self, cutoff: int):
+        """Удаляет записи старше cutoff: окно горячего слоя сдвигается вперёд."""
+        count = int(np.searchsorted(self.times[self.start:self.end], cutoff))
+        self.start += count
+        self.complete_from = max(self.complete_from, cutoff)
+
+    def select(self, date_from: int, date_to: Optional[int], limit: int, qualities: Tuple[int, ...] = ()) -> np.ndarray:
+        """Индексы последних limit записей в [date_from, date_to], от новых к старым."""
+        times = self.times[self.start:self.end]
+        lo = int(np.searchsorted(times, date_from, side="left"))
+        hi = int(np.searchsorted(times, date_to, side="right")) if date_to is not None else len(times)
+        if qualities:
+            indices = lo + np.flatnonzero(np.isin(self.qualities[self.start + lo:self.start + hi], qualities))
+        else:
+            indices = np.arange(lo, hi)
+        return self.start + indices[::-1][:limit]
+
+
+class HotTier:
+    """
+    Горячий слой истории в памяти процесса: кольцевой буфер последних
+    HOT_TIER_WINDOW секунд (время, значение, качество) для каждого числового узла.
+
+    Прогревается одним запросом за окно до самой свежей записи и обновляется
+    инкрементально из опросчика новых записей и из загрузки. Запросы /data с
+    date_from внутри окна, проекцией из time/value/quality (или столбца значения
+    узла) и без фильтров, кроме quality, отвечаются срезами массивов;
+    остальные прозрачно уходят в БД. Свежесть — как у live_feed: до LIVE_POLL_INTERVAL.
+    """
+
+    def __init__(self, window: float, max_bytes: float, max_points: int):
+        self.window = int(window * 1_000_000)
+        self.max_bytes = max_bytes
+        self.max_points = max_points
+        self.rings: Dict[int, NodeRing] = {}
+        # Узлы, которые нельзя обслуживать из памяти: нечисловые или не поместившиеся в лимит памяти
+        self.excluded = set()
+        self.complete_from: Optional[int] = None
+        self.capacity = min(max_points, MIN_CAPACITY)
+        self.warmed = False
+        self.hits = 0
+        self.misses = 0
+
+    def _new_ring(self, nodeid: int, kind: str) -> Optional[NodeRing]:
+        if kind not in HOT_KINDS or self.memory_bytes() + self.capacity * _SLOT_BYTES > self.max_bytes:
+            self.excluded.add(nodeid)
+            return None
+        ring = self.rings[nodeid] = NodeRing(kind, self.capacity, self.complete_from)
+        return ring
+
+    @staticmethod
+    def _arrays(rows: List[dict], kind: str):
+        column = VALUE_KIND_COLUMNS[kind]
+        times = np.fromiter((to_micros(row["time"]) for row in rows), dtype=np.int64, count=len(rows))
+        values = np.array([row[column] if row[column] is not None else np.nan for row in rows], dtype=np.float64)
+        qualities = np.fromiter(
+            (row["quality"] if row["quality"] is not None else QUALITY_MISSING for row in rows),
+            dtype=np.int64, count=len(rows)
+        )
+        return times, values, qualities
+
+    async def warm(self, session):
+        table = SensorData.__table__
+        latest = (await session.execute(select(func.max(table.c.time)))).scalar()
+        if latest is None:
+            # Пустая история: всё, что появится, попадёт в буфер
+            self.complete_from = 0
+            self.warmed = True
+            return
+        date_from = latest - timedelta(microseconds=self.window)
+        names = ("time", "quality") + tuple(VALUE_KIND_COLUMNS.values())
+        rows = (await session.execute(
+            select(table.c.nodeid, *[table.c[name] for name in names])
+            .where(table.c.time >= date_from)
+            .order_by(table.c.nodeid, table.c.time)
+        )).all()
+
+        by_node: Dict[int, List[dict]] = {}
+        for row in rows:
+            by_node.setdefault(row[0], []).append(dict(zip(names, row[1:])))
+
+        # Ёмкость на узел: вдвое больше самого плотного узла окна (не меньше MIN_CAPACITY),
+        # но не больше лимита точек и доли лимита памяти
+        densest = max((len(node_rows) for node_rows in by_node.values()), default=0)
+        slots = int(self.max_bytes // _SLOT_BYTES)
+        self.capacity = max(min(self.max_points, max(densest * 2, MIN_CAPACITY), slots // max(len(by_node), 1)), 1)
+        self.rings = {}
+        self.excluded = set()
+        self.complete_from = to_micros(date_from)
+        kinds = {}
+        for nodeid, node_rows in by_node.items():
+            kind = node_cache.value_kinds.get(nodeid) or value_kind(node_rows[-1])
+            if kind is None:
+                self.excluded.add(nodeid)
+                continue
+            kinds[nodeid] = kind
+            ring = self._new_ring(nodeid, kind)
+            if ring is not None:
+                ring.append(*self._arrays(node_rows, kind))
+        node_cache.set_value_kinds(kinds)
+        self.warmed = True
+        logger.info(f"Hot tier warmed with {len(rows)} rows for {len(self.rings)} nodes ({self.memory_bytes() / 2**20:.1f} MB)")
+
+    def update(self, rows: Iterable[dict]):
+        """Применяет новые записи (словари nodeid + поля истории)."""
+        if not self.warmed:
+            return
+        by_node: Dict[int, List[dict]] = {}
+        for row in rows:
+            by_node.setdefault(row["nodeid"], []).append(row)
+        for nodeid, node_rows in by_node.items():
+            if nodeid in self.excluded:
+                continue
+            ring = self.rings.get(nodeid)
+            if ring is None:
+                kind = node_cache.value_kinds.get(nodeid) or value_kind(node_rows[-1])
+                if kind is None:
+                    self.excluded.add(nodeid)
+                    continue
+                ring = self._new_ring(nodeid, kind)
+                if ring is None:
+                    continue
+            node_rows.sort(key=lambda row: row["time"])
+            times, values, qualities = self._arrays(node_rows, ring.kind)
+            newest = int(ring.times[ring.end - 1]) if len(ring) else None
+            if newest is None or times[0] > newest:
+                ring.append(times, values, qualities)
+            else:
+                for time, value, quality in zip(times.tolist(), values.tolist(), qualities.tolist()):
+                    ring.upsert(time, value, quality)
+            ring.trim(int(ring.times[ring.end - 1]) - self.window)
+
+    def _answerable(self, filters: Optional[HistoryFilters], fields: Optional[Tuple[str, ...]]) -> bool:
+        if fields is None:
+            # Полные записи (actualtime, recordtype, ...) в памяти не хранятся
+            return False
+        if filters is not None and (filters.recordtype or filters.appid):
+            return False
+        return all(field in HOT_FIELDS or field in VALUE_KIND_COLUMNS.values() for field in fields)
+
+    def _covered(self, ring: Optional[NodeRing], date_from: int, fields: Tuple[str, ...]) -> bool:
+        if ring is None:
+            return self.complete_from is not None and date_from >= self.complete_from
+        if date_from < ring.complete_from:
+            return False
+        # Столбец значения другого типа узла — null во всех записях, его проще взять из БД
+        return all(field in HOT_FIELDS or field == VALUE_KIND_COLUMNS[ring.kind] for field in fields)
+
+    def _nodeids(self, nodeid: NodeIds) -> Optional[List[int]]:
+        single = single_nodeid(nodeid)
+        if single is not None:
+            return [single]
+        if nodeid and not isinstance(nodeid, int):
+            return sorted(set(nodeid))
+        # Все узлы: из памяти, только если ни один узел не исключён
+        return None if self.excluded else sorted(self.rings)
+
+    def covers(self, nodeid: NodeIds, date_from: Optional[datetime], filters: Optional[HistoryFilters], fields: Optional[Tuple[str, ...]]) -> bool:
+        """Можно ли ответить на запрос /data из памяти."""
+        covered = self.warmed and date_from is not None and self._answerable(filters, fields)
+        if covered:
+            nodeids = self._nodeids(nodeid)
+            start = to_micros(date_from)
+            covered = nodeids is not None and all(
+                node not in self.excluded and self._covered(self.rings.get(node), start, fields)
+                for node in nodeids
+            )
+        if covered:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return covered
+
+    def _select(self, nodeid: NodeIds, date_from: datetime, date_to: Optional[datetime], limit: int, filters: Optional[HistoryFilters]):
+        start = to_micros(date_from)
+        end = to_micros(date_to) if date_to is not None else None
+        qualities = filters.quality if filters is not None else ()
+        for node in self._nodeids(nodeid) or ():
+            ring = self.rings.get(node)
+            if ring is not None:
+                indices = ring.select(start, end, limit, qualities)
+                if len(indices):
+                    yield node, ring, indices
+
+    async def get_history(self, session, nodeid: NodeIds, date_from: datetime, date_to: Optional[datetime], limit: int, filters: Optional[HistoryFilters], fields: Tuple[str, ...]) -> List[dict]:
+        """Ответ в форме get_nodes_history с проекцией fields; вызывается после covers()."""
+        selected = list(self._select(nodeid, date_from, date_to, limit, filters))
+        nodes = await node_cache.get_nodes(session, [node for node, _, _ in selected])
+        result = []
+        for node, ring, indices in selected:
+            if node not in nodes:
+                continue
+            columns = {"time": ring.times[indices].astype("datetime64[us]").tolist()}
+            value_column = VALUE_KIND_COLUMNS[ring.kind]
+            if "value" in fields or value_column in fields:
+                values = ring.values[indices].tolist()
+                if ring.kind == "double":
+                    values = [None if value != value else value for value in values]
+                else:
+                    values = [None if value != value else int(value) for value in values]
+                columns["value"] = columns[value_column] = values
+            if "quality" in fields:
+                columns["quality"] = [None if quality == QUALITY_MISSING else quality for quality in ring.qualities[indices].tolist()]
+            history = [dict(zip(fields, items)) for items in zip(*[columns[field] for field in fields])]
+            item = {"nodeid": node, "tagname": nodes[node]["tagname"], "history": history}
+            if "value" in fields:
+                item["value_kind"] = ring.kind
+            result.append(item)
+        return result
+
+    def node_versions(self, nodeid: NodeIds, date_from: datetime, date_to: Optional[datetime], filters: Optional[HistoryFilters] = None) -> Tuple[Tuple[int, datetime], ...]:
+        """Время последней записи каждого узла выборки по данным в памяти — как get_node_versions, без запроса к БД."""
+        return tuple(
+            (node, _EPOCH + timedelta(microseconds=int(ring.times[indices[0]])))
+            for node, ring, indices in self._select(nodeid, date_from, date_to, 1, filters)
+        )
+
+    def memory_bytes(self) -> int:
+        return len(self.rings) * self.capacity * _SLOT_BYTES
+
+    def stats(self) -> dict:
+        return {
+            "warmed": self.warmed,
+            "nodes": len(self.rings),
+            "excluded_nodes": len(self.excluded),
+            "capacity_per_node": self.capacity,
+            "points": sum(len(ring) for ring in self.rings.values()),
+            "memory_mb": round(self.memory_bytes() / 2**20, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+hot_tier = HotTier(settings.HOT_TIER_WINDOW, settings.HOT_TIER_MAX_MB * 2**20, settings.HOT_TIER_MAX_POINTS)
@@ -0,0 +1,242 @@
+from sqlalchemy import text, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from pydantic import TypeAdapter, ValidationError
+from db.models import SensorData, Node
+from crud.node_cache import node_cache
+from crud.latest import latest_values
+from crud.facets import facet_index
+from crud.hot_tier import hot_tier
+from crud.alarms import alarm_engine
+from crud.rollups import mark_rollups_dirty
+from core.http_cache import mark_history_written
+from core.config import settings
+from schemas.nodes import SensorReadingSchema
+from typing import Iterable, List
+from datetime import timezone
+import asyncio
+import csv
+import io
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+HISTORY_COLUMNS = [column.name for column in SensorData.__table__.columns]
+VALUE_COLUMNS = [name for name in HISTORY_COLUMNS if name not in ("nodeid", "time")]
+CONFLICT_POLICIES = ("ignore", "update", "error")
+
+_readings_adapter = TypeAdapter(List[SensorReadingSchema])
+
+# Ограничение числа одновременных загрузок (backpressure)
+_ingest_slots = asyncio.Semaphore(settings.INGEST_MAX_CONCURRENCY)
+
+
+class IngestError(ValueError):
+    """Некорректные входные данные для загрузки."""
+
+
+class IngestBusyError(RuntimeError):
+    """Все слоты загрузки заняты дольше INGEST_QUEUE_TIMEOUT."""
+
+
+def parse_readings(body: bytes, content_type: str) -> list:
+    """Разбирает тело запроса: JSON-массив, NDJSON или CSV (по Content-Type)."""
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    try:
+        if content_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+            return [json.loads(line) for line in body.splitlines() if line.strip()]
+        if content_type in ("text/csv", "application/csv"):
+            reader = csv.DictReader(io.StringIO(body.decode("utf-8")))
+            # Пустая ячейка CSV — отсутствующее значение
+            return [{key: value for key, value in row.items() if value != ""} for row in reader]
+        data = json.loads(body)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise IngestError(f"Cannot parse request body: {e}")
+    if not isinstance(data, list):
+        raise IngestError("Expected a JSON array of readings")
+    return data
+
+
+def validate_readings(readings: Iterable[dict]) -> List[tuple]:
+    """Проверяет записи по SensorReadingSchema и возвращает кортежи в порядке столбцов nodes_history."""
+    try:
+        models = _readings_adapter.validate_python(list(readings))
+    except ValidationError as e:
+        raise IngestError(str(e))
+    records = []
+    for model in models:
+        row = model.model_dump()
+        # Время хранится без часового пояса в UTC
+        for key in ("time", "actualtime"):
+            value = row[key]
+            if value is not None and value.tzinfo is not None:
+                row[key] = value.astimezone(timezone.utc).replace(tzinfo=None)
+        records.append(tuple(row[name] for name in HISTORY_COLUMNS))
+    return records
+
+
+def _deduplicate(records: List[tuple]) -> List[tuple]:
+    # ON CONFLICT DO UPDATE не допускает повторов ключа в одной команде: оставляем последнюю запись
+    nodeid_index, time_index = HISTORY_COLUMNS.index("nodeid"), HISTORY_COLUMNS.index("time")
+    unique = {}
+    for record in records:
+        unique[(record[nodeid_index], record[time_index])] = record
+    return list(unique.values())
+
+
+def _inserted(records: List[tuple], keys) -> List[tuple]:
+    """Записи пачки, ключи (nodeid, time) которых вернул RETURNING."""
+    keys = {(nodeid, time) for nodeid, time in keys}
+    nodeid_index, time_index = HISTORY_COLUMNS.index("nodeid"), HISTORY_COLUMNS.index("time")
+    return [record for record in records if (record[nodeid_index], record[time_index]) in keys]
+
+
+async def _create_missing_nodes(session, nodeids: set) -> int:
+    known = await node_cache.get_nodes(session, nodeids)
+    missing = sorted(nodeids - set(known))
+    if not missing:
+        return 0
+    dialect_insert = postgresql.insert if session.bind.dialect.name == "postgresql" else sqlite.insert
+    await session.execute(
+        dialect_insert(Node)
+        .values([{"nodeid": nodeid, "tagname": f"node_{nodeid}"} for nodeid in missing])
+        .on_conflict_do_nothing(index_elements=["nodeid"])
+    )
+    return len(missing)
+
+
+async def _copy_batch(session, records: List[tuple], on_conflict: str) -> List[tuple]:
+    """Запись пачки через COPY asyncpg; при upsert — через временную таблицу. Возвращает записанные записи."""
+    connection = await session.connection()
+    raw = await connection.get_raw_connection()
+    driver = raw.driver_connection
+
+    if on_conflict == "error":
+        await driver.copy_records_to_table("nodes_history", records=records, columns=HISTORY_COLUMNS)
+        return records
+
+    await session.execute(text(
+        "CREATE TEMP TABLE IF NOT EXISTS nodes_history_ingest "
+        "(LIKE nodes_history INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+    ))
+    await driver.copy_records_to_table("nodes_history_ingest", records=records, columns=HISTORY_COLUMNS)
+    columns = ", ".join(HISTORY_COLUMNS)
+    if on_conflict == "update":
+        action = "DO UPDATE SET " + ", ".join(f"{name} = EXCLUDED.{name}" for name in VALUE_COLUMNS)
+    else:
+        action = "DO NOTHING"
+    if on_conflict == "update":
+        await session.execute(text(
+            f"INSERT INTO nodes_history ({columns}) SELECT {columns} FROM nodes_history_ingest "
+            f"ON CONFLICT (nodeid, time) {action}"
+        ))
+        return records
+    # Пропущенные дубликаты не попадают в RETURNING
+    inserted = await session.execute(text(
+        f"INSERT INTO nodes_history ({columns}) SELECT {columns} FROM nodes_history_ingest "
+        f"ON CONFLICT (nodeid, time) {action} RETURNING nodeid, time"
+    ))
+    return _inserted(records, inserted.all())
+
+
+async def _insert_batch(session, records: List[tuple], on_conflict: str) -> List[tuple]:
+    """
+    Запись пачки через executemany для драйверов без COPY (SQLite в разработке
+    и бенчмарках). Возвращает записанные записи.
+    """
+    rows = [dict(zip(HISTORY_COLUMNS, record)) for record in records]
+    if on_conflict == "error":
+        await session.execute(insert(SensorData), rows)
+        return records
+    dialect_insert = postgresql.insert if session.bind.dialect.name == "postgresql" else sqlite.insert
+    statement = dialect_insert(SensorData)
+    if on_conflict == "update":
+        statement = statement.on_conflict_do_update(
+            index_elements=["nodeid", "time"],
+            set_={name: statement.excluded[name] for name in VALUE_COLUMNS}
+        )
+        await session.execute(statement, rows)
+        return records
+    statement = statement.on_conflict_do_nothing(index_elements=["nodeid", "time"])
+    # Пропущенные дубликаты не попадают в RETURNING
+    inserted = await session.execute(statement.returning(SensorData.nodeid, SensorData.time), rows)
+    return _inserted(records, inserted.all())
+
+
+def _apply_written(records: List[tuple]):
+    """
+    Передаёт записанные строки хранилищам в памяти. Только строки, которые
+    вернула вставка: пропущенные дубликаты (on_conflict=ignore) не должны
+    подменять значения из БД.
+    """
+    if not records:
+        return
+    nodeid_index = HISTORY_COLUMNS.index("nodeid")
+    written_nodeids = {record[nodeid_index] for record in records}
+    node_cache.mark_history(written_nodeids)
+    mark_history_written(written_nodeids)
+    rows = [dict(zip(HISTORY_COLUMNS, record)) for record in records]
+    latest_values.update(rows)
+    facet_index.update(rows)
+    if settings.HOT_TIER_ENABLED:
+        hot_tier.update(rows)
+    if settings.ALARMS_ENABLED:
+        alarm_engine.update(rows)
+
+async def ingest_readings(session, readings: Iterable[dict], on_conflict: str = "ignore", create_nodes: bool = False, batch_size: int = settings.INGEST_BATCH_SIZE) -> dict:
+    """
+    Загрузка показаний в nodes_history. Записи проверяются по SensorReadingSchema
+    и пишутся пачками по batch_size строк; каждая пачка фиксируется отдельно.
+    on_conflict: "ignore" — пропускать существующие (nodeid, time),
+    "update" — перезаписывать значения, "error" — прямой COPY без проверки.
+    """
+    if on_conflict not in CONFLICT_POLICIES:
+        raise IngestError(f"on_conflict must be one of {CONFLICT_POLICIES}")
+
+    records = validate_readings(readings)
+    received = len(records)
+    if on_conflict != "error":
+        records = _deduplicate(records)
+    if not records:
+        return {"received": received, "written": 0, "batches": 0, "nodes_created": 0}
+
+    try:
+        await asyncio.wait_for(_ingest_slots.acquire(), timeout=settings.INGEST_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise IngestBusyError("Ingest is overloaded, retry later")
+
+    try:
+        nodeid_index = HISTORY_COLUMNS.index("nodeid")
+        nodeids = {record[nodeid_index] for record in records}
+        time_index = HISTORY_COLUMNS.index("time")
+        nodes_created = 0
+        if create_nodes:
+            nodes_created = await _create_missing_nodes(session, nodeids)
+            await session.commit()
+
+        use_copy = session.bind.dialect.driver == "asyncpg"
+        batches = 0
+        written = 0
+        for start in range(0, len(records), batch_size):
+            batch = records[start:start + batch_size]
+            if use_copy:
+                batch = await _copy_batch(session, batch, on_conflict)
+            else:
+                batch = await _insert_batch(session, batch, on_conflict)
+            if settings.ROLLUP_ENABLED and batch:
+                # Вместе с пачкой: агрегаты её корзин пересчитаются при обновлении
+                await mark_rollups_dirty(session, min(record[time_index] for record in batch))
+            await session.commit()
+            # Сразу после фиксации: если следующая пачка упадёт, память не
+            # разойдётся с уже записанными в БД строками
+            _apply_written(batch)
+            written += len(batch)
+            batches += 1
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        _ingest_slots.release()
+
+    logger.info(f"Ingested {written} of {len(records)} readings in {batches} batches")
+    return {"received": received, "written": written, "batches": batches, "nodes_created": nodes_created}
@@ -0,0 +1,123 @@
+from sqlalchemy import select, desc
+from db.models import SensorData
+from crud.nodes import HISTORY_FIELDS, latest_history_query
+from crud.node_cache import node_cache
+from core.serialization import dumps
+from datetime import datetime
+from typing import Iterable, Optional
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class LastValueStore:
+    """
+    Таблица последних значений в памяти: nodeid -> последняя запись истории.
+    Прогревается при старте одним запросом DISTINCT ON (nodeid) и дальше
+    обновляется инкрементально — из опросчика новых записей и из загрузки.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.warmed = False
+        self.updates = 0
+        self._snapshot: Optional[bytes] = None
+
+    def _latest_query(self, dialect_name: str):
+        if dialect_name == "postgresql":
+            table = SensorData.__table__
+            return (
+                select(table.c.nodeid, *[table.c[name] for name in HISTORY_FIELDS])
+                .distinct(table.c.nodeid)
+                .order_by(table.c.nodeid, desc(table.c.time))
+            )
+        # Без DISTINCT ON — тот же оконный запрос "последние N", что и для /data
+        return latest_history_query(limit=1, dialect_name=dialect_name)
+
+    async def warm(self, session):
+        rows = (await session.execute(self._latest_query(session.bind.dialect.name))).all()
+        values = {}
+        for row in rows:
+            value = dict(zip(HISTORY_FIELDS, row[1:]))
+            value["nodeid"] = row[0]
+            values[row[0]] = value
+        nodes = await node_cache.get_nodes(session, values)
+        for nodeid, value in values.items():
+            value["tagname"] = nodes[nodeid]["tagname"] if nodeid in nodes else None
+        self.values = values
+        self.warmed = True
+        self._snapshot = None
+        logger.info(f"Last value store warmed with {len(values)} nodes")
+
+    def update(self, rows: Iterable[dict]):
+        """Применяет новые записи (словари nodeid + HISTORY_FIELDS); старые по времени игнорируются."""
+        changed = False
+        for row in rows:
+            current = self.values.get(row["nodeid"])
+            if current is not None and current["time"] is not None and row["time"] < current["time"]:
+                continue
+            value = {name: row.get(name) for name in HISTORY_FIELDS}
+            value["nodeid"] = row["nodeid"]
+            value["tagname"] = current["tagname"] if current else None
+            self.values[row["nodeid"]] = value
+            changed = True
+        if changed:
+            self.updates += 1
+            self._snapshot = None
+
+    async def fill_tagnames(self, session):
+        """Подставляет имена тегов для узлов, появившихся после прогрева."""
+        missing = [nodeid for nodeid, value in self.values.items() if value["tagname"] is None]
+        if not missing:
+            return
+        nodes = await node_cache.get_nodes(session, missing)
+        for nodeid in missing:
+            if nodeid in nodes:
+                self.values[nodeid]["tagname"] = nodes[nodeid]["tagname"]
+                self._snapshot = None
+
+    def query(self, nodeids: Optional[Iterable[int]] = None, appids: Optional[Iterable[uuid.UUID]] = None, qualities: Optional[Iterable[int]] = None) -> list:
+        if nodeids:
+            values = [self.values[nodeid] for nodeid in nodeids if nodeid in self.values]
+        else:
+            values = self.values.values()
+        if appids:
+            # appid записи — UUID из БД или строка из загрузки
+            appids = {str(appid) for appid in appids}
+            values = [value for value in values if value["appid"] is not None and str(value["appid"]) in appids]
+        if qualities:
+            qualities = set(qualities)
+            values = [value for value in values if value["quality"] in qualities]
+        return list(values)
+
+    def node_versions(self, nodeids: Optional[Iterable[int]], date_from: Optional[datetime] = None, date_to: Optional[datetime] = None) -> Optional[tuple]:
+        """
+        Время последней записи каждого узла выборки по таблице в памяти — как
+        get_node_versions, без запроса к БД. None, если по памяти не ответить:
+        таблица не прогрета или последняя запись узла позже date_to.
+        """
+        if not self.warmed:
+            return None
+        versions = []
+        for nodeid in sorted(set(nodeids)) if nodeids else sorted(self.values):
+            value = self.values.get(nodeid)
+            if value is None or value["time"] is None:
+                continue
+            if date_to is not None and value["time"] > date_to:
+                return None
+            if date_from is None or value["time"] >= date_from:
+                versions.append((nodeid, value["time"]))
+        return tuple(versions)
+
+    def snapshot(self) -> bytes:
+        """Сериализованный снимок всех значений; пересобирается только после изменений."""
+        if self._snapshot is None:
+            self._snapshot = dumps(sorted(self.values.values(), key=lambda value: value["nodeid"]))
+        return self._snapshot
+
+    def stats(self) -> dict:
+        return {"nodes": len(self.values), "warmed": self.warmed, "updates": self.updates}
+
+
+latest_values = LastValueStore()
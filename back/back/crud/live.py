@@ -0,0 +1,177 @@
+from sqlalchemy import select, desc, tuple_
+from db.models import SensorData
+from db.database import AsyncSessionLocal
+from crud.nodes import HISTORY_FIELDS
+from crud.node_cache import node_cache
+from core.config import settings
+from typing import Iterable, Optional
+from datetime import datetime, timedelta
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    def __init__(self, nodeids: Optional[Iterable[int]], maxsize: int):
+        self.nodeids = set(nodeids) if nodeids else None
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def wants(self, nodeid: int) -> bool:
+        return self.nodeids is None or nodeid in self.nodeids
+
+    def push(self, batch: list):
+        # Медленный клиент не должен тормозить остальных: вытесняем самую старую пачку
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(batch)
+
+
+class LiveFeed:
+    """
+    Один общий опросчик nodes_history на процесс, раздающий новые записи
+    всем подписчикам. Нагрузка на БД не зависит от числа открытых дашбордов:
+    один запрос раз в LIVE_POLL_INTERVAL секунд, пока есть хотя бы один подписчик.
+
+    Новые записи читаются страницами по ключу (time, nodeid) после курсора.
+    Строки, записанные с опозданием (в пределах LIVE_LOOKBACK секунд до курсора),
+    находятся по ключам окна перекрытия, которые ещё не выдавались.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal):
+        self.session_factory = session_factory
+        self.subscriptions = set()
+        self.listeners = []
+        self._task: Optional[asyncio.Task] = None
+        # Ключ (time, nodeid) последней выданной записи
+        self._cursor = None
+        self._seen = set()
+        self.polls = 0
+        self.rows_published = 0
+
+    def subscribe(self, nodeids: Optional[Iterable[int]] = None) -> Subscription:
+        subscription = Subscription(nodeids, settings.LIVE_QUEUE_SIZE)
+        self.subscriptions.add(subscription)
+        self._ensure_running()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscriptions.discard(subscription)
+
+    def add_listener(self, callback):
+        """
+        Внутренний потребитель новых записей (например, кэш последних значений).
+        Пока есть слушатели, опросчик работает и без подписчиков.
+        """
+        self.listeners.append(callback)
+        self._ensure_running()
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def publish(self, rows: list):
+        """Раздаёт записи подписчикам; rows — словари nodeid + HISTORY_FIELDS."""
+        if not rows:
+            return
+        node_cache.mark_history({row["nodeid"] for row in rows})
+        for listener in self.listeners:
+            listener(rows)
+        for subscription in list(self.subscriptions):
+            batch = [row for row in rows if subscription.wants(row["nodeid"])]
+            if batch:
+                subscription.push(batch)
+        self.rows_published += len(rows)
+
+    async def _poll(self, session) -> list:
+        lookback = timedelta(seconds=settings.LIVE_LOOKBACK)
+        table = SensorData.__table__
+        if self._cursor is None:
+            # Первый опрос только запоминает уже существующие записи
+            latest = (await session.execute(
+                select(table.c.time, table.c.nodeid)
+                .order_by(desc(table.c.time), desc(table.c.nodeid))
+                .limit(1)
+            )).first()
+            if latest is None:
+                # Пустая история: всё, что появится, считается новым
+                self._cursor = (datetime(1970, 1, 1), -1)
+            else:
+                self._cursor = tuple(latest)
+                self._seen = set((await session.execute(
+                    select(table.c.nodeid, table.c.time)
+                    .where(table.c.time > latest.time - lookback)
+                )).all())
+            return []
+
+        columns = (table.c.nodeid, *[table.c[name] for name in HISTORY_FIELDS])
+        cursor = tuple_(table.c.time, table.c.nodeid)
+
+        # Новые записи — страница по ключу (time, nodeid) после курсора:
+        # курсор сдвигается всегда, сколько бы записей ни было в окне перекрытия
+        items = (await session.execute(
+            select(*columns)
+            .where(cursor > tuple_(*self._cursor))
+            .order_by(table.c.time, table.c.nodeid)
+            .limit(settings.LIVE_BATCH_LIMIT)
+        )).all()
+
+        # Опоздавшие записи — ключи окна перекрытия до курсора, которых ещё не видели;
+        # полные строки читаются только для них
+        keys = (await session.execute(
+            select(table.c.nodeid, table.c.time)
+            .where(table.c.time > self._cursor[0] - lookback)
+            .where(cursor <= tuple_(*self._cursor))
+        )).all()
+        late = [tuple(key) for key in keys if tuple(key) not in self._seen]
+        if late:
+            items = (await session.execute(
+                select(*columns).where(tuple_(table.c.nodeid, table.c.time).in_(late))
+            )).all() + items
+
+        rows = []
+        for item in items:
+            row = dict(zip(HISTORY_FIELDS, item[1:]))
+            row["nodeid"] = item.nodeid
+            rows.append(row)
+            self._seen.add((item.nodeid, item.time))
+
+        if items and (items[-1].time, items[-1].nodeid) > self._cursor:
+            self._cursor = (items[-1].time, items[-1].nodeid)
+        horizon = self._cursor[0] - lookback
+        self._seen = {key for key in self._seen if key[1] > horizon}
+        return rows
+
+    async def _run(self):
+        while self.subscriptions or self.listeners:
+            try:
+                async with self.session_factory() as session:
+                    rows = await self._poll(session)
+                self.polls += 1
+                self.publish(rows)
+            except Exception as e:
+                logger.error(f"Live feed poll failed: {e}")
+            await asyncio.sleep(settings.LIVE_POLL_INTERVAL)
+        # Подписчиков и слушателей не осталось: при следующем запуске начинаем с текущего момента
+        self._cursor = None
+        self._seen = set()
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self.subscriptions),
+            "running": self._task is not None and not self._task.done(),
+            "polls": self.polls,
+            "rows_published": self.rows_published,
+            "dropped_batches": sum(s.dropped for s in self.subscriptions),
+        }
+
+
+live_feed = LiveFeed()
@@ -0,0 +1,122 @@
+from sqlalchemy import select, exists
+from db.models import SensorData, Node
+from core.cache import TTLCache
+from core.config import settings
+from typing import Dict, Iterable, List, Optional
+import time
+
+
+def _node_metadata(node) -> dict:
+    return {
+        "nodeid": node.nodeid,
+        "tagname": node.tagname,
+        "unit": node.unit,
+        "description": node.description,
+        "appid": str(node.appid) if node.appid else None
+    }
+
+
+class NodeCache:
+    """
+    Кэш метаданных узлов (nodeid -> tagname/unit/description/appid),
+    типов значений узлов и индекс "узлы с историей".
+
+    Индекс загружается один раз запросом EXISTS по idx_nodes_history_nodeid_time
+    вместо DISTINCT по всей истории, дополняется через mark_history() при
+    поступлении новых данных и полностью перечитывается раз в TTL.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.metadata = TTLCache(maxsize, ttl)
+        self.ttl = ttl
+        self._history_nodeids = set()
+        self._history_loaded_at: Optional[float] = None
+        self._tagnames: Optional[List[dict]] = None
+        # Тип значения узла (double/int/uint/bool/string) не меняется и не устаревает по TTL
+        self.value_kinds: Dict[int, str] = {}
+        self.history_reloads = 0
+
+    async def get_nodes(self, session, nodeids: Iterable[int]) -> Dict[int, dict]:
+        """Метаданные узлов; отсутствующие в кэше загружаются одним запросом."""
+        result = {}
+        missing = []
+        for nodeid in nodeids:
+            meta = self.metadata.get(nodeid)
+            if meta is None:
+                missing.append(nodeid)
+            else:
+                result[nodeid] = meta
+        if missing:
+            nodes = (await session.execute(
+                select(Node).where(Node.nodeid.in_(missing))
+            )).scalars().all()
+            for node in nodes:
+                meta = _node_metadata(node)
+                self.metadata.set(node.nodeid, meta)
+                result[node.nodeid] = meta
+        return result
+
+    async def get_node(self, session, nodeid: int) -> Optional[dict]:
+        return (await self.get_nodes(session, [nodeid])).get(nodeid)
+
+    def _history_expired(self) -> bool:
+        return self._history_loaded_at is None or time.monotonic() - self._history_loaded_at > self.ttl
+
+    async def get_history_nodeids(self, session) -> set:
+        if self._history_expired():
+            nodeids = (await session.execute(
+                select(Node.nodeid).where(
+                    exists().where(SensorData.nodeid == Node.nodeid)
+                )
+            )).scalars().all()
+            self._history_nodeids = set(nodeids)
+            self._history_loaded_at = time.monotonic()
+            self._tagnames = None
+            self.history_reloads += 1
+        return self._history_nodeids
+
+    async def get_tagnames(self, session) -> List[dict]:
+        history_nodeids = await self.get_history_nodeids(session)
+        if self._tagnames is None:
+            nodes = await self.get_nodes(session, history_nodeids)
+            self._tagnames = [
+                {"nodeid": nodeid, "tagname": nodes[nodeid]["tagname"]}
+                for nodeid in sorted(nodes)
+            ]
+        return self._tagnames
+
+    def get_value_kinds(self, nodeids: Iterable[int]) -> Dict[int, str]:
+        """Известные типы значений узлов; неизвестные определяет crud.nodes.get_value_kinds."""
+        return {nodeid: self.value_kinds[nodeid] for nodeid in nodeids if nodeid in self.value_kinds}
+
+    def set_value_kinds(self, kinds: Dict[int, str]):
+        self.value_kinds.update(kinds)
+
+    def mark_history(self, nodeids: Iterable[int]):
+        """Хук для путей записи: у узлов появились данные в истории."""
+        new = set(nodeids) - self._history_nodeids
+        if new:
+            self._history_nodeids |= new
+            self._tagnames = None
+
+    def invalidate(self, nodeid: Optional[int] = None):
+        """Сбрасывает метаданные узла или, без аргумента, весь кэш."""
+        if nodeid is None:
+            self.metadata.invalidate()
+            self.value_kinds.clear()
+            self._history_loaded_at = None
+        else:
+            self.metadata.invalidate(nodeid)
+            self.value_kinds.pop(nodeid, None)
+        self._tagnames = None
+
+    def stats(self) -> dict:
+        return {
+            "metadata": self.metadata.stats(),
+            "history_nodes": len(self._history_nodeids),
+            "value_kinds": len(self.value_kinds),
+            "history_reloads": self.history_reloads,
+        }
+
+
+node_cache = NodeCache(settings.NODE_CACHE_SIZE, settings.NODE_CACHE_TTL)
@@ -1,121 +1,468 @@
-from sqlalchemy import select, desc, func, distinct
+from sqlalchemy import select, desc, func, cast, extract, literal, tuple_, true, values, column as sql_column, Float, BigInteger, DateTime
 from db.models import SensorData, Node
-from typing import List, Optional
-from datetime import datetime
-
-async def get_nodes_history(session, nodeid: Optional[int] = None, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None) -> List[dict]:
-    try:
-        if not nodeid:
-            # Получаем список узлов с историей
-            history_nodes_query = select(distinct(SensorData.nodeid))
-            if date_from:
-                history_nodes_query = history_nodes_query.where(SensorData.time >= date_from)
-            if date_to:
-                history_nodes_query = history_nodes_query.where(SensorData.time <= date_to)
-            
-            history_node_ids = (await session.execute(history_nodes_query)).scalars().all()
-            if not history_node_ids:
-                return []
-            
-            # Получаем информацию о узлах
-            nodes = (await session.execute(
-                select(Node).where(Node.nodeid.in_(history_node_ids))
-            )).scalars().all()
-            
-            result = []
-            for node in nodes:
-                # Получаем историю для узла
-                subquery = (
-                    select(SensorData)
-                    .where(SensorData.nodeid == node.nodeid)
-                    .order_by(desc(SensorData.time))
-                    .limit(50)
-                )
-                
-                if date_from:
-                    subquery = subquery.where(SensorData.time >= date_from)
-                if date_to:
-                    subquery = subquery.where(SensorData.time <= date_to)
-                
-                history = (await session.execute(subquery)).scalars().all()
-                
-                if history:
-                    result.append({
-                        "nodeid": node.nodeid,
-                        "tagname": node.tagname,
-                        "history": [{
-                            "time": item.time.isoformat(),
-                            "actualtime": item.actualtime.isoformat() if item.actualtime else None,
-                            "valdouble": item.valdouble,
-                            "valint": item.valint,
-                            "valuint": item.valuint,
-                            "valbool": item.valbool,
-                            "valstring": item.valstring,
-                            "quality": item.quality,
-                            "recordtype": item.recordtype,
-                            "appid": str(item.appid) if item.appid else None
-                        } for item in history]
-                    })
-            
-            return result
-            
-        # Если указан nodeid
-        node = (await session.execute(
-            select(Node).where(Node.nodeid == nodeid)
-        )).scalar_one_or_none()
-        
-        if not node:
-            return []
-            
-        # Получаем историю для узла
-        query = select(SensorData).where(SensorData.nodeid == nodeid)
-        
+from crud.rollups import ROLLUP_LEVELS, get_watermarks, rollup_rows
+from crud.node_cache import node_cache
+from db.functions import numeric_value
+from core.config import settings
+from core.downsampling import lttb_indices
+from core.admission import query_errors
+from typing import Dict, Iterable, List, NamedTuple, Optional, AsyncIterator, Sequence, Tuple, Union
+from datetime import datetime, timedelta
+import numpy as np
+import uuid
+
+# Один узел, несколько узлов или все (None)
+NodeIds = Optional[Union[int, Sequence[int]]]
+
+def single_nodeid(nodeid: NodeIds) -> Optional[int]:
+    """ID узла, если запрошен ровно один узел, иначе None."""
+    if isinstance(nodeid, int):
+        return nodeid or None
+    if nodeid and len(nodeid) == 1:
+        return nodeid[0]
+    return None
+
+def filter_nodeids(query, column, nodeid: NodeIds):
+    """Условие на узлы: = для одного, IN для набора; без условия для всех."""
+    single = single_nodeid(nodeid)
+    if single is not None:
+        return query.where(column == single)
+    if nodeid and not isinstance(nodeid, int):
+        return query.where(column.in_(sorted(set(nodeid))))
+    return query
+
+class HistoryFilters(NamedTuple):
+    """Фильтры по значениям записей истории; пустое поле — без условия."""
+    recordtype: Tuple[str, ...] = ()
+    appid: Tuple[uuid.UUID, ...] = ()
+    quality: Tuple[int, ...] = ()
+
+    @classmethod
+    def of(cls, recordtype=None, appid=None, quality=None) -> Optional["HistoryFilters"]:
+        """Нормализованные фильтры (отсортированные, без повторов) или None, если условий нет."""
+        filters = cls(
+            tuple(sorted(set(recordtype or ()))),
+            tuple(sorted(set(appid or ()), key=str)),
+            tuple(sorted(set(quality or ())))
+        )
+        return filters if any(filters) else None
+
+def filter_values(query, table, filters: Optional[HistoryFilters]):
+    """Условия IN по recordtype/appid/quality — фильтрация в SQL, а не на клиенте."""
+    if filters is None:
+        return query
+    if filters.recordtype:
+        query = query.where(table.c.recordtype.in_(filters.recordtype))
+    if filters.appid:
+        query = query.where(table.c.appid.in_(filters.appid))
+    if filters.quality:
+        query = query.where(table.c.quality.in_(filters.quality))
+    return query
+
+HISTORY_FIELDS = (
+    "time", "actualtime", "valdouble", "valint", "valuint",
+    "valbool", "valstring", "quality", "recordtype", "appid"
+)
+
+# Столбец значения для каждого типа узла
+VALUE_KIND_COLUMNS = {
+    "double": "valdouble",
+    "int": "valint",
+    "uint": "valuint",
+    "bool": "valbool",
+    "string": "valstring"
+}
+
+# value — значение из столбца, соответствующего типу узла
+PROJECTABLE_FIELDS = HISTORY_FIELDS + ("value",)
+
+def parse_fields(fields: Optional[Iterable[str]]) -> Optional[Tuple[str, ...]]:
+    """
+    Проекция fields=time,value,quality (через запятую или повтором параметра)
+    в кортеж полей без повторов; time включается всегда и идёт первым.
+    """
+    if not fields:
+        return None
+    names = [name.strip() for item in fields for name in item.split(",") if name.strip()]
+    unknown = sorted(set(names) - set(PROJECTABLE_FIELDS))
+    if unknown:
+        raise ValueError(f"Unknown fields {unknown}, expected a subset of {list(PROJECTABLE_FIELDS)}")
+    result = ["time"]
+    for name in names:
+        if name not in result:
+            result.append(name)
+    return tuple(result)
+
+def _history_range(query, table, date_from: Optional[datetime], date_to: Optional[datetime], filters: Optional[HistoryFilters]):
+    if date_from:
+        query = query.where(table.c.time >= date_from)
+    if date_to:
+        query = query.where(table.c.time <= date_to)
+    return filter_values(query, table, filters)
+
+def node_set(nodeid: NodeIds):
+    """
+    Узлы для LATERAL: запрошенные — списком VALUES (история узла без строки
+    в nodes тоже попадает в ответ), без списка — все известные из nodes.
+    """
+    if nodeid and not isinstance(nodeid, int):
+        return values(sql_column("nodeid", BigInteger), name="n").data([(value,) for value in sorted(set(nodeid))])
+    return select(Node.nodeid).subquery("n")
+
+def latest_history_query(nodeid: NodeIds = None, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None, limit: int = settings.HISTORY_LIMIT, filters: Optional[HistoryFilters] = None, fields: Sequence[str] = HISTORY_FIELDS, dialect_name: str = "postgresql"):
+    """
+    Один запрос "последние N записей на узел".
+
+    Для одного узла — ORDER BY time DESC LIMIT N. Для нескольких узлов в
+    PostgreSQL — LATERAL по запрошенным узлам (или всем из nodes) с тем же
+    ORDER BY time DESC LIMIT N внутри: каждый узел читается обратным проходом
+    по idx_nodes_history_nodeid_time и останавливается после N строк, так что
+    стоимость не зависит от глубины истории. В SQLite (без LATERAL) — окно
+    ROW_NUMBER() OVER (PARTITION BY nodeid ORDER BY time DESC) с отбором
+    rn <= N; оно нумерует всю историю выбранных узлов.
+    Выбираются простые кортежи (nodeid, *fields) без ORM-объектов; fields должны включать time.
+    """
+    table = SensorData.__table__
+    columns = [table.c.nodeid] + [table.c[name] for name in fields]
+    single = single_nodeid(nodeid)
+    if single is not None:
+        query = (
+            select(*columns)
+            .where(table.c.nodeid == single)
+            .order_by(desc(table.c.time))
+            .limit(limit)
+        )
+        return _history_range(query, table, date_from, date_to, filters)
+
+    if dialect_name == "postgresql":
+        nodes = node_set(nodeid)
+        top = _history_range(
+            select(*columns).where(table.c.nodeid == nodes.c.nodeid),
+            table, date_from, date_to, filters
+        ).order_by(desc(table.c.time)).limit(limit).lateral("h")
+        return (
+            select(*[top.c[column.name] for column in columns])
+            .select_from(nodes.join(top, true()))
+            .order_by(top.c.nodeid, desc(top.c.time))
+        )
+
+    rn = func.row_number().over(
+        partition_by=table.c.nodeid,
+        order_by=desc(table.c.time)
+    ).label("rn")
+    inner = _history_range(filter_nodeids(select(*columns, rn), table.c.nodeid, nodeid), table, date_from, date_to, filters)
+    subquery = inner.subquery()
+    return (
+        select(*[subquery.c[column.name] for column in columns])
+        .where(subquery.c.rn <= limit)
+        .order_by(subquery.c.nodeid, desc(subquery.c.time))
+    )
+
+class HistoryProjection(NamedTuple):
+    """Поля ответа, выбираемые столбцы и тип значения каждого узла."""
+    fields: Tuple[str, ...]
+    columns: Tuple[str, ...]
+    value_kinds: Dict[int, str]
+
+def value_kind(values: dict) -> Optional[str]:
+    """Тип значения записи по первому заполненному столбцу значения."""
+    for kind, column in VALUE_KIND_COLUMNS.items():
+        if values.get(column) is not None:
+            return kind
+    return None
+
+async def get_value_kinds(session, nodeids: Iterable[int]) -> Dict[int, str]:
+    """
+    Типы значений узлов. Определяются один раз по последней записи узла
+    (одним запросом на все неизвестные узлы) и хранятся в кэше узлов.
+    """
+    nodeids = set(nodeids)
+    kinds = node_cache.get_value_kinds(nodeids)
+    missing = nodeids - set(kinds)
+    if missing:
+        query = latest_history_query(sorted(missing), limit=1, dialect_name=session.bind.dialect.name)
+        rows = (await session.execute(query)).all()
+        detected = {}
+        for row in rows:
+            kind = value_kind(dict(zip(HISTORY_FIELDS, row[1:])))
+            if kind is not None:
+                detected[row[0]] = kind
+        node_cache.set_value_kinds(detected)
+        kinds.update(detected)
+    return kinds
+
+async def plan_projection(session, nodeid: NodeIds, fields: Tuple[str, ...]) -> HistoryProjection:
+    """
+    Набор столбцов для проекции fields. Для поля value выбираются только
+    столбцы значений тех типов, что есть среди запрошенных узлов:
+    для числовых тегов это один valdouble вместо пяти столбцов значений.
+    """
+    kinds = {}
+    if "value" in fields:
+        single = single_nodeid(nodeid)
+        if single is not None:
+            nodeids = [single]
+        elif nodeid and not isinstance(nodeid, int):
+            nodeids = nodeid
+        else:
+            nodeids = await node_cache.get_history_nodeids(session)
+        kinds = await get_value_kinds(session, nodeids)
+    wanted = set(fields) | {VALUE_KIND_COLUMNS[kind] for kind in kinds.values()}
+    columns = tuple(name for name in HISTORY_FIELDS if name in wanted)
+    return HistoryProjection(fields, columns, kinds)
+
+def group_history(rows, nodes: dict, projection: Optional[HistoryProjection] = None) -> List[dict]:
+    """
+    Группирует кортежи (nodeid, *HISTORY_FIELDS), упорядоченные по nodeid,
+    в форму NodeSchema за один проход. Строки узлов, которых нет в nodes, пропускаются.
+    Значения остаются как есть (datetime, UUID) — их сериализует кодировщик ответа.
+    С projection строки содержат (nodeid, *projection.columns), а записи — только
+    поля projection.fields; value берётся из столбца значения узла.
+    """
+    result = []
+    current = None
+    current_nodeid = None
+    skip = False
+    names = HISTORY_FIELDS
+    positions = None
+    for row in rows:
+        row_nodeid = row[0]
+        if row_nodeid != current_nodeid:
+            current_nodeid = row_nodeid
+            node = nodes.get(row_nodeid)
+            skip = node is None
+            if not skip:
+                current = {"nodeid": row_nodeid, "tagname": node["tagname"], "history": []}
+                if projection is not None:
+                    names = projection.fields
+                    kind = projection.value_kinds.get(row_nodeid)
+                    # Позиции полей в строке; 0 — значение неизвестного типа
+                    positions = []
+                    for name in names:
+                        column = VALUE_KIND_COLUMNS.get(kind) if name == "value" else name
+                        positions.append(1 + projection.columns.index(column) if column else 0)
+                    if "value" in names:
+                        current["value_kind"] = kind
+                result.append(current)
+        if not skip:
+            if positions is None:
+                current["history"].append(dict(zip(names, row[1:])))
+            else:
+                current["history"].append(dict(zip(names, [row[i] if i else None for i in positions])))
+    return result
+
+async def get_history_rows(session, nodeid: NodeIds = None, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None, limit: int = settings.HISTORY_LIMIT, filters: Optional[HistoryFilters] = None, columns: Sequence[str] = HISTORY_FIELDS):
+    """Строки истории (nodeid, *columns) и метаданные их узлов."""
+    rows = (await session.execute(
+        latest_history_query(nodeid, date_from, date_to, limit, filters, columns, session.bind.dialect.name)
+    )).all()
+    # Метаданные узлов берутся из кэша, а не из nodes при каждом опросе
+    nodes = await node_cache.get_nodes(session, {row[0] for row in rows})
+    return rows, nodes
+
+@query_errors(list)
+async def get_nodes_history(session, nodeid: NodeIds = None, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None, limit: int = settings.HISTORY_LIMIT, filters: Optional[HistoryFilters] = None, fields: Optional[Tuple[str, ...]] = None) -> List[dict]:
+    if fields is None:
+        rows, nodes = await get_history_rows(session, nodeid, date_from, date_to, limit, filters)
+        return group_history(rows, nodes)
+    projection = await plan_projection(session, nodeid, fields)
+    rows, nodes = await get_history_rows(session, nodeid, date_from, date_to, limit, filters, projection.columns)
+    return group_history(rows, nodes, projection)
+
+async def get_node_versions(session, nodeid: NodeIds = None, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None, filters: Optional[HistoryFilters] = None) -> Tuple[Tuple[int, datetime], ...]:
+    """
+    Время последней записи каждого узла выборки. Версия по узлам меняется, даже
+    если новая запись одного узла старше последней записи другого.
+    Тот же запрос "последние N", что и для /data, с N = 1: для каждого узла
+    одна строка с конца idx_nodes_history_nodeid_time, а не max(time) по
+    GROUP BY, который читает все записи периода.
+    """
+    query = latest_history_query(nodeid, date_from, date_to, 1, filters, ("time",), session.bind.dialect.name)
+    return tuple((row[0], row[1]) for row in (await session.execute(query)).all())
+
+async def _history_bounds(session, nodeid: NodeIds, date_from: Optional[datetime], date_to: Optional[datetime], filters: Optional[HistoryFilters] = None):
+    if date_from and date_to:
+        return date_from, date_to
+    query = select(func.min(SensorData.time), func.max(SensorData.time))
+    query = filter_nodeids(query, SensorData.nodeid, nodeid)
+    if date_from:
+        query = query.where(SensorData.time >= date_from)
+    if date_to:
+        query = query.where(SensorData.time <= date_to)
+    query = filter_values(query, SensorData.__table__, filters)
+    first, last = (await session.execute(query)).one()
+    return date_from or first, date_to or last
+
+@query_errors(list)
+async def get_nodes_downsampled(session, nodeid: NodeIds = None, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None, points: int = settings.DOWNSAMPLE_POINTS, method: str = "buckets", filters: Optional[HistoryFilters] = None) -> List[dict]:
+    """
+    Прореживание истории до фиксированного числа точек на узел.
+    Агрегация min/max/avg по временным корзинам выполняется в SQL, поэтому
+    стоимость запроса определяется числом точек, а не длиной периода.
+    Для method="lttb" SQL строит в DOWNSAMPLE_LTTB_OVERSAMPLE раз больше корзин,
+    а итоговые точки выбираются алгоритмом LTTB на NumPy.
+    """
+    date_from, date_to = await _history_bounds(session, nodeid, date_from, date_to, filters)
+    if date_from is None or date_to is None:
+        return []
+
+    buckets = points * settings.DOWNSAMPLE_LTTB_OVERSAMPLE if method == "lttb" else points
+    # Небольшой запас, чтобы запись ровно в date_to попала в последнюю корзину
+    width = ((date_to - date_from).total_seconds() + 1e-6) / buckets
+
+    value = numeric_value()
+    offset = extract("epoch", SensorData.time) - extract("epoch", literal(date_from, DateTime))
+    bucket = cast(func.floor(offset / literal(width, Float)), BigInteger).label("bucket")
+
+    query = (
+        select(
+            SensorData.nodeid,
+            Node.tagname,
+            bucket,
+            func.min(value),
+            func.max(value),
+            func.avg(value),
+            func.count(value)
+        )
+        .join(Node, Node.nodeid == SensorData.nodeid)
+        .where(SensorData.time >= date_from)
+        .where(SensorData.time <= date_to)
+        .where(value.is_not(None))
+        .group_by(SensorData.nodeid, Node.tagname, bucket)
+        .order_by(SensorData.nodeid, bucket)
+    )
+    query = filter_nodeids(query, SensorData.nodeid, nodeid)
+    query = filter_values(query, SensorData.__table__, filters)
+
+    rows = (await session.execute(query)).all()
+
+    result = []
+    current = None
+    for row_nodeid, tagname, row_bucket, vmin, vmax, vavg, count in rows:
+        if current is None or current["nodeid"] != row_nodeid:
+            current = {
+                "nodeid": row_nodeid,
+                "tagname": tagname,
+                "method": method,
+                "bucket_seconds": width,
+                "points": []
+            }
+            result.append(current)
+        current["points"].append({
+            "time": date_from + timedelta(seconds=row_bucket * width),
+            "value": float(vavg) if vavg is not None else None,
+            "min": vmin,
+            "max": vmax,
+            "count": count
+        })
+
+    if method == "lttb":
+        for node in result:
+            node_points = node["points"]
+            if len(node_points) <= points:
+                continue
+            x = np.fromiter((p["time"].timestamp() for p in node_points), dtype=np.float64, count=len(node_points))
+            y = np.fromiter((p["value"] for p in node_points), dtype=np.float64, count=len(node_points))
+            node["points"] = [node_points[i] for i in lttb_indices(x, y, points)]
+
+    return result
+
+def plan_rollup(date_from: datetime, date_to: datetime, points: int, resolution: Optional[float] = None):
+    """
+    Выбирает самый грубый уровень агрегации, корзина которого не больше
+    запрошенного разрешения (по умолчанию — длина периода / points).
+    None означает, что нужны исходные данные (в том числе при выключенных агрегатах).
+    """
+    if not settings.ROLLUP_ENABLED:
+        return None
+    wanted = resolution or (date_to - date_from).total_seconds() / points
+    for level in reversed(ROLLUP_LEVELS):
+        if level[2] <= wanted:
+            return level
+    return None
+
+@query_errors(list)
+async def get_nodes_rollup(session, nodeid: NodeIds = None, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None, points: int = settings.DOWNSAMPLE_POINTS, resolution: Optional[float] = None, filters: Optional[HistoryFilters] = None) -> List[dict]:
+    date_from, date_to = await _history_bounds(session, nodeid, date_from, date_to, filters)
+    if date_from is None or date_to is None:
+        return []
+
+    # Агрегаты не разделены по recordtype/appid/quality: с фильтрами нужны исходные данные
+    level = plan_rollup(date_from, date_to, points, resolution) if filters is None else None
+    if level is None:
+        # Период слишком короткий для агрегатов — прореживаем исходные данные
+        result = await get_nodes_downsampled(session, nodeid, date_from, date_to, points, filters=filters)
+        for node in result:
+            node["resolution"] = "raw"
+        return result
+
+    name = level[0]
+    nodeids = sorted({nodeid} if isinstance(nodeid, int) else set(nodeid)) if nodeid else None
+    watermark = (await get_watermarks(session)).get(name)
+    rows = rollup_rows(level, date_from, date_to, watermark, nodeids).subquery()
+    query = (
+        select(rows, Node.tagname)
+        .join(Node, Node.nodeid == rows.c.nodeid)
+        .order_by(rows.c.nodeid, rows.c.bucket)
+    )
+
+    result = []
+    current = None
+    for item in (await session.execute(query)).all():
+        if current is None or current["nodeid"] != item.nodeid:
+            current = {"nodeid": item.nodeid, "tagname": item.tagname, "resolution": name, "points": []}
+            result.append(current)
+        current["points"].append({
+            "time": item.bucket,
+            "value": item.sum_value / item.count if item.count else None,
+            "min": item.min_value,
+            "max": item.max_value,
+            "count": item.count or 0,
+            "bad_count": item.bad_count,
+            "first_value": item.first_value,
+            "last_value": item.last_value
+        })
+    return result
+
+EXPORT_COLUMNS = (
+    "nodeid", "time", "actualtime", "valdouble", "valint", "valuint",
+    "valbool", "valstring", "quality", "recordtype", "appid"
+)
+
+async def iter_history_pages(session, nodeid: Optional[int] = None, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None, page_size: int = settings.EXPORT_PAGE_SIZE, filters: Optional[HistoryFilters] = None) -> AsyncIterator[list]:
+    """
+    Постраничный обход истории по ключу (nodeid, time) без OFFSET:
+    каждая страница начинается строго после последней строки предыдущей
+    и читается по первичному ключу. В памяти держится не больше одной страницы.
+    """
+    last = None
+    while True:
+        query = (
+            select(*[getattr(SensorData, column) for column in EXPORT_COLUMNS])
+            .order_by(SensorData.nodeid, SensorData.time)
+            .limit(page_size)
+        )
+        if nodeid:
+            query = query.where(SensorData.nodeid == nodeid)
         if date_from:
             query = query.where(SensorData.time >= date_from)
         if date_to:
             query = query.where(SensorData.time <= date_to)
-            
-        query = query.order_by(desc(SensorData.time)).limit(50)
-        history = (await session.execute(query)).scalars().all()
-        
-        if not history:
-            return []
-            
-        return [{
-            "nodeid": node.nodeid,
-            "tagname": node.tagname,
-            "history": [{
-                "time": item.time.isoformat(),
-                "actualtime": item.actualtime.isoformat() if item.actualtime else None,
-                "valdouble": item.valdouble,
-                "valint": item.valint,
-                "valuint": item.valuint,
-                "valbool": item.valbool,
-                "valstring": item.valstring,
-                "quality": item.quality,
-                "recordtype": item.recordtype,
-                "appid": str(item.appid) if item.appid else None
-            } for item in history]
-        }]
-        
-    except Exception:
-        return []
+        query = filter_values(query, SensorData.__table__, filters)
+        if last is not None:
+            query = query.where(tuple_(SensorData.nodeid, SensorData.time) > tuple_(*last))
+
+        rows = (await session.execute(query)).all()
+        # Завершаем транзакцию после каждой страницы, чтобы не держать снимок
+        # и соединение на всё время длинной выгрузки
+        await session.commit()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < page_size:
+            return
+        last = (rows[-1].nodeid, rows[-1].time)
 
+@query_errors(list)
 async def get_all_tagnames(session) -> List[dict]:
-    try:
-        # Получаем список узлов с историей
-        history_node_ids = (await session.execute(
-            select(distinct(SensorData.nodeid))
-        )).scalars().all()
-        
-        if not history_node_ids:
-            return []
-        
-        # Получаем информацию о узлах
-        nodes = (await session.execute(
-            select(Node).where(Node.nodeid.in_(history_node_ids))
-        )).scalars().all()
-        
-        return [{"nodeid": node.nodeid, "tagname": node.tagname} for node in nodes]
-    except Exception:
-        return [] 
\ No newline at end of file
+    return await node_cache.get_tagnames(session)
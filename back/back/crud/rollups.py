@@ -0,0 +1,227 @@
+from sqlalchemy import select, func, case, delete, insert, update, union_all
+from db.models import SensorData, SensorRollup1m, SensorRollup1h, SensorRollup1d, RollupWatermark
+from db.functions import time_bucket, numeric_value
+from core.config import settings
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Уровни агрегации: имя, единица усечения, длина корзины в секундах, таблица.
+# Каждый уровень строится из предыдущего (первый — из nodes_history).
+ROLLUP_LEVELS = (
+    ("1m", "minute", 60, SensorRollup1m),
+    ("1h", "hour", 3600, SensorRollup1h),
+    ("1d", "day", 86400, SensorRollup1d),
+)
+
+ROLLUP_COLUMNS = (
+    "nodeid", "bucket", "min_value", "max_value", "sum_value", "count",
+    "bad_count", "first_value", "first_time", "last_value", "last_time"
+)
+
+
+def truncate_time(value: datetime, unit: str) -> datetime:
+    """Python-аналог time_bucket для границ периодов."""
+    value = value.replace(second=0, microsecond=0)
+    if unit in ("hour", "day", "month"):
+        value = value.replace(minute=0)
+    if unit in ("day", "month"):
+        value = value.replace(hour=0)
+    if unit == "month":
+        value = value.replace(day=1)
+    return value
+
+
+def _raw_source(unit: str, start: Optional[datetime], end: Optional[datetime] = None, nodeids: Optional[List[int]] = None):
+    value = numeric_value()
+    bucket = time_bucket(unit, SensorData.time)
+    query = select(
+        SensorData.nodeid.label("nodeid"),
+        bucket.label("bucket"),
+        value.label("min_v"),
+        value.label("max_v"),
+        value.label("sum_v"),
+        case((value.is_not(None), 1), else_=0).label("count_v"),
+        case((func.coalesce(SensorData.quality, 0) < settings.ROLLUP_GOOD_QUALITY, 1), else_=0).label("bad_v"),
+        value.label("first_v"),
+        SensorData.time.label("first_t"),
+        value.label("last_v"),
+        SensorData.time.label("last_t"),
+        func.row_number().over(partition_by=(SensorData.nodeid, bucket), order_by=SensorData.time).label("rn_first"),
+        func.row_number().over(partition_by=(SensorData.nodeid, bucket), order_by=SensorData.time.desc()).label("rn_last"),
+    )
+    if start is not None:
+        query = query.where(SensorData.time >= start)
+    if end is not None:
+        query = query.where(SensorData.time <= end)
+    if nodeids:
+        query = query.where(SensorData.nodeid.in_(nodeids))
+    return query.subquery()
+
+
+def _rollup_source(unit: str, model, start: Optional[datetime]):
+    bucket = time_bucket(unit, model.bucket)
+    query = select(
+        model.nodeid.label("nodeid"),
+        bucket.label("bucket"),
+        model.min_value.label("min_v"),
+        model.max_value.label("max_v"),
+        model.sum_value.label("sum_v"),
+        model.count.label("count_v"),
+        model.bad_count.label("bad_v"),
+        model.first_value.label("first_v"),
+        model.first_time.label("first_t"),
+        model.last_value.label("last_v"),
+        model.last_time.label("last_t"),
+        func.row_number().over(partition_by=(model.nodeid, bucket), order_by=model.bucket).label("rn_first"),
+        func.row_number().over(partition_by=(model.nodeid, bucket), order_by=model.bucket.desc()).label("rn_last"),
+    )
+    if start is not None:
+        query = query.where(model.bucket >= start)
+    return query.subquery()
+
+
+def _aggregate(source):
+    columns = (
+        source.c.nodeid,
+        source.c.bucket,
+        func.min(source.c.min_v),
+        func.max(source.c.max_v),
+        func.sum(source.c.sum_v),
+        func.sum(source.c.count_v),
+        func.sum(source.c.bad_v),
+        func.max(case((source.c.rn_first == 1, source.c.first_v))),
+        func.min(source.c.first_t),
+        func.max(case((source.c.rn_last == 1, source.c.last_v))),
+        func.max(source.c.last_t),
+    )
+    return (
+        select(*[column.label(name) for column, name in zip(columns, ROLLUP_COLUMNS)])
+        .group_by(source.c.nodeid, source.c.bucket)
+    )
+
+
+def rollup_rows(level, date_from: datetime, date_to: datetime, watermark: Optional[datetime], nodeids: Optional[List[int]] = None):
+    """
+    Строки уровня агрегации за период: готовые корзины до водяного знака
+    из таблицы уровня, после него — агрегаты исходных данных на лету
+    (данные, ещё не попавшие в агрегаты, и корзины, помеченные загрузкой
+    как изменённые). Без водяного знака всё считается по исходным данным.
+    """
+    _, unit, _, model = level
+    start = truncate_time(date_from, unit)
+    fresh_from = max(start, watermark) if watermark is not None else start
+    fresh = _aggregate(_raw_source(unit, fresh_from, date_to, nodeids))
+    if watermark is None or watermark <= start:
+        return fresh
+    stored = (
+        select(*[model.__table__.c[name] for name in ROLLUP_COLUMNS])
+        .where(model.bucket >= start)
+        .where(model.bucket <= date_to)
+        .where(model.bucket < watermark)
+    )
+    if nodeids:
+        stored = stored.where(model.nodeid.in_(nodeids))
+    return union_all(stored, fresh)
+
+
+async def _get_watermark(session, name: str) -> Optional[datetime]:
+    return (await session.execute(
+        select(RollupWatermark.watermark).where(RollupWatermark.name == name)
+    )).scalar_one_or_none()
+
+
+async def get_watermarks(session) -> Dict[str, datetime]:
+    """Водяные знаки уровней: корзины раньше знака в таблицах агрегатов полны."""
+    rows = (await session.execute(select(RollupWatermark.name, RollupWatermark.watermark))).all()
+    return {name: watermark for name, watermark in rows if watermark is not None}
+
+
+async def _set_watermark(session, name: str, watermark: datetime, previous: Optional[datetime]):
+    if previous is None:
+        updated = await session.execute(
+            update(RollupWatermark)
+            .where(RollupWatermark.name == name)
+            .values(watermark=watermark)
+        )
+        if not updated.rowcount:
+            await session.execute(insert(RollupWatermark).values(name=name, watermark=watermark))
+        return
+    # Только если знак не опустила загрузка во время пересчёта: иначе
+    # помеченные ею корзины остаются к следующему обновлению
+    await session.execute(
+        update(RollupWatermark)
+        .where(RollupWatermark.name == name)
+        .where(RollupWatermark.watermark == previous)
+        .values(watermark=watermark)
+    )
+
+
+async def mark_rollups_dirty(session, since: datetime):
+    """
+    Опускает водяные знаки до корзин, содержащих since, — вызывается
+    в транзакции загрузки: опоздавшие и дозагруженные записи попадут в
+    агрегаты при следующем обновлении, а до него читаются из исходных данных.
+    """
+    for name, unit, _, _ in ROLLUP_LEVELS:
+        bucket = truncate_time(since, unit)
+        await session.execute(
+            update(RollupWatermark)
+            .where(RollupWatermark.name == name)
+            .where(RollupWatermark.watermark > bucket)
+            .values(watermark=bucket)
+        )
+
+
+async def refresh_rollups(session) -> dict:
+    """
+    Инкрементальное обновление агрегатов. Для каждого уровня пересчитываются
+    только корзины начиная с водяного знака; остальные строки не трогаются.
+    Новый знак отстаёт от последней записи на ROLLUP_LATENESS секунд, чтобы
+    записи узлов, отстающих от остальных, попадали в пересчёт; более
+    старые записи опускают знак сами (mark_rollups_dirty при загрузке).
+    """
+    latest = (await session.execute(select(func.max(SensorData.time)))).scalar()
+    if latest is None:
+        return {}
+    settled = latest - timedelta(seconds=settings.ROLLUP_LATENESS)
+
+    refreshed = {}
+    source_model = None
+    for name, unit, _, model in ROLLUP_LEVELS:
+        start = await _get_watermark(session, name)
+
+        source = _raw_source(unit, start) if source_model is None else _rollup_source(unit, source_model, start)
+
+        clear = delete(model)
+        if start is not None:
+            clear = clear.where(model.bucket >= start)
+        await session.execute(clear)
+        result = await session.execute(
+            insert(model).from_select(list(ROLLUP_COLUMNS), _aggregate(source))
+        )
+
+        watermark = truncate_time(settled, unit)
+        if start is not None:
+            watermark = max(watermark, start)
+        await _set_watermark(session, name, watermark, start)
+        refreshed[name] = result.rowcount
+        source_model = model
+
+    await session.commit()
+    logger.info(f"Rollups refreshed: {refreshed}")
+    return refreshed
+
+
+async def run_rollup_refresher(session_factory, interval: float = settings.ROLLUP_REFRESH_INTERVAL):
+    """Фоновая задача: периодически обновляет агрегаты."""
+    while True:
+        try:
+            async with session_factory() as session:
+                await refresh_rollups(session)
+        except Exception as e:
+            logger.error(f"Error refreshing rollups: {e}")
+        await asyncio.sleep(interval)
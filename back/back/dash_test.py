@@ -3,17 +3,160 @@ from dash import dcc, html, Input, Output, State
 import pandas as pd
 import dash_bootstrap_components as dbc
 import requests
+import threading
+import time
+from functools import lru_cache
 
 API_URL = "http://localhost:8000/api/v1/data"
 
-def fetch_data_from_api():
-    response = requests.get(API_URL)
+COLUMNS = ['nodeid', 'tagname', 'time', 'valdouble', 'quality', 'recordtype', 'appid']
+# Поля записей для графика и локальных фильтров
+FIELDS = 'valdouble,quality,recordtype,appid'
+
+REFRESH_INTERVAL = 10                  # не чаще одного запроса к API за интервал
+WINDOW = pd.Timedelta(hours=1)         # сколько истории держать в памяти
+OVERLAP = pd.Timedelta(seconds=5)      # перекрытие для записей, пришедших с опозданием
+FETCH_LIMIT = 1000                     # записей на узел за один запрос
+
+def fetch_data_from_api(params=None):
+    response = requests.get(API_URL, params=params)
     response.raise_for_status()
-    data = response.json()
-    df = pd.DataFrame(data)
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    rows = [
+        {**item, 'nodeid': node['nodeid'], 'tagname': node['tagname']}
+        for node in response.json()
+        for item in node['history']
+    ]
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    df['timestamp'] = pd.to_datetime(df['time'])
     return df
 
+def as_list(value):
+    # Dropdown с multi=True может вернуть одно значение строкой
+    if not value:
+        return None
+    return [value] if isinstance(value, str) else value
+
+def as_key(value):
+    # Хешируемое значение фильтра для мемоизации
+    value = as_list(value)
+    return tuple(sorted(value)) if value else None
+
+
+class DataStore:
+    """
+    Общий для всех сессий и callback'ов кэш последних данных в памяти процесса.
+    Обновляется не чаще раза в REFRESH_INTERVAL секунд и инкрементально:
+    запрашиваются только записи новее последнего известного time (с небольшим
+    перекрытием), хвост перекрытия заменяется свежими данными, записи старше
+    WINDOW отбрасываются. После обновления заранее строится разбиение по узлам,
+    а version меняется, сбрасывая мемоизированные фильтры и графики.
+    """
+
+    def __init__(self):
+        self.df = pd.DataFrame(columns=COLUMNS + ['timestamp'])
+        self.by_node = {}
+        self.last_time = None
+        self.version = 0
+        self.refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with self._lock:
+            if time.monotonic() - self.refreshed_at < REFRESH_INTERVAL:
+                return
+            params = {'limit': FETCH_LIMIT, 'fields': FIELDS}
+            if self.last_time is not None:
+                params['date_from'] = (self.last_time - OVERLAP).isoformat()
+            try:
+                new = fetch_data_from_api(params)
+            except requests.RequestException as e:
+                print(f"Не удалось обновить данные: {e}")
+                return
+            finally:
+                self.refreshed_at = time.monotonic()
+            if new.empty:
+                return
+
+            df = self.df
+            if self.last_time is not None:
+                overlap = df['timestamp'] >= self.last_time - OVERLAP
+                # Пришло только уже известное перекрытие: версия не меняется, мемоизация сохраняется
+                if new['timestamp'].max() <= self.last_time and len(new) == overlap.sum():
+                    return
+                df = df[~overlap]
+            df = pd.concat([df, new], ignore_index=True) if not df.empty else new
+            self.last_time = df['timestamp'].max()
+            df = df[df['timestamp'] >= self.last_time - WINDOW]
+            df = df.sort_values(['nodeid', 'timestamp'], ignore_index=True)
+
+            # Новые объекты подменяются целиком: читатели без блокировки видят согласованный снимок
+            self.by_node = {nodeid: group for nodeid, group in df.groupby('nodeid', sort=True)}
+            self.df = df
+            self.version += 1
+            print(f"Кэш обновлён: +{len(new)} строк, всего {len(df)}")
+
+    def covers(self, start_date):
+        """Диапазон с началом start_date целиком есть в кэше."""
+        if not start_date:
+            return True
+        return not self.df.empty and pd.Timestamp(start_date) >= self.df['timestamp'].min()
+
+
+store = DataStore()
+
+
+@lru_cache(maxsize=4)
+def filter_options(version):
+    df = store.df
+    nodes = df[['nodeid', 'tagname']].drop_duplicates('nodeid').sort_values('nodeid')
+    return (
+        [{'label': f"{nodeid} — {tagname}", 'value': str(nodeid)} for nodeid, tagname in nodes.itertuples(index=False)],
+        [{'label': str(i), 'value': str(i)} for i in sorted(df['recordtype'].dropna().unique())],
+        [{'label': str(i), 'value': str(i)} for i in sorted(df['appid'].dropna().unique())],
+        [{'label': str(int(i)), 'value': str(int(i))} for i in sorted(df['quality'].dropna().unique())],
+    )
+
+
+@lru_cache(maxsize=64)
+def filtered_nodes(version, nodeids, recordtypes, appids, qualities, start_date, end_date):
+    """Отфильтрованные строки по узлам; одинаковые фильтры разных сессий считаются один раз."""
+    if nodeids:
+        groups = {int(n): store.by_node[int(n)] for n in nodeids if int(n) in store.by_node}
+    else:
+        groups = store.by_node
+    result = {}
+    for nodeid, node_df in groups.items():
+        mask = pd.Series(True, index=node_df.index)
+        if recordtypes:
+            mask &= node_df['recordtype'].isin(recordtypes)
+        if appids:
+            mask &= node_df['appid'].isin(appids)
+        if qualities:
+            mask &= node_df['quality'].isin([int(q) for q in qualities])
+        if start_date:
+            mask &= node_df['timestamp'] >= pd.Timestamp(start_date)
+        if end_date:
+            # Конец диапазона — дата включительно
+            mask &= node_df['timestamp'] < pd.Timestamp(end_date) + pd.Timedelta(days=1)
+        if mask.any():
+            result[nodeid] = node_df if mask.all() else node_df[mask]
+    return result
+
+
+def fetch_range(nodeids, recordtypes, appids, qualities, start_date, end_date):
+    """Диапазон раньше окна кэша: запрос с фильтрами на сервере."""
+    df = fetch_data_from_api({
+        'nodeid': as_list(nodeids),
+        'recordtype': as_list(recordtypes),
+        'appid': as_list(appids),
+        'quality': as_list(qualities),
+        'date_from': start_date,
+        'date_to': end_date,
+        'limit': FETCH_LIMIT,
+        'fields': FIELDS,
+    })
+    return {nodeid: node_df for nodeid, node_df in df.sort_values('timestamp').groupby('nodeid')}
+
 # 🎨 Dash-приложение с Bootstrap
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.FLATLY])
 app.title = "📈 Monitoring Dashboard"
@@ -71,13 +214,8 @@ app.layout = dbc.Container([
     Input('auto-refresh', 'n_intervals')
 )
 def update_filter_options(_):
-    df = fetch_data_from_api()
-    return (
-        [{'label': str(i), 'value': str(i)} for i in sorted(df['nodeid'].dropna().unique())],
-        [{'label': str(i), 'value': str(i)} for i in sorted(df['recordtype'].dropna().unique())],
-        [{'label': str(i), 'value': str(i)} for i in sorted(df['appid'].dropna().unique())],
-        [{'label': str(i), 'value': str(i)} for i in sorted(df['quality'].dropna().unique())],
-    )
+    store.refresh()
+    return filter_options(store.version)
 
 
 # 📈 Обновление графика
@@ -95,44 +233,24 @@ def update_graph(_, nodeids, recordtypes, appids, qualities, start_date, end_dat
     print(f"Фильтры: nodeids={nodeids}, recordtypes={recordtypes}, appids={appids}, qualities={qualities}")
     print(f"Временные фильтры: start_date={start_date}, end_date={end_date}")
     
-    df = fetch_data_from_api()
+    store.refresh()
+    filters = (as_key(nodeids), as_key(recordtypes), as_key(appids), as_key(qualities), start_date, end_date)
+    if store.covers(start_date):
+        return build_figure(store.version, *filters)
+    # Вне окна кэша: без мемоизации, данные берутся с сервера при каждом обновлении
+    return make_figure(fetch_range(*filters))
 
-    # Преобразуем UUID в строки
-    df['appid'] = df['appid'].astype(str)
 
-    # Фильтрация
-    if nodeids:
-        # Если в фильтре только одно значение, обрабатываем как список
-        if isinstance(nodeids, str):
-            nodeids = [nodeids]
-        df = df[df['nodeid'].isin(nodeids)]
-
-    if recordtypes:
-        if isinstance(recordtypes, str):
-            recordtypes = [recordtypes]
-        df = df[df['recordtype'].isin(recordtypes)]
-
-    if appids:
-        if isinstance(appids, str):
-            appids = [appids]
-        df = df[df['appid'].isin(appids)]
-
-    if qualities:
-        if isinstance(qualities, str):
-            qualities = [qualities]
-        df = df[df['quality'].isin(qualities)]
-
-    if start_date:
-        df = df[df['timestamp'] >= pd.to_datetime(start_date)]
-    if end_date:
-        df = df[df['timestamp'] <= pd.to_datetime(end_date)]
-
-    print(f"После фильтрации: {len(df)} строк")
-
-    # Группировка и построение графика
+@lru_cache(maxsize=64)
+def build_figure(version, *filters):
+    return make_figure(filtered_nodes(version, *filters))
+
+
+def make_figure(groups):
+    print(f"На графике: {sum(len(node_df) for node_df in groups.values())} строк")
+
     traces = []
-    for nodeid in df['nodeid'].unique():
-        node_df = df[df['nodeid'] == nodeid]
+    for nodeid, node_df in groups.items():
         traces.append({
             'x': node_df['timestamp'],
             'y': node_df['valdouble'],
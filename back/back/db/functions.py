@@ -0,0 +1,50 @@
+from sqlalchemy import func, cast, Float, DateTime, literal_column
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.ext.compiler import compiles
+from db.models import SensorData
+
+# Форматы усечения времени для SQLite (совпадают с форматом хранения DateTime в SQLAlchemy)
+_SQLITE_BUCKET_FORMATS = {
+    "minute": "%Y-%m-%d %H:%M:00.000000",
+    "hour": "%Y-%m-%d %H:00:00.000000",
+    "day": "%Y-%m-%d 00:00:00.000000",
+    "month": "%Y-%m-01 00:00:00.000000",
+}
+
+
+class time_bucket(FunctionElement):
+    """
+    Начало временной корзины ('minute', 'hour', 'day', 'month') для выражения времени.
+    В PostgreSQL компилируется в date_trunc, в SQLite — в strftime.
+    """
+    type = DateTime()
+    name = "time_bucket"
+    inherit_cache = True
+
+    def __init__(self, unit: str, expr):
+        if unit not in _SQLITE_BUCKET_FORMATS:
+            raise ValueError(f"Unsupported time bucket unit: {unit}")
+        # Единица передаётся литералом, чтобы входить в ключ кэша выражения
+        super().__init__(literal_column(f"'{unit}'"), expr)
+
+
+@compiles(time_bucket)
+def _compile_time_bucket(element, compiler, **kw):
+    unit, expr = list(element.clauses)
+    return "date_trunc(%s, %s)" % (compiler.process(unit, **kw), compiler.process(expr, **kw))
+
+
+@compiles(time_bucket, "sqlite")
+def _compile_time_bucket_sqlite(element, compiler, **kw):
+    unit, expr = list(element.clauses)
+    fmt = _SQLITE_BUCKET_FORMATS[unit.name.strip("'")]
+    return "strftime('%s', %s)" % (fmt, compiler.process(expr, **kw))
+
+
+def numeric_value():
+    """Числовое значение записи: valdouble, иначе valint/valuint."""
+    return func.coalesce(
+        SensorData.valdouble,
+        cast(SensorData.valint, Float),
+        cast(SensorData.valuint, Float)
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, BigInteger, Float, DateTime, Boolean, Text, PrimaryKeyConstraint, Index
+from sqlalchemy import Column, Integer, BigInteger, Float, DateTime, Boolean, Text, PrimaryKeyConstraint, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -30,4 +30,55 @@ class Node(Base):
     tagname = Column(Text)
     description = Column(Text)
     unit = Column(Text)
-    appid = Column(UUID(as_uuid=True)) 
\ No newline at end of file
+    appid = Column(UUID(as_uuid=True)) 
+
+class RollupMixin:
+    """Агрегаты истории узла за временную корзину: min/max/sum/count, первое и последнее значение."""
+    nodeid = Column(BigInteger, primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    min_value = Column(Float)
+    max_value = Column(Float)
+    sum_value = Column(Float)
+    count = Column(BigInteger)
+    bad_count = Column(BigInteger)
+    first_value = Column(Float)
+    first_time = Column(DateTime)
+    last_value = Column(Float)
+    last_time = Column(DateTime)
+
+class SensorRollup1m(RollupMixin, Base):
+    __tablename__ = "nodes_history_1m"
+
+class SensorRollup1h(RollupMixin, Base):
+    __tablename__ = "nodes_history_1h"
+
+class SensorRollup1d(RollupMixin, Base):
+    __tablename__ = "nodes_history_1d"
+
+class RollupWatermark(Base):
+    __tablename__ = "rollup_watermarks"
+    name = Column(Text, primary_key=True)
+    watermark = Column(DateTime)
+
+class AlarmRule(Base):
+    """
+    Правило тревоги для узла (nodeid), приложения (appid) или всех узлов.
+    kind: threshold — выход за low/high (возврат с гистерезисом deadband),
+    rate — скорость изменения больше max_rate единиц в секунду,
+    stale — нет новых записей дольше max_age секунд,
+    quality — качество ниже min_quality.
+    """
+    __tablename__ = "alarm_rules"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(Text)
+    kind = Column(Text)
+    nodeid = Column(BigInteger, index=True)
+    appid = Column(UUID(as_uuid=True))
+    low = Column(Float)
+    high = Column(Float)
+    deadband = Column(Float)
+    max_rate = Column(Float)
+    max_age = Column(Float)
+    min_quality = Column(BigInteger)
+    severity = Column(Text)
+    enabled = Column(Boolean)
@@ -0,0 +1,331 @@
+"""
+Секционирование nodes_history по времени (PostgreSQL).
+
+Таблица разбивается декларативно (PARTITION BY RANGE (time)) на дневные
+или месячные секции; записи вне созданных секций (дозагрузка старых данных,
+метки времени дальше PARTITION_PREMAKE) попадают в секцию DEFAULT, а не
+отвергаются. Обслуживание:
+  - заранее создаёт PARTITION_PREMAKE будущих секций;
+  - переносит строки из секции DEFAULT в созданные для них секции;
+  - для секций старше PARTITION_BRIN_AFTER_DAYS заменяет B-tree индекс по time на BRIN;
+  - секции старше PARTITION_RETENTION_DAYS удаляет или переносит в схему
+    PARTITION_ARCHIVE_SCHEMA.
+
+Запуск из каталога back/back:
+    python -m db.partitioning migrate   # перевод существующей таблицы
+    python -m db.partitioning maintain  # однократное обслуживание
+"""
+import asyncio
+import logging
+import sys
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from sqlalchemy import text
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+TABLE = "nodes_history"
+LEGACY_TABLE = "nodes_history_legacy"
+NEW_TABLE = "nodes_history_new"
+MIRROR = "nodes_history_mirror"
+DEFAULT_PARTITION = f"{TABLE}_default"
+
+
+def partition_start(value: datetime, interval: str = None) -> datetime:
+    interval = interval or settings.PARTITION_INTERVAL
+    value = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == "month":
+        value = value.replace(day=1)
+    return value
+
+
+def next_partition_start(start: datetime, interval: str = None) -> datetime:
+    interval = interval or settings.PARTITION_INTERVAL
+    if interval == "month":
+        return (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def partition_name(start: datetime, interval: str = None) -> str:
+    interval = interval or settings.PARTITION_INTERVAL
+    suffix = start.strftime("%Y_%m") if interval == "month" else start.strftime("%Y_%m_%d")
+    return f"{TABLE}_p{suffix}"
+
+
+async def is_partitioned(session) -> bool:
+    return bool((await session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :name AND c.relnamespace = 'public'::regnamespace"
+    ), {"name": TABLE})).scalar())
+
+
+async def list_partitions(session) -> List[Tuple[str, datetime, datetime]]:
+    """Секции nodes_history с границами (from, to), отсортированные по времени."""
+    rows = (await session.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :name"
+    ), {"name": TABLE})).all()
+    partitions = []
+    for name, bound in rows:
+        # FOR VALUES FROM ('2024-01-01 00:00:00') TO ('2024-02-01 00:00:00')
+        parts = bound.split("'")
+        if len(parts) < 4:
+            continue
+        partitions.append((name, datetime.fromisoformat(parts[1]), datetime.fromisoformat(parts[3])))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+async def _table_exists(session, name: str) -> bool:
+    return (await session.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name})).scalar()
+
+
+async def create_default_partition(session, parent: str = TABLE) -> str:
+    await session.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {parent} DEFAULT"))
+    return DEFAULT_PARTITION
+
+
+async def create_partition(session, start: datetime, parent: str = TABLE) -> str:
+    end = next_partition_start(start)
+    name = partition_name(start)
+    if await _table_exists(session, name):
+        return name
+    bounds = f"FOR VALUES FROM ('{start.isoformat(sep=' ')}') TO ('{end.isoformat(sep=' ')}')"
+    if await _table_exists(session, DEFAULT_PARTITION):
+        # Секцию нельзя создать, пока строки её диапазона лежат в DEFAULT:
+        # создаём отдельную таблицу, переносим их и присоединяем её
+        await session.execute(text(f"CREATE TABLE {name} (LIKE {parent} INCLUDING DEFAULTS)"))
+        await session.execute(text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE time >= :start AND time < :end RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ), {"start": start, "end": end})
+        await session.execute(text(f"ALTER TABLE {parent} ATTACH PARTITION {name} {bounds}"))
+    else:
+        await session.execute(text(f"CREATE TABLE {name} PARTITION OF {parent} {bounds}"))
+    # Свежие секции читаются выборочно — обычный B-tree по времени
+    await session.execute(text(f"CREATE INDEX IF NOT EXISTS {name}_time_idx ON {name} (time)"))
+    return name
+
+
+async def create_future_partitions(session, now: datetime = None, parent: str = TABLE) -> List[str]:
+    start = partition_start(now or datetime.utcnow())
+    created = []
+    for _ in range(settings.PARTITION_PREMAKE + 1):
+        created.append(await create_partition(session, start, parent))
+        start = next_partition_start(start)
+    return created
+
+
+async def split_default_partition(session) -> List[str]:
+    """Создаёт секции для строк, попавших в DEFAULT, и переносит их туда."""
+    unit = "month" if settings.PARTITION_INTERVAL == "month" else "day"
+    starts = (await session.execute(text(
+        f"SELECT DISTINCT date_trunc(:unit, time) FROM {DEFAULT_PARTITION} ORDER BY 1"
+    ), {"unit": unit})).scalars().all()
+    return [await create_partition(session, start) for start in starts]
+
+
+async def convert_old_indexes_to_brin(session, now: datetime = None) -> List[str]:
+    """Для старых секций, куда данные уже не пишутся, BRIN по time вместо B-tree."""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=settings.PARTITION_BRIN_AFTER_DAYS)
+    converted = []
+    for name, _, end in await list_partitions(session):
+        if end > cutoff:
+            continue
+        has_btree = (await session.execute(text(
+            "SELECT 1 FROM pg_indexes WHERE tablename = :table AND indexname = :index"
+        ), {"table": name, "index": f"{name}_time_idx"})).scalar()
+        if not has_btree:
+            continue
+        await session.execute(text(f"CREATE INDEX IF NOT EXISTS {name}_time_brin ON {name} USING brin (time)"))
+        await session.execute(text(f"DROP INDEX IF EXISTS {name}_time_idx"))
+        converted.append(name)
+    return converted
+
+
+async def apply_retention(session, now: datetime = None) -> List[str]:
+    """Отсоединяет секции за пределами срока хранения: удаляет или переносит в архивную схему."""
+    if settings.PARTITION_RETENTION_DAYS <= 0:
+        return []
+    cutoff = (now or datetime.utcnow()) - timedelta(days=settings.PARTITION_RETENTION_DAYS)
+    removed = []
+    for name, _, end in await list_partitions(session):
+        if end > cutoff:
+            continue
+        await session.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {name}"))
+        if settings.PARTITION_ARCHIVE_SCHEMA:
+            await session.execute(text(f"CREATE SCHEMA IF NOT EXISTS {settings.PARTITION_ARCHIVE_SCHEMA}"))
+            await session.execute(text(f"ALTER TABLE {name} SET SCHEMA {settings.PARTITION_ARCHIVE_SCHEMA}"))
+        else:
+            await session.execute(text(f"DROP TABLE {name}"))
+        removed.append(name)
+    return removed
+
+
+async def maintain_partitions(session, now: datetime = None) -> dict:
+    if not await is_partitioned(session):
+        logger.warning(f"Table {TABLE} is not partitioned, run `python -m db.partitioning migrate`")
+        return {}
+    result = {
+        "default": await create_default_partition(session),
+        "created": await create_future_partitions(session, now),
+        "split": await split_default_partition(session),
+        "brin": await convert_old_indexes_to_brin(session, now),
+        "removed": await apply_retention(session, now),
+    }
+    logger.info(f"Partition maintenance: {result}")
+    return result
+
+
+async def prepare_partitioned_copy(session, now: datetime = None) -> None:
+    """
+    Создаёт секционированную nodes_history_new рядом с рабочей таблицей:
+    секции без пропусков от первых данных до текущего времени, будущие секции
+    и DEFAULT. Триггер на рабочей таблице повторяет в ней каждую запись,
+    изменение и удаление, пока идёт перенос.
+    """
+    # Остатки прерванного переноса: он начинается заново
+    await session.execute(text(f"DROP TRIGGER IF EXISTS {MIRROR} ON {TABLE}"))
+    await session.execute(text(f"DROP TABLE IF EXISTS {NEW_TABLE} CASCADE"))
+    await session.execute(text(
+        f"CREATE TABLE {NEW_TABLE} (LIKE {TABLE} INCLUDING DEFAULTS, "
+        f"PRIMARY KEY (nodeid, time)) PARTITION BY RANGE (time)"
+    ))
+    await session.execute(text(f"CREATE INDEX idx_nodes_history_nodeid_time_new ON {NEW_TABLE} (nodeid, time)"))
+
+    now = now or datetime.utcnow()
+    first = (await session.execute(text(f"SELECT min(time) FROM {TABLE}"))).scalar()
+    if first is not None:
+        # Секции идут подряд до текущего времени: загрузка в промежуток
+        # между старыми данными и сегодняшним днём не должна попадать в DEFAULT
+        start = partition_start(first)
+        while start < partition_start(now):
+            await create_partition(session, start, NEW_TABLE)
+            start = next_partition_start(start)
+    await create_future_partitions(session, now, NEW_TABLE)
+    await create_default_partition(session, NEW_TABLE)
+
+    columns = [row[0] for row in (await session.execute(text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = 'public' AND table_name = :name ORDER BY ordinal_position"
+    ), {"name": TABLE})).all()]
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns)
+    # Запись триггера главнее копии: при конфликте с уже перенесённой строкой она её заменяет
+    await session.execute(text(f"""
+        CREATE OR REPLACE FUNCTION {MIRROR}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                DELETE FROM {NEW_TABLE} WHERE nodeid = OLD.nodeid AND time = OLD.time;
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                INSERT INTO {NEW_TABLE} SELECT NEW.* ON CONFLICT (nodeid, time) DO UPDATE SET {updates};
+            END IF;
+            RETURN NULL;
+        END $$
+    """))
+    await session.execute(text(
+        f"CREATE TRIGGER {MIRROR} AFTER INSERT OR UPDATE OR DELETE ON {TABLE} "
+        f"FOR EACH ROW EXECUTE FUNCTION {MIRROR}()"
+    ))
+    await session.commit()
+
+
+async def copy_legacy_rows(session, batch_size: int = None) -> Tuple[int, int]:
+    """
+    Переносит строки рабочей таблицы в nodes_history_new пачками по первичному
+    ключу (nodeid, time); каждая пачка — отдельная короткая транзакция, запись
+    в рабочую таблицу не блокируется. Строки, уже записанные триггером,
+    не перезаписываются. Возвращает (строк, пачек).
+    """
+    batch_size = batch_size or settings.PARTITION_MIGRATE_BATCH
+    copied = batches = 0
+    last = None
+    while True:
+        after = "WHERE (nodeid, time) > (:nodeid, :time)" if last else ""
+        row = (await session.execute(text(
+            f"WITH batch AS (SELECT * FROM {TABLE} {after} ORDER BY nodeid, time LIMIT :limit), "
+            f"copied AS (INSERT INTO {NEW_TABLE} SELECT * FROM batch ON CONFLICT (nodeid, time) DO NOTHING) "
+            f"SELECT (SELECT count(*) FROM batch), nodeid, time FROM batch ORDER BY nodeid DESC, time DESC LIMIT 1"
+        ), dict(limit=batch_size, **(last or {})))).first()
+        await session.commit()
+        if row is None:
+            break
+        count = row[0]
+        copied += count
+        batches += 1
+        last = {"nodeid": row[1], "time": row[2]}
+        if count < batch_size:
+            break
+    return copied, batches
+
+
+async def swap_partitioned_table(session) -> None:
+    """
+    Одна короткая транзакция: рабочая таблица становится nodes_history_legacy,
+    nodes_history_new — nodes_history; триггер переноса удаляется.
+    """
+    await session.execute(text(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE"))
+    await session.execute(text(f"DROP TRIGGER {MIRROR} ON {TABLE}"))
+    await session.execute(text(f"DROP FUNCTION {MIRROR}()"))
+    await session.execute(text(f"ALTER TABLE {TABLE} RENAME TO {LEGACY_TABLE}"))
+    for index in ("idx_nodes_history_nodeid_time", "idx_nodes_history_time", "ix_nodes_history_nodeid"):
+        await session.execute(text(f"ALTER INDEX IF EXISTS {index} RENAME TO {index}_legacy"))
+    await session.execute(text(f"ALTER TABLE {LEGACY_TABLE} RENAME CONSTRAINT {TABLE}_pkey TO {LEGACY_TABLE}_pkey"))
+    await session.execute(text(f"ALTER TABLE {NEW_TABLE} RENAME TO {TABLE}"))
+    await session.execute(text(f"ALTER TABLE {TABLE} RENAME CONSTRAINT {NEW_TABLE}_pkey TO {TABLE}_pkey"))
+    await session.execute(text("ALTER INDEX idx_nodes_history_nodeid_time_new RENAME TO idx_nodes_history_nodeid_time"))
+    await session.commit()
+
+
+async def migrate_to_partitioned(session, now: datetime = None) -> dict:
+    """
+    Перевод обычной nodes_history в секционированную без остановки записи:
+    секционированная копия с триггером, перенос пачками по
+    PARTITION_MIGRATE_BATCH строк и переименование в короткой транзакции.
+    Блокировка на всё время копирования не берётся; место под вторую копию
+    истории нужно, пока nodes_history_legacy не удалена вручную после проверки.
+    Удаление строки, параллельное переносу её пачки, может не повториться в копии.
+    """
+    if await is_partitioned(session):
+        return {"migrated": False, "reason": "already partitioned"}
+    await prepare_partitioned_copy(session, now)
+    copied, batches = await copy_legacy_rows(session)
+    await swap_partitioned_table(session)
+    return {"migrated": True, "rows": copied, "batches": batches}
+
+
+async def run_partition_maintenance(session_factory, interval: float = settings.PARTITION_MAINTENANCE_INTERVAL):
+    """Фоновая задача: периодическое обслуживание секций."""
+    while True:
+        try:
+            async with session_factory() as session:
+                await maintain_partitions(session)
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Error maintaining partitions: {e}")
+        await asyncio.sleep(interval)
+
+
+async def _main(command: str):
+    from db.database import engine, AsyncSessionLocal
+    try:
+        async with AsyncSessionLocal() as session:
+            if command == "migrate":
+                print(await migrate_to_partitioned(session))
+            print(await maintain_partitions(session))
+            await session.commit()
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else "maintain"
+    if command not in ("migrate", "maintain"):
+        sys.exit(__doc__)
+    asyncio.run(_main(command))
@@ -1,8 +1,74 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+import asyncio
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from api.v1.endpoints import router as api_router
+from core.config import settings
+from db.database import AsyncSessionLocal, explain_sampler
+from core.metrics import MetricsMiddleware, registry, PROMETHEUS_MEDIA_TYPE
+from core.admission import OverloadedError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from crud.rollups import run_rollup_refresher
+from db.partitioning import run_partition_maintenance
+from crud.live import live_feed
+from crud.latest import latest_values
+from crud.facets import facet_index
+from crud.hot_tier import hot_tier
+from crud.alarms import alarm_engine, run_stale_checker
+import logging
 
-app = FastAPI(title="Sensor Monitoring API")
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Фоновые задачи приложения
+    tasks = []
+    if settings.LATEST_ENABLED:
+        try:
+            async with AsyncSessionLocal() as session:
+                await latest_values.warm(session)
+        except Exception as e:
+            logger.error(f"Error warming last value store: {e}")
+        try:
+            async with AsyncSessionLocal() as session:
+                await facet_index.warm(session)
+        except Exception as e:
+            logger.error(f"Error warming facet index: {e}")
+        live_feed.add_listener(latest_values.update)
+        live_feed.add_listener(facet_index.update)
+    if settings.HOT_TIER_ENABLED:
+        try:
+            async with AsyncSessionLocal() as session:
+                await hot_tier.warm(session)
+        except Exception as e:
+            logger.error(f"Error warming hot tier: {e}")
+        live_feed.add_listener(hot_tier.update)
+    if settings.ALARMS_ENABLED:
+        try:
+            async with AsyncSessionLocal() as session:
+                await alarm_engine.load_rules(session)
+            # Состояние тревог восстанавливается по последним значениям узлов
+            alarm_engine.update(latest_values.values.values())
+        except Exception as e:
+            logger.error(f"Error loading alarm rules: {e}")
+        live_feed.add_listener(alarm_engine.update)
+        tasks.append(asyncio.create_task(run_stale_checker()))
+    if settings.PARTITION_ENABLED:
+        tasks.append(asyncio.create_task(run_partition_maintenance(AsyncSessionLocal)))
+    if settings.DB_EXPLAIN_SAMPLE_RATE > 0:
+        tasks.append(asyncio.create_task(explain_sampler.run()))
+    if settings.ROLLUP_ENABLED:
+        tasks.append(asyncio.create_task(run_rollup_refresher(AsyncSessionLocal)))
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await live_feed.stop()
+
+
+app = FastAPI(title="Sensor Monitoring API", lifespan=lifespan)
 
 # Настройка CORS
 app.add_middleware(
@@ -13,9 +79,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Метрики запросов: задержка, размер ответа, время и число запросов к БД по маршрутам
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, exclude_paths=settings.METRICS_EXCLUDE_PATHS)
+
+# Перегрузка (очередь заполнена, таймаут выражения, пул исчерпан) — 503 с Retry-After,
+# чтобы клиенты повторяли запрос позже, а не сразу
+@app.exception_handler(OverloadedError)
+async def overloaded_handler(request: Request, exc: OverloadedError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(settings.OVERLOAD_RETRY_AFTER)},
+    )
+
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Database connection pool exhausted, retry later"},
+        headers={"Retry-After": str(settings.OVERLOAD_RETRY_AFTER)},
+    )
+
 # Подключаем роутер API
 app.include_router(api_router, prefix="/api/v1")
 
 @app.get("/")
 async def root():
     return {"message": "Sensor Monitoring API is running"}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(content=registry.render(), media_type=PROMETHEUS_MEDIA_TYPE)
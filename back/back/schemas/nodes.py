@@ -1,5 +1,6 @@
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from core.config import settings
+from typing import Optional, List, Literal
 import datetime
 import uuid
 
@@ -18,6 +19,26 @@ class SensorHistorySchema(BaseModel):
     class Config:
         orm_mode = True
 
+class SensorReadingSchema(SensorHistorySchema):
+    """Запись для загрузки в nodes_history: nodeid и time обязательны, остальное — нет."""
+    nodeid: int
+    time: datetime.datetime
+    actualtime: Optional[datetime.datetime] = None
+    valint: Optional[int] = None
+    valuint: Optional[int] = None
+    valdouble: Optional[float] = None
+    valbool: Optional[bool] = None
+    valstring: Optional[str] = None
+    quality: Optional[int] = None
+    recordtype: Optional[str] = None
+    appid: Optional[uuid.UUID] = None
+
+class IngestResultSchema(BaseModel):
+    received: int
+    written: int
+    batches: int
+    nodes_created: int
+
 class NodeSchema(BaseModel):
     nodeid: int
     tagname: str
@@ -31,4 +52,105 @@ class NodeShortSchema(BaseModel):
     tagname: str
 
     class Config:
-        orm_mode = True 
\ No newline at end of file
+        orm_mode = True 
+
+class DownsampledPointSchema(BaseModel):
+    time: datetime.datetime
+    value: Optional[float]
+    min: Optional[float]
+    max: Optional[float]
+    count: int
+
+class DownsampledNodeSchema(BaseModel):
+    nodeid: int
+    tagname: str
+    method: str
+    bucket_seconds: float
+    points: List[DownsampledPointSchema]
+
+class RollupPointSchema(DownsampledPointSchema):
+    bad_count: Optional[int] = None
+    first_value: Optional[float] = None
+    last_value: Optional[float] = None
+
+class RollupNodeSchema(BaseModel):
+    nodeid: int
+    tagname: str
+    resolution: str
+    points: List[RollupPointSchema]
+
+class HistoryQuerySchema(BaseModel):
+    """Запрос истории сразу по набору узлов с общими параметрами."""
+    nodeids: List[int] = Field(..., min_length=1)
+    date_from: Optional[datetime.datetime] = None
+    date_to: Optional[datetime.datetime] = None
+    limit: int = Field(settings.HISTORY_LIMIT, ge=1, le=settings.HISTORY_MAX_LIMIT)
+    recordtype: Optional[List[str]] = None
+    appid: Optional[List[uuid.UUID]] = None
+    quality: Optional[List[int]] = None
+    # Проекция полей записей, как fields= у /data
+    fields: Optional[List[str]] = None
+    # Если задано points или resolution, возвращаются агрегаты (как /data/rollup)
+    points: Optional[int] = Field(None, ge=3, le=settings.DOWNSAMPLE_MAX_POINTS)
+    resolution: Optional[float] = Field(None, gt=0)
+
+class AlignedSchema(BaseModel):
+    """Значения узлов на общей сетке времени: столбец time и столбец values на узел."""
+    start: datetime.datetime
+    step: float
+    fill: str
+    time: List[datetime.datetime]
+    nodeids: List[int]
+    tagnames: List[str]
+    values: List[List[Optional[float]]]
+
+class AlarmRuleSchema(BaseModel):
+    """Правило тревоги; без nodeid и appid действует на все узлы."""
+    name: str
+    kind: Literal["threshold", "rate", "stale", "quality"]
+    nodeid: Optional[int] = None
+    appid: Optional[uuid.UUID] = None
+    low: Optional[float] = None
+    high: Optional[float] = None
+    deadband: Optional[float] = Field(None, ge=0)
+    max_rate: Optional[float] = Field(None, gt=0)
+    max_age: Optional[float] = Field(None, gt=0)
+    min_quality: Optional[int] = None
+    severity: str = "warning"
+    enabled: bool = True
+
+    @model_validator(mode="after")
+    def check_kind_parameters(self):
+        required = {"threshold": None, "rate": "max_rate", "stale": "max_age", "quality": "min_quality"}[self.kind]
+        if self.kind == "threshold" and self.low is None and self.high is None:
+            raise ValueError("threshold rule needs low and/or high")
+        if required and getattr(self, required) is None:
+            raise ValueError(f"{self.kind} rule needs {required}")
+        return self
+
+class AlarmRuleOutSchema(AlarmRuleSchema):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+
+class AlarmSchema(BaseModel):
+    rule_id: int
+    rule: Optional[str]
+    kind: str
+    severity: Optional[str]
+    nodeid: int
+    tagname: Optional[str]
+    message: str
+    raised_at: datetime.datetime
+    value: Optional[float]
+    last_time: datetime.datetime
+    last_value: Optional[float]
+
+class FacetsSchema(BaseModel):
+    """Различные значения для фильтров дашборда."""
+    nodes: List[NodeShortSchema]
+    recordtype: List[str]
+    appid: List[str]
+    quality: List[int]
+    date_from: Optional[datetime.datetime] = None
+    date_to: Optional[datetime.datetime] = None
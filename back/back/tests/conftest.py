@@ -0,0 +1,88 @@
+"""
+Общая подготовка БД для тестов: пустая схема во временном файле SQLite
+или, для проверок PostgreSQL-only кода, в базе из переменной PG_URL.
+
+Запуск из каталога back/back: python -m pytest -q tests
+PG_URL=postgresql+asyncpg://user@host/db python -m pytest -q tests
+(база PG_URL очищается тестами — только отдельная тестовая база)
+"""
+import asyncio
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from api.v1.endpoints import router
+from core.http_cache import response_cache
+from crud.node_cache import node_cache
+from db.database import get_db
+from db.models import Base
+
+
+@pytest.fixture(autouse=True)
+def _reset_caches():
+    """Кэши процесса не переживают тест: в каждом тесте своя база с теми же nodeid."""
+    yield
+    node_cache.invalidate()
+    response_cache.invalidate()
+
+
+@pytest.fixture
+def database_url(tmp_path):
+    return f"sqlite+aiosqlite:///{tmp_path / 'test.db'}"
+
+
+@pytest.fixture
+def pg_url():
+    url = os.environ.get("PG_URL")
+    if not url:
+        pytest.skip("PG_URL не задан")
+    return url
+
+
+def _runner(url):
+    def run(check):
+        """Выполняет check(engine, session_factory) на пустой схеме."""
+        async def main():
+            engine = create_async_engine(url)
+            try:
+                async with engine.begin() as conn:
+                    await conn.run_sync(Base.metadata.drop_all)
+                    await conn.run_sync(Base.metadata.create_all)
+                await check(engine, sessionmaker(engine, class_=AsyncSession))
+            finally:
+                await engine.dispose()
+        asyncio.run(main())
+    return run
+
+
+@pytest.fixture
+def run_db(database_url):
+    return _runner(database_url)
+
+
+@pytest.fixture
+def run_pg(pg_url):
+    return _runner(pg_url)
+
+
+@pytest.fixture
+def api_client(database_url):
+    """Клиент API v1 поверх той же базы, что и run_db (схема создаётся через run_db)."""
+    # Клиент работает в своём цикле событий: соединения не переиспользуются между циклами
+    engine = create_async_engine(database_url, poolclass=NullPool)
+    session_factory = sessionmaker(engine, class_=AsyncSession)
+
+    async def session():
+        async with session_factory() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(router, prefix="/api/v1")
+    app.dependency_overrides[get_db] = session
+    with TestClient(app) as client:
+        yield client
@@ -0,0 +1,139 @@
+"""
+Ошибки запросов к БД: таймаут выражения и исчерпание пула — перегрузка
+(503), а не пустой результат. Объединение одинаковых запросов (результат,
+исключение и отмена первого) и ограничитель (очередь, отказ, таймаут
+ожидания); одинаковые запросы занимают один слот ограничителя.
+"""
+import asyncio
+
+import pytest
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+
+from core.admission import AdmissionLimiter, OverloadedError, QueryTimeoutError, SingleFlight, query_errors
+
+
+class _Canceled(Exception):
+    sqlstate = "57014"
+
+
+def _failing(error, default=list):
+    @query_errors(default)
+    async def query():
+        raise error
+    return query
+
+
+def test_query_errors_keeps_overload_and_falls_back_otherwise():
+    with pytest.raises(PoolTimeoutError):
+        asyncio.run(_failing(PoolTimeoutError("QueuePool limit reached"))())
+    with pytest.raises(QueryTimeoutError):
+        asyncio.run(_failing(OperationalError("SELECT 1", {}, _Canceled()))())
+    with pytest.raises(QueryTimeoutError):
+        asyncio.run(_failing(asyncio.TimeoutError())())
+    assert asyncio.run(_failing(ValueError("broken row"))()) == []
+    with pytest.raises(ValueError):
+        asyncio.run(_failing(ValueError("broken row"), None)())
+
+
+def test_single_flight_shares_result_and_error():
+    async def main():
+        flights = SingleFlight()
+        release = asyncio.Event()
+        calls = []
+
+        async def work(value):
+            calls.append(value)
+            await release.wait()
+            if isinstance(value, Exception):
+                raise value
+            return value
+
+        waiters = [asyncio.create_task(flights.do("a", lambda: work(1))) for _ in range(5)]
+        other = asyncio.create_task(flights.do("b", lambda: work(2)))
+        await asyncio.sleep(0)
+        assert flights.stats() == {"in_flight": 2, "leaders": 2, "coalesced": 4}
+        release.set()
+        assert await asyncio.gather(*waiters) == [1] * 5 and await other == 2
+        assert calls == [1, 2]
+
+        # Результат не кэшируется: следующий запрос выполняется заново
+        assert await flights.do("a", lambda: work(3)) == 3
+
+        release.clear()
+        error = ValueError("broken")
+        waiters = [asyncio.create_task(flights.do("a", lambda: work(error))) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert all(result is error for result in results)
+        assert flights.stats()["in_flight"] == 0
+
+        # Отменённый первый запрос: ожидающий выполняет работу сам
+        release.clear()
+        leader = asyncio.create_task(flights.do("a", lambda: work(4)))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("a", lambda: work(5)))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await follower == 5
+        assert leader.cancelled()
+
+    asyncio.run(main())
+
+
+def test_limiter_queues_sheds_and_times_out():
+    async def main():
+        limiter = AdmissionLimiter(limit=1, queue_size=1, queue_timeout=0.05)
+        release = asyncio.Event()
+
+        async def hold():
+            async with limiter.slot():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        assert limiter.saturated and limiter.active == 1
+        queued = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        assert limiter.waiting == 1
+        # Очередь заполнена — отказ сразу
+        with pytest.raises(OverloadedError, match="Too many"):
+            async with limiter.slot():
+                pass
+        with pytest.raises(OverloadedError, match="timed out"):
+            await queued
+        release.set()
+        await holder
+        async with limiter.slot():
+            assert limiter.active == 1
+        assert limiter.stats() == {
+            "limit": 1, "queue_size": 1, "active": 0, "waiting": 0, "max_waiting": 1,
+            "admitted": 2, "shed": 1, "timed_out": 1,
+        }
+
+    asyncio.run(main())
+
+
+def test_coalesced_queries_take_one_slot():
+    async def main():
+        flights = SingleFlight()
+        limiter = AdmissionLimiter(limit=1, queue_size=0, queue_timeout=1.0)
+        release = asyncio.Event()
+
+        async def run(value):
+            async with limiter.slot():
+                await release.wait()
+                return value
+
+        same = [asyncio.create_task(flights.do("a", lambda: run(1))) for _ in range(10)]
+        await asyncio.sleep(0)
+        # Другой запрос не объединяется и при пустой очереди отклоняется
+        with pytest.raises(OverloadedError):
+            await flights.do("b", lambda: run(2))
+        release.set()
+        assert await asyncio.gather(*same) == [1] * 10
+        assert (limiter.admitted, limiter.shed, flights.followers) == (1, 1, 9)
+
+    asyncio.run(main())
@@ -0,0 +1,35 @@
+"""
+Новое правило тревоги сразу проверяется по текущим значениям узлов,
+не дожидаясь следующей записи.
+"""
+from datetime import datetime
+
+from crud.alarms import alarm_engine, create_alarm_rule
+from crud.latest import latest_values
+from schemas.nodes import AlarmRuleSchema
+
+NODEID = 9201
+
+
+def test_new_rule_checks_current_values(run_db):
+    row = {"nodeid": NODEID, "time": datetime(2024, 1, 1), "valdouble": 50.0, "quality": 192}
+
+    async def check(engine, session_factory):
+        try:
+            latest_values.update([row])
+            alarm_engine.update([row])
+
+            async with session_factory() as session:
+                rule = await create_alarm_rule(session, AlarmRuleSchema(name="high", kind="threshold", nodeid=NODEID, high=10.0).model_dump())
+            alarm = alarm_engine.active[(rule["id"], NODEID)]
+            assert alarm["value"] == 50.0 and alarm["raised_at"] == row["time"]
+
+            # Уже проверенная запись не проверяется повторно при новых данных
+            alarm_engine.update([row])
+            assert alarm_engine.raised == 1
+        finally:
+            latest_values.values.pop(NODEID, None)
+            alarm_engine.set_rules([])
+            alarm_engine.active.clear()
+
+    run_db(check)
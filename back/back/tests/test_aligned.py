@@ -0,0 +1,94 @@
+"""
+Выравнивание на общую сетку: LOCF, линейная интерполяция и средние по
+корзинам на границах периода, опорная точка до периода (последняя с
+непустым значением и подходящая под фильтры), узел с одной точкой и узел
+без данных — в SQLite и, с PG_URL, в PostgreSQL.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import insert
+
+from core.alignment import align_linear, align_locf, scatter_buckets, time_grid
+from crud.aligned import get_aligned, grid_size
+from crud.nodes import HistoryFilters
+from db.models import Node, SensorData
+
+START = datetime(2024, 1, 1)
+END = START + timedelta(seconds=60)
+NAN = np.nan
+
+
+def _row(nodeid, second, value, quality=192):
+    return {"nodeid": nodeid, "time": START + timedelta(seconds=second), "valdouble": value, "quality": quality}
+
+
+ROWS = [
+    _row(1, -3600, 99.0),
+    _row(1, -30, 10.0),
+    _row(1, -20, 77.0, quality=0),
+    # Запись без значения не годится в опорные точки
+    _row(1, -10, None),
+    _row(1, 15, 20.0),
+    _row(1, 45, 40.0),
+    _row(1, 90, 0.0),
+    _row(1, 120, 1.0),
+    _row(2, 30, 5.0),
+]
+GOOD = HistoryFilters.of(None, None, [192])
+
+
+def _check(run):
+    async def check(engine, session_factory):
+        async with engine.begin() as conn:
+            await conn.execute(insert(Node), [{"nodeid": nodeid, "tagname": f"tag{nodeid}"} for nodeid in (1, 2, 3)])
+            await conn.execute(insert(SensorData), ROWS)
+
+        async def aligned(fill, filters=None, nodeids=(1, 2, 3, 4)):
+            async with session_factory() as session:
+                return await get_aligned(session, list(nodeids), START, END, 15, fill, filters)
+
+        result = await aligned("locf")
+        assert result["nodeids"] == [1, 2, 3] and result["tagnames"] == ["tag1", "tag2", "tag3"]
+        assert result["time"] == [START + timedelta(seconds=second) for second in range(0, 61, 15)]
+        np.testing.assert_array_equal(result["values"][0], [77, 20, 20, 40, 40])
+        np.testing.assert_array_equal(result["values"][1], [NAN, NAN, 5, 5, 5])
+        np.testing.assert_array_equal(result["values"][2], [NAN] * 5)
+
+        result = await aligned("locf", GOOD)
+        np.testing.assert_array_equal(result["values"][0], [10, 20, 20, 40, 40])
+
+        # Опорные точки с обеих сторон: -30 с (10) и +90 с (0)
+        result = await aligned("linear", GOOD)
+        np.testing.assert_allclose(result["values"][0], [10 + 10 * 30 / 45, 20, 30, 40, 40 - 40 * 15 / 45])
+        np.testing.assert_array_equal(result["values"][1], [NAN, NAN, 5, NAN, NAN])
+
+        result = await aligned("average")
+        np.testing.assert_array_equal(result["values"][0], [NAN, 20, NAN, 40, NAN])
+        np.testing.assert_array_equal(result["values"][1], [NAN, NAN, 5, NAN, NAN])
+
+        assert (await aligned("locf", nodeids=[4]))["values"] == []
+
+    run(check)
+
+
+def test_aligned_fill_modes_sqlite(run_db):
+    _check(run_db)
+
+
+def test_aligned_fill_modes_postgresql(run_pg):
+    _check(run_pg)
+
+
+def test_alignment_edge_cases():
+    grid = time_grid(0, 10, 4)
+    assert grid.tolist() == [0, 10, 20, 30]
+    assert grid_size(START, START, 15) == 1
+    empty = np.array([], dtype=np.int64)
+    np.testing.assert_array_equal(align_locf(empty, np.array([]), grid), [NAN] * 4)
+    np.testing.assert_array_equal(align_linear(empty, np.array([]), grid), [NAN] * 4)
+    single = np.array([10], dtype=np.int64)
+    np.testing.assert_array_equal(align_locf(single, np.array([1.5]), grid), [NAN, 1.5, 1.5, 1.5])
+    np.testing.assert_array_equal(align_linear(single, np.array([1.5]), grid), [NAN, 1.5, NAN, NAN])
+    # Корзины вне сетки отбрасываются
+    np.testing.assert_array_equal(scatter_buckets(np.array([-1, 1, 4]), np.array([7.0, 8.0, 9.0]), 4), [NAN, 8, NAN, NAN])
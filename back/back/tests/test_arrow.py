@@ -0,0 +1,126 @@
+"""
+Arrow IPC: выбор формата по ?format и Accept; история — плоская таблица
+с временем timestamp[us] и словарными строками, такая же по значениям,
+как JSON; вложенные ответы, в том числе столбец value узлов разных типов
+(строками); выровненные значения (NaN — null) и пустые ответы.
+"""
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+import pyarrow as pa
+from sqlalchemy import insert
+
+from core.arrow import ARROW_MEDIA_TYPE, HISTORY_ARROW_SCHEMA, aligned_to_arrow, history_to_arrow, nested_to_arrow, wants_arrow
+from db.models import Node, SensorData
+
+START = datetime(2024, 1, 1)
+APP = uuid.UUID("00000000-0000-0000-0000-0000000000a1")
+
+
+def _read(body: bytes) -> pa.Table:
+    return pa.ipc.open_stream(body).read_all()
+
+
+def test_wants_arrow():
+    assert wants_arrow("arrow", None)
+    assert not wants_arrow("json", ARROW_MEDIA_TYPE)
+    assert wants_arrow(None, f"application/json;q=0.5, {ARROW_MEDIA_TYPE}")
+    assert not wants_arrow(None, "application/json")
+    assert not wants_arrow(None, None)
+
+
+def test_history_to_arrow():
+    nodes = {1: {"tagname": "a"}, 2: {"tagname": "b"}}
+    rows = [
+        (1, START, None, 1.5, None, None, None, None, 192, "R", APP),
+        (2, START + timedelta(seconds=1), START, None, 7, None, True, "on", None, None, None),
+        # Узел без метаданных пропускается
+        (3, START, None, 0.0, None, None, None, None, 192, None, None),
+    ]
+    table = _read(history_to_arrow(rows, nodes))
+    assert table.schema.equals(HISTORY_ARROW_SCHEMA)
+    assert table.num_rows == 2
+    assert table.column("time").cast(pa.int64()).to_pylist() == [1704067200000000, 1704067201000000]
+    assert table.column("tagname").to_pylist() == ["a", "b"]
+    assert table.column("appid").to_pylist() == [str(APP), None]
+    assert table.column("valint").to_pylist() == [None, 7]
+
+    empty = _read(history_to_arrow([], nodes))
+    assert empty.schema.equals(HISTORY_ARROW_SCHEMA) and empty.num_rows == 0
+
+
+def test_nested_to_arrow():
+    result = [
+        {"nodeid": 1, "tagname": "a", "value_kind": "double", "history": [{"time": START, "value": 1.5}, {"time": START, "value": None}]},
+        {"nodeid": 2, "tagname": "b", "value_kind": None, "history": []},
+        {"nodeid": 3, "tagname": "c", "value_kind": "string", "history": [{"time": START, "value": "on"}]},
+    ]
+    table = _read(nested_to_arrow(result, "history"))
+    assert table.column_names == ["nodeid", "tagname", "value_kind", "time", "value"]
+    assert table.column("nodeid").to_pylist() == [1, 1, 3]
+    assert pa.types.is_dictionary(table.schema.field("tagname").type)
+    # Число и строка в одном столбце — строки, null остаётся null
+    assert table.schema.field("value").type == pa.string()
+    assert table.column("value").to_pylist() == ["1.5", None, "on"]
+
+    numeric = _read(nested_to_arrow(result[:2], "history"))
+    assert numeric.schema.field("value").type == pa.float64()
+    assert numeric.schema.field("time").type == pa.timestamp("us")
+
+    # Узлы без точек — пустая таблица с полями узла
+    assert _read(nested_to_arrow(result[1:2], "history")).num_rows == 0
+    assert _read(nested_to_arrow([], "history")).num_rows == 0
+
+
+def test_aligned_to_arrow():
+    result = {
+        "time": [START, START + timedelta(seconds=15)],
+        "nodeids": [1, 2],
+        "tagnames": ["a", None],
+        "values": [np.array([1.0, np.nan]), np.array([np.nan, np.nan])],
+        "step": 15,
+        "fill": "locf",
+    }
+    table = _read(aligned_to_arrow(result))
+    assert table.column_names == ["time", "1", "2"]
+    assert table.column("1").to_pylist() == [1.0, None]
+    assert table.column("2").null_count == 2
+    assert table.schema.field("1").metadata == {b"tagname": b"a"}
+    assert table.schema.metadata == {b"step": b"15", b"fill": b"locf"}
+
+    empty = _read(aligned_to_arrow(dict(result, nodeids=[], tagnames=[], values=[])))
+    assert empty.column_names == ["time"] and empty.num_rows == 2
+
+
+def test_arrow_matches_json(run_db, api_client):
+    async def seed(engine, session_factory):
+        async with engine.begin() as conn:
+            await conn.execute(insert(Node), [{"nodeid": nodeid, "tagname": f"tag{nodeid}"} for nodeid in (1, 2)])
+            await conn.execute(insert(SensorData), [
+                {"nodeid": 1, "time": START + timedelta(minutes=minute), "valdouble": float(minute), "quality": 192, "appid": APP}
+                for minute in range(3)
+            ])
+            await conn.execute(insert(SensorData), [{"nodeid": 2, "time": START, "valint": 3, "quality": 0}])
+
+    run_db(seed)
+    params = {"nodeid": [1, 2]}
+    response = api_client.get("/api/v1/data", params=params, headers={"Accept": ARROW_MEDIA_TYPE})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == ARROW_MEDIA_TYPE
+    table = _read(response.content)
+    expected = [
+        (node["nodeid"], node["tagname"], record["time"], record["valdouble"], record["valint"], record["appid"])
+        for node in api_client.get("/api/v1/data", params=params).json() for record in node["history"]
+    ]
+    rows = table.to_pylist()
+    assert [
+        (row["nodeid"], row["tagname"], row["time"].isoformat(), row["valdouble"], row["valint"], row["appid"]) for row in rows
+    ] == expected
+
+    # Проекция: у узлов с разными типами значений один столбец value
+    table = _read(api_client.get("/api/v1/data", params=dict(params, fields="time,value", format="arrow")).content)
+    assert table.column("value").to_pylist() == [2.0, 1.0, 0.0, 3.0]
+
+    empty = _read(api_client.get("/api/v1/data", params={"nodeid": 99, "format": "arrow"}).content)
+    assert empty.schema.equals(HISTORY_ARROW_SCHEMA) and empty.num_rows == 0
@@ -0,0 +1,30 @@
+"""
+Сессия запроса: ответы клиенту через HTTPException (422, 404) не логируются
+как ошибки сервера, непредвиденные исключения — логируются.
+"""
+import asyncio
+import logging
+
+import pytest
+from fastapi import HTTPException
+
+from db.database import get_db
+
+
+def _raise_in_session(error):
+    async def main():
+        dependency = get_db()
+        await dependency.__anext__()
+        await dependency.athrow(error)
+    asyncio.run(main())
+
+
+def test_client_errors_are_not_logged_as_server_faults(caplog):
+    with caplog.at_level(logging.WARNING, logger="db.database"):
+        with pytest.raises(HTTPException):
+            _raise_in_session(HTTPException(status_code=422, detail="bad input"))
+        assert not caplog.records
+
+        with pytest.raises(RuntimeError):
+            _raise_in_session(RuntimeError("broken"))
+        assert [record.levelno for record in caplog.records] == [logging.ERROR]
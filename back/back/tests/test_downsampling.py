@@ -0,0 +1,88 @@
+"""
+Прореживание: LTTB сохраняет первую и последнюю точки и выбросы, корзины
+min/max/avg в SQL дают ровно points корзин на узел, включая запись ровно
+в date_to; узел с одной точкой и пустой период.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import insert
+
+from core.config import settings
+from core.downsampling import lttb_indices
+from crud.nodes import get_nodes_downsampled
+from db.models import Node, SensorData
+
+START = datetime(2024, 1, 1)
+HOUR = timedelta(hours=1)
+
+
+def _series(n=1000, spike=500):
+    x = np.arange(n, dtype=np.float64)
+    y = np.sin(x / 50)
+    y[spike] = 10.0
+    return x, y
+
+
+def test_lttb_shape_and_edges():
+    x, y = _series()
+    indices = lttb_indices(x, y, 50)
+    assert len(indices) == 50
+    assert indices[0] == 0 and indices[-1] == len(x) - 1
+    assert np.all(np.diff(indices) > 0)
+    assert 500 in indices
+    # Точек не больше порога — ряд не меняется
+    assert lttb_indices(x[:10], y[:10], 10).tolist() == list(range(10))
+    assert lttb_indices(x[:1], y[:1], 3).tolist() == [0]
+    assert lttb_indices(x[:0], y[:0], 3).tolist() == []
+
+
+def test_downsampled_history(run_db):
+    async def check(engine, session_factory):
+        async with engine.begin() as conn:
+            await conn.execute(insert(Node), [{"nodeid": nodeid, "tagname": f"tag{nodeid}"} for nodeid in (1, 2, 3)])
+            x, y = _series(3601, spike=1800)
+            await conn.execute(insert(SensorData), [
+                {"nodeid": 1, "time": START + timedelta(seconds=int(second)), "valdouble": float(value), "quality": 192}
+                for second, value in zip(x, y)
+            ] + [{"nodeid": 3, "time": START + timedelta(minutes=30), "valdouble": 4.0, "quality": 192}])
+            await conn.execute(insert(SensorData), [
+                {"nodeid": 2, "time": START + timedelta(seconds=second), "valint": second % 7, "quality": 192}
+                for second in range(0, 3601, 60)
+            ])
+
+        async def downsampled(nodeids, points, method="buckets", date_from=START, date_to=START + HOUR):
+            async with session_factory() as session:
+                return await get_nodes_downsampled(session, nodeids, date_from, date_to, points, method)
+
+        result = await downsampled([1, 2, 3], 10)
+        assert [node["nodeid"] for node in result] == [1, 2, 3]
+        first, second, single = result
+        assert len(first["points"]) == 10
+        assert first["points"][0]["time"] == START
+        # Запись ровно в date_to — в последней корзине
+        assert sum(point["count"] for point in first["points"]) == 3601
+        assert max(point["max"] for point in first["points"]) == 10.0
+        assert all(point["min"] <= point["value"] <= point["max"] for point in first["points"])
+        # Целочисленный узел усредняется как число
+        assert sum(point["count"] for point in second["points"]) == 61
+        assert isinstance(second["points"][0]["value"], float)
+        assert [(point["value"], point["count"]) for point in single["points"]] == [(4.0, 1)]
+
+        # LTTB выбирает из корзин с запасом DOWNSAMPLE_LTTB_OVERSAMPLE, первая и последняя остаются
+        lttb = (await downsampled([1], 20, "lttb"))[0]["points"]
+        oversampled = (await downsampled([1], 20 * settings.DOWNSAMPLE_LTTB_OVERSAMPLE))[0]["points"]
+        assert len(lttb) == 20
+        assert lttb[0]["time"] == START and lttb[-1] == oversampled[-1]
+        assert [point["time"] for point in lttb] == sorted(point["time"] for point in lttb)
+        assert all(point in oversampled for point in lttb)
+
+        assert await downsampled([1], 10, date_from=START - 2 * HOUR, date_to=START - HOUR) == []
+        assert await downsampled([99], 10, date_from=None, date_to=None) == []
+
+    run_db(check)
+
+
+def test_downsampled_points_are_bounded(api_client):
+    response = api_client.get("/api/v1/data/downsampled", params={"nodeid": 1, "points": 2})
+    assert response.status_code == 422
@@ -0,0 +1,97 @@
+"""
+Выгрузка истории: постраничный обход по ключу (nodeid, time) проходит
+границы страниц и узлов без пропусков и повторов, учитывает период и
+фильтры; пустой период; NDJSON и CSV в ответе /data/export.
+"""
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from api.v1 import endpoints
+from crud.nodes import EXPORT_COLUMNS, HistoryFilters, iter_history_pages
+from db.models import Node, SensorData
+
+START = datetime(2024, 1, 1)
+
+
+def _rows():
+    rows = [
+        {"nodeid": nodeid, "time": START + timedelta(minutes=minute), "valdouble": float(minute), "quality": 192 if minute % 3 else 0}
+        for nodeid in (1, 2, 3) for minute in range(10)
+    ]
+    rows.append({"nodeid": 2, "time": START + timedelta(minutes=20), "valstring": "текст", "quality": 192})
+    return rows
+
+
+async def _seed(engine):
+    async with engine.begin() as conn:
+        await conn.execute(insert(Node), [{"nodeid": nodeid, "tagname": f"tag{nodeid}"} for nodeid in (1, 2, 3)])
+        rows = _rows()
+        await conn.execute(insert(SensorData), [row for row in rows if "valdouble" in row])
+        await conn.execute(insert(SensorData), [row for row in rows if "valstring" in row])
+
+
+def test_history_pages(run_db):
+    async def check(engine, session_factory):
+        await _seed(engine)
+
+        async def pages(page_size, nodeid=None, date_from=None, date_to=None, filters=None):
+            async with session_factory() as session:
+                return [
+                    [(row.nodeid, row.time) for row in page]
+                    async for page in iter_history_pages(session, nodeid, date_from, date_to, page_size, filters)
+                ]
+
+        expected = sorted((row["nodeid"], row["time"]) for row in _rows())
+        for page_size in (1, 4, 7, len(expected), 100):
+            result = await pages(page_size)
+            assert all(0 < len(page) <= page_size for page in result)
+            assert [key for page in result for key in page] == expected
+
+        bounded = await pages(4, date_from=START + timedelta(minutes=5), date_to=START + timedelta(minutes=20))
+        assert [key for page in bounded for key in page] == [
+            key for key in expected if START + timedelta(minutes=5) <= key[1] <= START + timedelta(minutes=20)
+        ]
+        filtered = await pages(4, nodeid=2, filters=HistoryFilters.of(None, None, [0]))
+        assert [key for page in filtered for key in page] == [(2, START + timedelta(minutes=minute)) for minute in (0, 3, 6, 9)]
+
+        assert await pages(4, date_from=START - timedelta(days=2), date_to=START - timedelta(days=1)) == []
+        assert await pages(4, nodeid=99) == []
+
+    run_db(check)
+
+
+def test_export_formats(run_db, api_client, database_url, monkeypatch):
+    async def seed(engine, session_factory):
+        await _seed(engine)
+
+    run_db(seed)
+    engine = create_async_engine(database_url, poolclass=NullPool)
+    monkeypatch.setattr(endpoints, "AsyncSessionLocal", sessionmaker(engine, class_=AsyncSession))
+
+    response = api_client.get("/api/v1/data/export", params={"nodeid": 2})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert "nodes_history_2.ndjson" in response.headers["content-disposition"]
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 11 and all(list(line) == list(EXPORT_COLUMNS) for line in lines)
+    assert lines[0]["time"] == START.isoformat() and lines[0]["valdouble"] == 0.0
+    assert lines[-1]["valstring"] == "текст" and lines[-1]["valdouble"] is None
+
+    response = api_client.get("/api/v1/data/export", params={"format": "csv", "date_from": START.isoformat(), "date_to": START.isoformat()})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    table = list(csv.reader(io.StringIO(response.text)))
+    assert table[0] == list(EXPORT_COLUMNS)
+    assert [row[0] for row in table[1:]] == ["1", "2", "3"]
+
+    # Пустой период — только заголовок
+    response = api_client.get("/api/v1/data/export", params={"format": "csv", "nodeid": 99})
+    assert list(csv.reader(io.StringIO(response.text))) == [list(EXPORT_COLUMNS)]
+    assert api_client.get("/api/v1/data/export", params={"nodeid": 99}).text == ""
@@ -0,0 +1,72 @@
+"""
+Фильтры без периода строятся по индексу значений, накопленному при записи,
+и таблице последних значений — без чтения истории. После перезапуска индекс
+прогревается по истории, и значения, не записывавшиеся с тех пор, не теряются.
+"""
+from datetime import datetime
+
+from sqlalchemy import event, insert
+
+from crud.facets import _facets_cache, facet_index, get_facets
+from crud.ingest import ingest_readings
+from crud.latest import latest_values
+from db.models import SensorData
+
+NODEID = 9101
+
+
+def test_facets_without_range_do_not_scan_history(run_db, monkeypatch):
+    # Таблица последних значений прогревается один раз при старте
+    monkeypatch.setattr(latest_values, "warmed", True)
+    monkeypatch.setattr(facet_index, "warmed", True)
+
+    async def check(engine, session_factory):
+        statements = []
+        try:
+            async with session_factory() as session:
+                await ingest_readings(session, [
+                    {"nodeid": NODEID, "time": "2024-01-01T00:00:00", "valdouble": 1.0, "quality": 0, "recordtype": "old"},
+                    {"nodeid": NODEID, "time": "2024-01-01T00:00:10", "valdouble": 2.0, "quality": 192, "recordtype": "new"},
+                ], create_nodes=True)
+
+            event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+            async with session_factory() as session:
+                facets = await get_facets(session, [NODEID])
+            assert facets["recordtype"] == ["new", "old"]
+            assert facets["quality"] == [0, 192]
+            assert not [statement for statement in statements if "DISTINCT" in statement]
+        finally:
+            _facets_cache.invalidate()
+            facet_index.values.pop(NODEID, None)
+            latest_values.values.pop(NODEID, None)
+
+    run_db(check)
+
+
+def test_facets_after_restart_include_history(run_db, monkeypatch):
+    # Процесс только что запущен: в памяти ничего нет
+    monkeypatch.setattr(facet_index, "values", {})
+    monkeypatch.setattr(facet_index, "warmed", False)
+
+    async def check(engine, session_factory):
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(insert(SensorData), [
+                    {"nodeid": NODEID, "time": datetime(2024, 1, 1), "valdouble": 1.0, "quality": 0, "recordtype": "archived"},
+                    {"nodeid": NODEID, "time": datetime(2024, 1, 2), "valdouble": 2.0, "quality": 192, "recordtype": "current"},
+                ])
+            async with session_factory() as session:
+                await ingest_readings(session, [
+                    {"nodeid": NODEID, "time": "2024-01-03T00:00:00", "valdouble": 3.0, "quality": 64, "recordtype": "current"},
+                ], create_nodes=True)
+            async with session_factory() as session:
+                facets = await get_facets(session, [NODEID])
+            assert facets["recordtype"] == ["archived", "current"]
+            assert facets["quality"] == [0, 64, 192]
+            assert facet_index.warmed
+        finally:
+            _facets_cache.invalidate()
+            latest_values.values.pop(NODEID, None)
+            latest_values.warmed = False
+
+    run_db(check)
@@ -0,0 +1,81 @@
+"""
+Горячий слой против БД: на случайных запросах /data ответ из памяти должен
+совпадать с ответом get_nodes_history, если covers() разрешает память.
+Отдельно — буфер, урезанный лимитом HOT_TIER_MAX_POINTS при прогреве.
+
+Запуск из каталога back/back: python -m pytest -q tests
+"""
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks import generator as data_generator
+from core.serialization import dumps
+from crud.hot_tier import HotTier
+from crud.node_cache import node_cache
+from crud.nodes import HistoryFilters, get_nodes_history
+
+START = datetime(2024, 1, 1)
+TAGS = 6
+DURATION = 1800
+
+FIELD_SETS = (("time", "value"), ("time", "value", "quality"), ("time", "valdouble"), ("time", "quality"))
+
+
+def _run(url, check):
+    async def main():
+        generator = data_generator.SensorDataGenerator(TAGS, 1.0, DURATION, data_generator.parse_mix("double=0.7,int=0.3"), START, seed=1)
+        await data_generator.load(url, generator)
+        engine = create_async_engine(url)
+        node_cache.invalidate()
+        try:
+            async with sessionmaker(engine, class_=AsyncSession)() as session:
+                await check(session)
+        finally:
+            await engine.dispose()
+    asyncio.run(main())
+
+
+async def _compare(session, tier: HotTier, rng: random.Random, queries: int) -> int:
+    """Сравнивает случайные запросы с БД; возвращает число запросов, отвеченных из памяти."""
+    answered = 0
+    for _ in range(queries):
+        nodeids = tuple(sorted(rng.sample(range(1, TAGS + 1), rng.randint(1, 3))))
+        date_from = START + timedelta(seconds=rng.randint(0, DURATION))
+        date_to = date_from + timedelta(seconds=rng.randint(0, 600)) if rng.random() < 0.7 else None
+        limit = rng.choice((1, 10, 50, 1000))
+        fields = rng.choice(FIELD_SETS)
+        filters = HistoryFilters.of(None, None, [192]) if rng.random() < 0.3 else None
+        if not tier.covers(nodeids, date_from, filters, fields):
+            continue
+        answered += 1
+        hot = await tier.get_history(session, nodeids, date_from, date_to, limit, filters, fields)
+        db = await get_nodes_history(session, nodeids, date_from, date_to, limit, filters, fields)
+        assert dumps(hot) == dumps(db), (nodeids, date_from, date_to, limit, fields, filters)
+    return answered
+
+
+def test_hot_tier_matches_database(database_url):
+    async def check(session):
+        tier = HotTier(window=3600, max_bytes=256 * 2**20, max_points=100000)
+        await tier.warm(session)
+        assert await _compare(session, tier, random.Random(0), 200) > 100
+
+    _run(database_url, check)
+
+
+def test_capped_hot_tier_does_not_claim_evicted_rows(database_url):
+    async def check(session):
+        # 1800 записей на узел при ёмкости 50: при прогреве остаются только последние
+        tier = HotTier(window=3600, max_bytes=256 * 2**20, max_points=50)
+        await tier.warm(session)
+        assert tier.capacity == 50
+        assert not tier.covers((1,), START + timedelta(minutes=10), None, ("time", "value"))
+        latest = START + timedelta(seconds=DURATION - 1)
+        assert tier.covers((1,), latest - timedelta(seconds=30), None, ("time", "value"))
+        assert await _compare(session, tier, random.Random(1), 200) > 0
+
+    _run(database_url, check)
@@ -0,0 +1,79 @@
+"""
+Версия ответов /data: меняется при новой записи любого узла выборки (даже
+старше последней записи другого узла) и при перезаписи через загрузку.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from core.http_cache import make_etag, mark_history_written, response_cache, write_marks
+from crud.latest import latest_values
+from crud.nodes import get_node_versions
+from db.models import SensorData
+
+START = datetime(2024, 1, 1)
+
+
+def _row(nodeid, second, value=1.0):
+    return {"nodeid": nodeid, "time": START + timedelta(seconds=second), "valdouble": value, "quality": 192}
+
+
+def test_etag_follows_each_node(run_db):
+    nodeids = (1, 2)
+    key = (nodeids, None, None, None, None, None, "application/json")
+
+    async def check(engine, session_factory):
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(insert(SensorData), [_row(1, 10), _row(2, 100)])
+
+            async def etag():
+                async with session_factory() as session:
+                    versions = await get_node_versions(session, nodeids)
+                return make_etag(key, (versions, write_marks(nodeids)))
+
+            first = await etag()
+            assert first == await etag()
+
+            # Новая запись узла 1 старше последней записи узла 2
+            async with engine.begin() as conn:
+                await conn.execute(insert(SensorData), [_row(1, 20)])
+            second = await etag()
+            assert second != first
+
+            # Перезапись существующей записи не сдвигает max(time)
+            response_cache.set(key, (second, b"[]"))
+            response_cache.set(((3,),) + key[1:], (second, b"[]"))
+            mark_history_written([1])
+            assert await etag() != second
+            assert key not in response_cache
+            assert ((3,),) + key[1:] in response_cache
+        finally:
+            response_cache.invalidate()
+
+    run_db(check)
+
+
+def test_versions_from_memory_match_database(run_db):
+    async def check(engine, session_factory):
+        async with engine.begin() as conn:
+            await conn.execute(insert(SensorData), [_row(1, second) for second in range(0, 100, 10)] + [_row(2, 5), _row(3, 50)])
+        async with session_factory() as session:
+            await latest_values.warm(session)
+        try:
+            for nodeids, date_from, date_to in [
+                ((1, 2), None, None),
+                (None, None, None),
+                ((1, 2, 3, 4), START + timedelta(seconds=10), None),
+                ((1, 3), None, START + timedelta(seconds=200)),
+            ]:
+                async with session_factory() as session:
+                    expected = await get_node_versions(session, nodeids, date_from, date_to)
+                assert latest_values.node_versions(nodeids, date_from, date_to) == expected
+            # Последняя запись узла позже конца периода — ответ только из БД
+            assert latest_values.node_versions((1, 2), None, START + timedelta(seconds=50)) is None
+        finally:
+            latest_values.values.clear()
+            latest_values.warmed = False
+
+    run_db(check)
@@ -0,0 +1,78 @@
+"""
+Загрузка: пропущенные при on_conflict=ignore дубликаты не считаются
+записанными и не попадают в таблицу последних значений; пачки, записанные
+до ошибки в следующей, сразу видны хранилищам в памяти.
+"""
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from crud.ingest import ingest_readings
+from core.http_cache import write_marks
+from crud.facets import facet_index
+from crud.latest import latest_values
+from db.models import SensorData
+
+NODEID = 9001
+
+
+def _reading(time, value, quality=192):
+    return {"nodeid": NODEID, "time": time, "valdouble": value, "quality": quality}
+
+
+def test_ignored_duplicates_are_not_applied(run_db):
+    async def check(engine, session_factory):
+        try:
+            async def ingest(readings, on_conflict="ignore"):
+                async with session_factory() as session:
+                    return await ingest_readings(session, readings, on_conflict, create_nodes=True)
+
+            assert (await ingest([_reading("2024-01-01T00:00:00", 1.0)]))["written"] == 1
+            result = await ingest([_reading("2024-01-01T00:00:00", -5.0, 0), _reading("2024-01-01T00:00:10", 2.0)])
+            assert result["received"] == 2 and result["written"] == 1
+            assert latest_values.values[NODEID]["valdouble"] == 2.0
+
+            result = await ingest([_reading("2024-01-01T00:00:10", -5.0, 0)])
+            assert result["written"] == 0
+            assert latest_values.values[NODEID]["valdouble"] == 2.0
+            assert latest_values.values[NODEID]["quality"] == 192
+
+            assert (await ingest([_reading("2024-01-01T00:00:10", 3.0)], "update"))["written"] == 1
+            assert latest_values.values[NODEID]["valdouble"] == 3.0
+            async with session_factory() as session:
+                values = (await session.execute(select(SensorData.valdouble).order_by(SensorData.time))).scalars().all()
+            assert values == [1.0, 3.0]
+        finally:
+            latest_values.values.pop(NODEID, None)
+
+    run_db(check)
+
+
+def test_committed_batches_reach_memory_when_later_batch_fails(run_db):
+    async def check(engine, session_factory):
+        try:
+            async with session_factory() as session:
+                await ingest_readings(session, [_reading("2024-01-01T00:00:30", 0.0)], create_nodes=True)
+            marks = write_marks([NODEID])
+            readings = [
+                _reading("2024-01-01T00:00:00", 1.0),
+                {**_reading("2024-01-01T00:00:10", 2.0), "recordtype": "first"},
+                # Вторая пачка: повтор существующей записи при on_conflict=error
+                _reading("2024-01-01T00:00:20", 3.0),
+                _reading("2024-01-01T00:00:30", 4.0),
+            ]
+            with pytest.raises(IntegrityError):
+                async with session_factory() as session:
+                    await ingest_readings(session, readings, "error", batch_size=2)
+
+            async with session_factory() as session:
+                values = (await session.execute(select(SensorData.valdouble).order_by(SensorData.time))).scalars().all()
+            assert values == [1.0, 2.0, 0.0]
+            assert write_marks([NODEID]) != marks
+            assert "first" in facet_index.query([NODEID])["recordtype"]
+            assert latest_values.values[NODEID]["valdouble"] == 0.0
+        finally:
+            facet_index.values.pop(NODEID, None)
+            latest_values.values.pop(NODEID, None)
+
+    run_db(check)
@@ -0,0 +1,50 @@
+"""
+/latest: фильтры по узлам, appid и качеству по таблице последних значений;
+appid проверяется как UUID (422 на неверное значение).
+"""
+import uuid
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from crud.latest import latest_values
+from db.models import Node, SensorData
+
+APP = uuid.UUID("00000000-0000-0000-0000-0000000000a1")
+OTHER = uuid.UUID("00000000-0000-0000-0000-0000000000b2")
+
+
+def _row(nodeid, hour, quality, appid):
+    return {"nodeid": nodeid, "time": datetime(2024, 1, 1, hour), "valdouble": float(hour), "quality": quality, "appid": appid}
+
+
+def test_latest_filters(run_db, api_client):
+    async def seed(engine, session_factory):
+        async with engine.begin() as conn:
+            await conn.execute(insert(Node), [{"nodeid": nodeid, "tagname": f"tag{nodeid}"} for nodeid in (1, 2, 3)])
+            await conn.execute(insert(SensorData), [
+                _row(1, 0, 0, OTHER), _row(1, 1, 192, APP),
+                _row(2, 2, 0, APP),
+                _row(3, 3, 192, OTHER),
+            ])
+
+    run_db(seed)
+    try:
+        def nodes(**params):
+            response = api_client.get("/api/v1/latest", params=params)
+            assert response.status_code == 200
+            return [(value["nodeid"], value["valdouble"]) for value in response.json()]
+
+        # Только последняя запись каждого узла
+        assert nodes() == [(1, 1.0), (2, 2.0), (3, 3.0)]
+        assert api_client.get("/api/v1/latest").json()[0]["tagname"] == "tag1"
+        assert sorted(nodes(nodeid=[3, 1])) == [(1, 1.0), (3, 3.0)]
+        assert sorted(nodes(appid=str(APP))) == [(1, 1.0), (2, 2.0)]
+        assert nodes(appid=str(APP), quality=192) == [(1, 1.0)]
+        assert nodes(nodeid=2, quality=192) == []
+        assert nodes(nodeid=99) == []
+
+        assert api_client.get("/api/v1/latest", params={"appid": "not-a-uuid"}).status_code == 422
+    finally:
+        latest_values.values.clear()
+        latest_values.warmed = False
@@ -0,0 +1,53 @@
+"""
+Опросчик новых записей: курсор сдвигается, даже если окно перекрытия
+LIVE_LOOKBACK содержит больше записей, чем LIVE_BATCH_LIMIT, а опоздавшие
+записи внутри окна выдаются ровно один раз.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from core.config import settings
+from crud.live import LiveFeed
+from db.models import SensorData
+
+START = datetime(2024, 1, 1)
+
+
+def _rows(nodeids, seconds):
+    return [
+        {"nodeid": nodeid, "time": START + timedelta(seconds=second), "valdouble": float(second), "quality": 192}
+        for second in seconds for nodeid in nodeids
+    ]
+
+
+def test_live_feed_pages_past_dense_lookback_window(run_db, monkeypatch):
+    monkeypatch.setattr(settings, "LIVE_BATCH_LIMIT", 50)
+    monkeypatch.setattr(settings, "LIVE_LOOKBACK", 60)
+
+    async def check(engine, session_factory):
+        async with engine.begin() as conn:
+            await conn.execute(insert(SensorData), _rows(range(1, 11), range(0, 3600, 10)))
+        feed = LiveFeed(session_factory)
+
+        async def poll_all():
+            delivered = []
+            for _ in range(100):
+                async with session_factory() as session:
+                    rows = await feed._poll(session)
+                if not rows:
+                    break
+                delivered.extend((row["nodeid"], row["time"]) for row in rows)
+            return delivered
+
+        assert await poll_all() == []
+        async with engine.begin() as conn:
+            # 300 новых записей и одна опоздавшая внутри окна перекрытия
+            await conn.execute(insert(SensorData), _rows(range(1, 11), range(3600, 3900, 10)))
+            await conn.execute(insert(SensorData), _rows([11], [3590]))
+        delivered = await poll_all()
+        assert len(delivered) == len(set(delivered)) == 301
+        assert (11, START + timedelta(seconds=3590)) in delivered
+        assert await poll_all() == []
+
+    run_db(check)
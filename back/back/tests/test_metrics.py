@@ -0,0 +1,108 @@
+"""
+Метрики Prometheus: монотонные счётчики экспортируются с типом counter
+и суффиксом _total; кумулятивные корзины гистограмм и экранирование меток;
+MetricsMiddleware считает запросы к БД и размер ответа по шаблону маршрута.
+"""
+import pytest
+from fastapi import FastAPI, Response
+from fastapi.testclient import TestClient
+
+import crud.alarms  # noqa: F401 — регистрирует метрики тревог
+import db.database  # noqa: F401 — регистрирует метрики пула
+from core.admission import query_limiter
+from core.metrics import (
+    Counter, CounterFunc, Histogram, MetricsMiddleware, current_request_stats, observe_query,
+    registry, request_db_queries, request_db_rows, response_size, statement_kind
+)
+
+
+def _types(text):
+    return dict(line.split()[2:4] for line in text.splitlines() if line.startswith("# TYPE"))
+
+
+def test_monotonic_counts_are_counters():
+    types = _types(registry.render().decode())
+    for name in ("alarm_rows_evaluated_total", "db_pool_timeouts_total", "query_shed_total", "query_queue_timeouts_total", "query_coalesced_total"):
+        assert types[name] == "counter"
+    assert all(name.endswith("_total") for name, kind in types.items() if kind == "counter")
+    assert types["query_active"] == "gauge"
+
+    shed = query_limiter.shed
+    query_limiter.shed += 2
+    try:
+        assert f"query_shed_total {shed + 2}" in registry.render().decode().splitlines()
+    finally:
+        query_limiter.shed = shed
+
+    with pytest.raises(ValueError):
+        CounterFunc("query_shed", "No suffix.", lambda: 0)
+
+
+def test_histogram_and_counter_render():
+    histogram = Histogram("test_seconds", "Test.", ("route",), (0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value, 'a"b')
+    assert list(histogram.render()) == [
+        "# HELP test_seconds Test.",
+        "# TYPE test_seconds histogram",
+        # Значение на границе попадает в эту корзину (le — меньше или равно)
+        'test_seconds_bucket{route="a\\"b",le="0.1"} 2',
+        'test_seconds_bucket{route="a\\"b",le="1.0"} 3',
+        'test_seconds_bucket{route="a\\"b",le="+Inf"} 4',
+        'test_seconds_sum{route="a\\"b"} 5.65',
+        'test_seconds_count{route="a\\"b"} 4',
+    ]
+    # Без наблюдений — только заголовки
+    assert len(list(Histogram("empty_seconds", "Empty.").render())) == 2
+
+    counter = Counter("test_total", "Test.", ("kind",))
+    counter.inc("b")
+    counter.inc("a", amount=2.5)
+    counter.inc("b")
+    assert list(counter.render())[2:] == ['test_total{kind="a"} 2.5', 'test_total{kind="b"} 2']
+
+
+def test_statement_kind():
+    assert statement_kind("  select 1") == "SELECT"
+    assert statement_kind("WITH t AS (SELECT 1) SELECT * FROM t") == "WITH"
+    assert statement_kind("PRAGMA foreign_keys") == "OTHER"
+    assert statement_kind("") == "OTHER"
+
+
+def _series(histogram, *labels):
+    counts, total = histogram._series.get(labels, ([0], 0.0))
+    return sum(counts), total
+
+
+def test_middleware_labels_by_route():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware, exclude_paths=("/metrics",))
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: int):
+        observe_query("SELECT 1", 0.01, 5)
+        observe_query("SELECT 2", 0.02, -1)
+        return Response(content=b"x" * item_id)
+
+    @app.get("/metrics")
+    async def metrics():
+        assert current_request_stats() is None
+        return {}
+
+    route = ("GET", "/items/{item_id}")
+    before = [_series(histogram, *route) for histogram in (request_db_queries, request_db_rows, response_size)]
+    with TestClient(app) as client:
+        assert client.get("/items/3").status_code == 200
+        assert client.get("/items/7").status_code == 200
+        assert client.get("/missing").status_code == 404
+        assert client.get("/metrics").status_code == 200
+    # Вне запроса статистика не копится
+    observe_query("SELECT 3", 0.01, 1)
+
+    after = [_series(histogram, *route) for histogram in (request_db_queries, request_db_rows, response_size)]
+    # Один ряд на шаблон маршрута: два запроса, по две выборки и пять строк в каждом
+    assert [(count - old_count, total - old_total) for (count, total), (old_count, old_total) in zip(after, before)] == [
+        (2, 4), (2, 10), (2, 10)
+    ]
+    assert _series(request_db_queries, "GET", "unmatched")[0] >= 1
+    assert ("GET", "/metrics") not in request_db_queries._series
@@ -0,0 +1,78 @@
+"""
+История по набору узлов: GET /data с повторяющимся nodeid и POST
+/data/query отвечают одинаково, по limit последних записей каждого узла,
+а число запросов к nodes_history не зависит от числа узлов; неизвестные
+узлы пропускаются, с points — агрегаты по всем узлам набора.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, insert
+from sqlalchemy.engine import Engine
+
+from db.models import Node, SensorData
+
+START = datetime(2024, 1, 1)
+NODEIDS = (1, 2, 3, 4, 5)
+
+
+def _seed(run_db):
+    async def seed(engine, session_factory):
+        async with engine.begin() as conn:
+            await conn.execute(insert(Node), [{"nodeid": nodeid, "tagname": f"tag{nodeid}"} for nodeid in NODEIDS])
+            await conn.execute(insert(SensorData), [
+                {"nodeid": nodeid, "time": START + timedelta(minutes=minute), "valdouble": float(nodeid * 100 + minute), "quality": 192}
+                for nodeid in NODEIDS for minute in range(nodeid * 2)
+            ])
+
+    run_db(seed)
+
+
+def test_node_set_is_one_query(run_db, api_client):
+    _seed(run_db)
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if "nodes_history" in statement:
+            statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", count)
+    try:
+        def history(nodeids):
+            statements.clear()
+            response = api_client.get("/api/v1/data", params={"nodeid": list(nodeids), "limit": 3})
+            assert response.status_code == 200
+            return response.json(), len(statements)
+
+        single, single_queries = history([2])
+        many, many_queries = history([5, 1, 3, 99])
+    finally:
+        event.remove(Engine, "before_cursor_execute", count)
+
+    assert [len(node["history"]) for node in single] == [3]
+    # Версия и сами данные — по одному запросу на весь набор
+    assert many_queries == single_queries == 2
+    assert [node["nodeid"] for node in many] == [1, 3, 5]
+    assert [[record["valdouble"] for record in node["history"]] for node in many] == [[101.0, 100.0], [305.0, 304.0, 303.0], [509.0, 508.0, 507.0]]
+
+
+def test_query_body_matches_get(run_db, api_client):
+    _seed(run_db)
+    params = {"nodeid": [4, 2], "limit": 2, "date_to": (START + timedelta(minutes=2)).isoformat()}
+    expected = api_client.get("/api/v1/data", params=params).json()
+    assert [[record["time"] for record in node["history"]] for node in expected] == [
+        ["2024-01-01T00:02:00", "2024-01-01T00:01:00"], ["2024-01-01T00:02:00", "2024-01-01T00:01:00"]
+    ]
+    body = {"nodeids": [2, 4, 2], "limit": 2, "date_to": params["date_to"]}
+    assert api_client.post("/api/v1/data/query", json=body).json() == expected
+    assert api_client.post("/api/v1/data/query", json=dict(body, fields=["time", "value"])).json()[0]["history"] == [
+        {"time": "2024-01-01T00:02:00", "value": 202.0}, {"time": "2024-01-01T00:01:00", "value": 201.0}
+    ]
+
+    rollup = api_client.post("/api/v1/data/query", json={"nodeids": [1, 5], "points": 3}).json()
+    assert [(node["nodeid"], node["resolution"], sum(point["count"] for point in node["points"])) for node in rollup] == [
+        (1, "1m", 2), (5, "1m", 10)
+    ]
+
+    assert api_client.post("/api/v1/data/query", json={"nodeids": []}).status_code == 422
+    assert api_client.post("/api/v1/data/query", json={"nodeids": [1], "fields": ["bogus"]}).status_code == 422
+    assert api_client.post("/api/v1/data/query", json={"nodeids": [99]}).json() == []
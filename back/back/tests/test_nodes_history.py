@@ -0,0 +1,69 @@
+"""
+"Последние N записей на узел" одним запросом: LATERAL в PostgreSQL и окно
+в SQLite дают те же строки, что и отбор в Python, — для одного узла, списка
+узлов, всех узлов, с периодом и фильтром по качеству.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from crud.nodes import HistoryFilters, latest_history_query
+from db.models import Node, SensorData
+
+START = datetime(2024, 1, 1)
+DEPTHS = {1: 30, 2: 5, 3: 0, 4: 12}
+
+
+def _rows():
+    return [
+        {"nodeid": nodeid, "time": START + timedelta(seconds=10 * second), "valdouble": float(second), "quality": 0 if second % 3 else 192}
+        for nodeid, depth in DEPTHS.items() for second in range(depth)
+    ]
+
+
+def _expected(rows, nodeids, limit, date_from=None, quality=None):
+    result = []
+    for nodeid in sorted(nodeids):
+        selected = [
+            row for row in rows
+            if row["nodeid"] == nodeid
+            and (date_from is None or row["time"] >= date_from)
+            and (quality is None or row["quality"] == quality)
+        ]
+        selected.sort(key=lambda row: row["time"], reverse=True)
+        result.extend((row["nodeid"], row["time"], row["valdouble"]) for row in selected[:limit])
+    return result
+
+
+def _check(run):
+    rows = _rows()
+
+    async def check(engine, session_factory):
+        async with engine.begin() as conn:
+            # Узел 4 есть только в истории
+            await conn.execute(insert(Node), [{"nodeid": nodeid, "tagname": f"tag{nodeid}"} for nodeid in (1, 2, 3)])
+            await conn.execute(insert(SensorData), rows)
+
+        async def fetch(nodeid, limit, date_from=None, filters=None):
+            async with session_factory() as session:
+                query = latest_history_query(nodeid, date_from, None, limit, filters, ("time", "valdouble"), session.bind.dialect.name)
+                return [tuple(row) for row in (await session.execute(query)).all()]
+
+        assert await fetch(1, 7) == _expected(rows, [1], 7)
+        assert await fetch([1, 2, 3, 4], 10) == _expected(rows, [1, 2, 3, 4], 10)
+        assert await fetch([2, 1, 2], 3) == _expected(rows, [1, 2], 3)
+        # Без списка узлы берутся из nodes; строки без узла ответ всё равно пропускает
+        assert [row for row in await fetch(None, 10) if row[0] != 4] == _expected(rows, [1, 2, 3], 10)
+        date_from = START + timedelta(seconds=45)
+        assert await fetch([1, 2], 100, date_from) == _expected(rows, [1, 2], 100, date_from)
+        assert await fetch([1, 4], 4, None, HistoryFilters.of(None, None, [192])) == _expected(rows, [1, 4], 4, quality=192)
+
+    run(check)
+
+
+def test_latest_per_node_sqlite(run_db):
+    _check(run_db)
+
+
+def test_latest_per_node_postgresql(run_pg):
+    _check(run_pg)
@@ -0,0 +1,102 @@
+"""
+Секционирование nodes_history на PostgreSQL (пропускается без PG_URL):
+перенос существующей таблицы пачками с записью во время переноса,
+обслуживание, разбор секции DEFAULT и срок хранения.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, text
+
+from core.config import settings
+from crud.nodes import get_nodes_history
+from db.models import Node, SensorData
+from db.partitioning import (
+    DEFAULT_PARTITION, LEGACY_TABLE, copy_legacy_rows, is_partitioned, list_partitions,
+    maintain_partitions, prepare_partitioned_copy, swap_partitioned_table
+)
+
+START = datetime(2024, 1, 1)
+NOW = datetime(2024, 4, 15)
+ARCHIVE = "history_archive"
+
+
+def _rows(nodeids, start, hours, step=6, value=1.0):
+    return [
+        {"nodeid": nodeid, "time": start + timedelta(hours=hour), "valdouble": value, "quality": 192}
+        for nodeid in nodeids for hour in range(0, hours, step)
+    ]
+
+
+async def _count(session, table, where=""):
+    return (await session.execute(text(f"SELECT count(*) FROM {table} {where}"))).scalar()
+
+
+async def _cleanup(engine):
+    async with engine.begin() as conn:
+        await conn.execute(text(f"DROP TABLE IF EXISTS {LEGACY_TABLE}"))
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {ARCHIVE} CASCADE"))
+
+
+def test_migrate_maintain_split_and_retention(run_pg, monkeypatch):
+    monkeypatch.setattr(settings, "PARTITION_INTERVAL", "month")
+    monkeypatch.setattr(settings, "PARTITION_PREMAKE", 3)
+    monkeypatch.setattr(settings, "PARTITION_BRIN_AFTER_DAYS", 7)
+    monkeypatch.setattr(settings, "PARTITION_RETENTION_DAYS", 0)
+
+    async def check(engine, session_factory):
+        await _cleanup(engine)
+        # Январь — март, 3 узла, каждые 6 часов
+        rows = _rows((1, 2, 3), START, 24 * 91)
+        async with engine.begin() as conn:
+            await conn.execute(insert(Node), [{"nodeid": nodeid, "tagname": f"tag{nodeid}"} for nodeid in (1, 2, 3, 4)])
+            await conn.execute(insert(SensorData), rows)
+        try:
+            async with session_factory() as session:
+                await prepare_partitioned_copy(session, NOW)
+                # Запись во время переноса: новая строка и перезапись уже существующей
+                await session.execute(insert(SensorData), _rows((4,), START + timedelta(days=40), 24))
+                await session.execute(text("UPDATE nodes_history SET valdouble = 5.0 WHERE nodeid = 1 AND time = :time"), {"time": START})
+                await session.commit()
+                copied, batches = await copy_legacy_rows(session, batch_size=100)
+                assert copied == len(rows) + 4 and batches == -(-copied // 100)
+                await swap_partitioned_table(session)
+
+                assert await is_partitioned(session)
+                assert await _count(session, SensorData.__tablename__) == await _count(session, LEGACY_TABLE) == len(rows) + 4
+                names = [name for name, _, _ in await list_partitions(session)]
+                # Без пропусков от первых данных и PARTITION_PREMAKE месяцев вперёд
+                assert names == [f"nodes_history_p2024_{month:02d}" for month in range(1, 8)]
+                history = await get_nodes_history(session, [1, 4], limit=1)
+                assert [(node["nodeid"], len(node["history"])) for node in history] == [(1, 1), (4, 1)]
+                first = await get_nodes_history(session, 1, date_to=START)
+                assert first[0]["history"][0]["valdouble"] == 5.0
+
+                result = await maintain_partitions(session, NOW)
+                await session.commit()
+                # Индексы закончившихся секций заменены на BRIN
+                assert result["brin"] == ["nodes_history_p2024_01", "nodes_history_p2024_02", "nodes_history_p2024_03"]
+
+                # Дозагрузка далеко в будущее попадает в DEFAULT, обслуживание переносит её в свою секцию
+                await session.execute(insert(SensorData), _rows((1,), datetime(2024, 12, 5), 24))
+                await session.commit()
+                assert await _count(session, DEFAULT_PARTITION) == 4
+                result = await maintain_partitions(session, NOW)
+                await session.commit()
+                assert result["split"] == ["nodes_history_p2024_12"]
+                assert await _count(session, DEFAULT_PARTITION) == 0
+                assert await _count(session, "nodes_history_p2024_12") == 4
+
+                # Срок хранения: январь удаляется, февраль — переносится в архивную схему
+                monkeypatch.setattr(settings, "PARTITION_RETENTION_DAYS", 60)
+                assert (await maintain_partitions(session, NOW))["removed"] == ["nodes_history_p2024_01"]
+                await session.commit()
+                monkeypatch.setattr(settings, "PARTITION_ARCHIVE_SCHEMA", ARCHIVE)
+                assert (await maintain_partitions(session, NOW + timedelta(days=30)))["removed"] == ["nodes_history_p2024_02"]
+                await session.commit()
+                assert await _count(session, f"{ARCHIVE}.nodes_history_p2024_02") == 3 * 29 * 4 + 4
+                assert await _count(session, SensorData.__tablename__, "WHERE time < '2024-03-01'") == 0
+                assert await _count(session, SensorData.__tablename__) == 3 * 31 * 4 + 4
+        finally:
+            await _cleanup(engine)
+
+    run_pg(check)
@@ -0,0 +1,71 @@
+"""
+Проекция полей истории: разбор fields (time первым, без повторов, 422 на
+неизвестное поле), value из столбца типа узла, в том числе false и 0,
+выборка только нужных столбцов значений и тип значения в кэше узлов.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+
+from crud.node_cache import node_cache
+from crud.nodes import get_nodes_history, parse_fields, plan_projection
+from db.models import Node, SensorData
+
+START = datetime(2024, 1, 1)
+
+VALUES = {
+    1: {"valdouble": 1.5},
+    2: {"valint": 0},
+    3: {"valbool": False},
+    4: {"valstring": "on"},
+    # Узел без значений
+    5: {},
+}
+
+
+def test_parse_fields():
+    assert parse_fields(None) is None
+    assert parse_fields([]) is None
+    assert parse_fields(["value, quality", "time", "value"]) == ("time", "value", "quality")
+    assert parse_fields([" , "]) == ("time",)
+    with pytest.raises(ValueError, match="bogus"):
+        parse_fields(["time,bogus"])
+
+
+def test_projected_history(run_db, api_client):
+    async def check(engine, session_factory):
+        async with engine.begin() as conn:
+            await conn.execute(insert(Node), [{"nodeid": nodeid, "tagname": f"tag{nodeid}"} for nodeid in VALUES])
+            for nodeid, value in VALUES.items():
+                await conn.execute(insert(SensorData), [
+                    dict(value, nodeid=nodeid, time=START + timedelta(minutes=minute), quality=192) for minute in range(2)
+                ])
+
+        async with session_factory() as session:
+            # Для числового узла — один столбец значения
+            assert (await plan_projection(session, [1], ("time", "value"))).columns == ("time", "valdouble")
+            result = await get_nodes_history(session, list(VALUES), limit=1, fields=("time", "value"))
+        assert [(node["nodeid"], node["value_kind"], node["history"]) for node in result] == [
+            (1, "double", [{"time": START + timedelta(minutes=1), "value": 1.5}]),
+            (2, "int", [{"time": START + timedelta(minutes=1), "value": 0}]),
+            (3, "bool", [{"time": START + timedelta(minutes=1), "value": False}]),
+            (4, "string", [{"time": START + timedelta(minutes=1), "value": "on"}]),
+            (5, None, [{"time": START + timedelta(minutes=1), "value": None}]),
+        ]
+        assert node_cache.get_value_kinds(VALUES) == {1: "double", 2: "int", 3: "bool", 4: "string"}
+
+        # Без value тип не определяется, поля — только запрошенные
+        async with session_factory() as session:
+            result = await get_nodes_history(session, 1, limit=1, fields=("time", "quality"))
+        assert result == [{"nodeid": 1, "tagname": "tag1", "history": [{"time": START + timedelta(minutes=1), "quality": 192}]}]
+
+    run_db(check)
+
+    response = api_client.get("/api/v1/data", params={"nodeid": [2, 4], "limit": 1, "fields": "quality,value"})
+    assert response.status_code == 200
+    assert [node["history"] for node in response.json()] == [
+        [{"time": "2024-01-01T00:01:00", "value": 0, "quality": 192}],
+        [{"time": "2024-01-01T00:01:00", "value": "on", "quality": 192}],
+    ]
+    assert api_client.get("/api/v1/data", params={"fields": "time,bogus"}).status_code == 422
@@ -0,0 +1,121 @@
+"""
+Агрегаты: выбор уровня по разрешению и числу точек; без обновления и при
+выключенных агрегатах ответ строится по исходным данным, а записи
+отстающего узла и дозагрузка попадают в ответ и до, и после пересчёта;
+значения корзин для вещественных и целых узлов, фильтры и пустой период.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from core.config import settings
+from crud.ingest import ingest_readings
+from crud.nodes import HistoryFilters, get_nodes_rollup, plan_rollup
+from crud.rollups import ROLLUP_LEVELS, refresh_rollups
+from db.models import Node, SensorData
+
+START = datetime(2024, 1, 1)
+END = START + timedelta(hours=2)
+
+
+def _rows(nodeid, seconds):
+    return [{"nodeid": nodeid, "time": START + timedelta(seconds=second), "valdouble": 1.0, "quality": 192} for second in seconds]
+
+
+def _counts(result):
+    return {node["nodeid"]: sum(point["count"] for point in node["points"]) for node in result}
+
+
+def test_rollups_cover_unrefreshed_and_late_rows(run_db, monkeypatch):
+    async def check(engine, session_factory):
+        async with engine.begin() as conn:
+            await conn.execute(insert(Node), [{"nodeid": 1, "tagname": "a"}, {"nodeid": 2, "tagname": "b"}])
+            await conn.execute(insert(SensorData), _rows(1, range(0, 7200, 10)) + _rows(2, range(0, 1800, 10)))
+
+        async def rollup():
+            async with session_factory() as session:
+                return await get_nodes_rollup(session, [1, 2], START, END, resolution=60)
+
+        # Агрегаты ещё не обновлялись
+        result = await rollup()
+        assert {node["resolution"] for node in result} == {"1m"}
+        assert _counts(result) == {1: 720, 2: 180}
+
+        monkeypatch.setattr(settings, "ROLLUP_ENABLED", False)
+        assert {node["resolution"] for node in await rollup()} == {"raw"}
+        monkeypatch.setattr(settings, "ROLLUP_ENABLED", True)
+
+        async with session_factory() as session:
+            await refresh_rollups(session)
+        assert _counts(await rollup()) == {1: 720, 2: 180}
+
+        # Узел 2 догружает час, давно пройденный последней записью узла 1
+        async with session_factory() as session:
+            readings = [dict(row, time=row["time"].isoformat()) for row in _rows(2, range(1800, 5400, 10))]
+            await ingest_readings(session, readings)
+        assert _counts(await rollup()) == {1: 720, 2: 540}
+        async with session_factory() as session:
+            await refresh_rollups(session)
+        assert _counts(await rollup()) == {1: 720, 2: 540}
+
+    run_db(check)
+
+
+def test_plan_rollup(monkeypatch):
+    names = {level[0]: level for level in ROLLUP_LEVELS}
+    day = timedelta(days=1)
+    # Самый грубый уровень, корзина которого не больше длины периода / points
+    assert plan_rollup(START, START + 30 * day, 30) == names["1d"]
+    assert plan_rollup(START, START + 30 * day, 31) == names["1h"]
+    assert plan_rollup(START, START + day, 24) == names["1h"]
+    assert plan_rollup(START, START + day, 1440) == names["1m"]
+    assert plan_rollup(START, START + timedelta(hours=1), 1000) is None
+    # Явное разрешение важнее числа точек
+    assert plan_rollup(START, START + day, 1000, resolution=3600) == names["1h"]
+    assert plan_rollup(START, START + day, 10, resolution=59) is None
+    monkeypatch.setattr(settings, "ROLLUP_ENABLED", False)
+    assert plan_rollup(START, START + 30 * day, 30) is None
+
+
+def test_rollup_points(run_db):
+    async def check(engine, session_factory):
+        async with engine.begin() as conn:
+            await conn.execute(insert(Node), [{"nodeid": nodeid, "tagname": f"tag{nodeid}"} for nodeid in (1, 2, 3)])
+            await conn.execute(insert(SensorData), [
+                {"nodeid": 1, "time": START + timedelta(minutes=minute), "valdouble": float(minute), "quality": 0 if minute == 30 else 192}
+                for minute in range(0, 120, 10)
+            ])
+            await conn.execute(insert(SensorData), [
+                {"nodeid": 2, "time": START + timedelta(minutes=minute), "valint": minute // 10, "quality": 192}
+                for minute in range(0, 60, 20)
+            ])
+            # Узел без числовых значений
+            await conn.execute(insert(SensorData), [{"nodeid": 3, "time": START, "valstring": "on", "quality": 192}])
+
+        async def rollup(nodeids=(1, 2, 3), filters=None, date_from=START, date_to=END):
+            async with session_factory() as session:
+                return await get_nodes_rollup(session, list(nodeids), date_from, date_to, resolution=3600, filters=filters)
+
+        for refreshed in (False, True):
+            if refreshed:
+                async with session_factory() as session:
+                    await refresh_rollups(session)
+            first, second, text = await rollup()
+            assert first["nodeid"] == 1 and first["tagname"] == "tag1" and first["resolution"] == "1h"
+            assert first["points"] == [
+                {"time": START, "value": 25.0, "min": 0.0, "max": 50.0, "count": 6, "bad_count": 1, "first_value": 0.0, "last_value": 50.0},
+                {"time": START + timedelta(hours=1), "value": 85.0, "min": 60.0, "max": 110.0, "count": 6, "bad_count": 0, "first_value": 60.0, "last_value": 110.0},
+            ]
+            # Целые значения агрегируются как числа
+            assert [(point["value"], point["min"], point["max"], point["count"]) for point in second["points"]] == [(2.0, 0.0, 4.0, 3)]
+            assert [(point["value"], point["count"]) for point in text["points"]] == [(None, 0)]
+
+        # Агрегаты не разделены по качеству: с фильтрами — исходные данные
+        filtered = await rollup([1], HistoryFilters.of(None, None, [0]))
+        assert [node["resolution"] for node in filtered] == ["raw"]
+        assert sum(point["count"] for point in filtered[0]["points"]) == 1
+
+        assert await rollup(date_from=START - timedelta(days=2), date_to=START - timedelta(days=1)) == []
+        assert await rollup([99], date_from=None, date_to=None) == []
+
+    run_db(check)
@@ -0,0 +1,60 @@
+"""
+Ответ /data в JSON: dumps кодирует datetime, UUID, None и массивы NumPy
+(NaN — null); тело совпадает с проверкой через NodeSchema, у каждой
+записи все поля истории, в том числе у узлов с разными типами значений;
+пустой период — пустой список.
+"""
+import json
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+
+import numpy as np
+from pydantic import TypeAdapter
+from sqlalchemy import insert
+
+from core.serialization import dumps
+from crud.nodes import HISTORY_FIELDS
+from db.models import Node, SensorData
+from schemas.nodes import NodeSchema
+
+START = datetime(2024, 1, 1)
+APP = uuid.UUID("00000000-0000-0000-0000-0000000000a1")
+
+
+def test_dumps_types():
+    assert json.loads(dumps({"time": START, "appid": APP, "value": None, 1: 2.5})) == {
+        "time": "2024-01-01T00:00:00", "appid": str(APP), "value": None, "1": 2.5
+    }
+    assert json.loads(dumps({"values": np.array([1.5, np.nan]), "ids": np.array([1, 2])})) == {"values": [1.5, None], "ids": [1, 2]}
+    assert dumps([]) == b"[]"
+
+
+def test_history_body(run_db, api_client):
+    async def seed(engine, session_factory):
+        async with engine.begin() as conn:
+            await conn.execute(insert(Node), [{"nodeid": nodeid, "tagname": f"tag{nodeid}"} for nodeid in (1, 2, 3)])
+            await conn.execute(insert(SensorData), [
+                {"nodeid": 1, "time": START + timedelta(minutes=minute), "valdouble": minute / 2, "quality": 192, "appid": APP, "recordtype": "R"}
+                for minute in range(3)
+            ])
+            await conn.execute(insert(SensorData), [{"nodeid": 2, "time": START, "valint": -5, "quality": 0}])
+            await conn.execute(insert(SensorData), [{"nodeid": 3, "time": START, "valstring": "on"}])
+
+    run_db(seed)
+    response = api_client.get("/api/v1/data", params={"nodeid": [3, 1, 2], "limit": 2})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    body = response.json()
+    assert [(node["nodeid"], node["tagname"], len(node["history"])) for node in body] == [(1, "tag1", 2), (2, "tag2", 1), (3, "tag3", 1)]
+    assert all(set(record) == set(HISTORY_FIELDS) for node in body for record in node["history"])
+    first = body[0]["history"][0]
+    assert (first["time"], first["valdouble"], first["appid"], first["recordtype"]) == ("2024-01-01T00:02:00", 1.0, str(APP), "R")
+    assert body[1]["history"][0]["valint"] == -5 and body[1]["history"][0]["valdouble"] is None
+    assert body[2]["history"][0]["valstring"] == "on" and body[2]["history"][0]["quality"] is None
+    # Без повторной проверки через Pydantic тело то же, что дала бы NodeSchema
+    schema = TypeAdapter(List[NodeSchema])
+    assert schema.dump_python(schema.validate_json(response.content), mode="json") == body
+
+    response = api_client.get("/api/v1/data", params={"nodeid": 1, "date_to": (START - timedelta(days=1)).isoformat()})
+    assert response.status_code == 200 and response.content == b"[]"